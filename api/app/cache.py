@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache backed by Redis, with a local in-memory fallback tier.
+
+Cached responses are stored as their serialized JSON body together with an ETag, so a hit costs
+a single Redis GET and no serialization, and clients revalidating with `If-None-Match` receive a
+bodiless 304. Keys holding patient data are namespaced by data source (see `patient_key`), so a
+user can never be served another source's data.
+
+When Redis is disabled (`CACHE_ENABLE=false`) or unreachable, entries live in a small per-process
+LRU instead. Invalidations cannot reach Redis while it is down, so the local tier keeps short
+timeouts and Redis entries expire after `CACHE_DEFAULT_TIMEOUT` at most.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fhir_utils import codec
+from loguru import logger
+from redis import asyncio as redis
+from redis.exceptions import RedisError
+
+from app import config
+
+KEY_PREFIX = "fhir-api"
+
+
+class CacheEntry:
+    """A serialized JSON response body and its ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes, etag: str = None):
+        self.body = body
+        self.etag = etag or f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+    def dump(self) -> bytes:
+        return self.etag.encode() + b"\n" + self.body
+
+    @classmethod
+    def load(cls, data: bytes) -> "CacheEntry":
+        etag, _, body = data.partition(b"\n")
+        return cls(body, etag.decode())
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """Whether the `If-None-Match` header value matches this entry"""
+        if not if_none_match:
+            return False
+        etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+        return "*" in etags or self.etag in etags
+
+    def to_response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if self.matches(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
+
+class LocalCache:
+    """Bounded in-memory LRU with per-entry timeouts"""
+
+    def __init__(self, max_entries: int = 1024, max_timeout: int = 60):
+        self.max_entries = max_entries
+        self.max_timeout = max_timeout
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def get(self, key: str) -> bytes | None:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, data = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    def set(self, key: str, data: bytes, timeout: int) -> None:
+        self._entries[key] = (time.monotonic() + min(timeout, self.max_timeout), data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: Redis, falling back to a `LocalCache` when Redis is disabled or
+    failing.
+
+    Args:
+        redis_client (redis.Redis, optional): Async Redis client. Defaults to None (local only).
+        default_timeout (int): Seconds entries are kept.
+        local (LocalCache, optional): The fallback tier.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis | None,
+        default_timeout: int,
+        local: LocalCache = None,
+    ):
+        self.redis = redis_client
+        self.default_timeout = default_timeout
+        self.local = local or LocalCache()
+
+    async def get(self, key: str) -> CacheEntry | None:
+        key = f"{KEY_PREFIX}:{key}"
+        data = None
+        if self.redis is not None:
+            try:
+                data = await self.redis.get(key)
+            except RedisError as exc:
+                logger.warning(f"Response cache unavailable, using the local tier: {exc}")
+                data = self.local.get(key)
+        else:
+            data = self.local.get(key)
+        return CacheEntry.load(data) if data is not None else None
+
+    async def set(self, key: str, content: Any, timeout: int = None) -> CacheEntry:
+        """Serialize and store `content`, returning the new entry"""
+        entry = CacheEntry(codec.dumps(jsonable_encoder(content)))
+        key, timeout = f"{KEY_PREFIX}:{key}", timeout or self.default_timeout
+        if self.redis is not None:
+            try:
+                await self.redis.set(key, entry.dump(), ex=timeout)
+                return entry
+            except RedisError as exc:
+                logger.warning(f"Response cache unavailable, using the local tier: {exc}")
+        self.local.set(key, entry.dump(), timeout)
+        return entry
+
+    async def delete(self, *keys: str) -> None:
+        if not keys:
+            return
+        keys = [f"{KEY_PREFIX}:{key}" for key in keys]
+        # The local tier may hold entries written while Redis was unavailable.
+        self.local.delete(*keys)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(*keys)
+            except RedisError as exc:
+                logger.warning(f"Unable to invalidate the response cache: {exc}")
+
+    async def delete_prefix(self, prefix: str, batch_size: int = 1000) -> None:
+        """
+        Delete every entry whose key starts with `prefix`. Redis keys are found with SCAN, which
+        walks the whole keyspace, so this is meant for rare writes, e.g. to the entity tables.
+        """
+        prefix = f"{KEY_PREFIX}:{prefix}"
+        self.local.delete_prefix(prefix)
+        if self.redis is None:
+            return
+        try:
+            keys = []
+            async for key in self.redis.scan_iter(match=f"{prefix}*", count=batch_size):
+                keys.append(key)
+                if len(keys) == batch_size:
+                    await self.redis.unlink(*keys)
+                    keys = []
+            if keys:
+                await self.redis.unlink(*keys)
+        except RedisError as exc:
+            logger.warning(f"Unable to invalidate the response cache: {exc}")
+
+    async def respond(
+        self, request: Request, key: str, build: Callable[[], Awaitable[Any]]
+    ) -> Response:
+        """Answer from the cache, building and storing the content on a miss"""
+        entry = await self.get(key)
+        if entry is None:
+            entry = await self.set(key, await build())
+        return entry.to_response(request)
+
+
+def entities_key(entity: str) -> str:
+    """Key of the `/entities/{entity}` list, shared by every user"""
+    return f"entities:{entity}"
+
+
+PATIENTS_PREFIX = "patients:"
+
+
+def patient_key(data_source_id, cpf: str) -> str:
+    """Key of a patient read, namespaced by data source"""
+    return f"{PATIENTS_PREFIX}{data_source_id}:{cpf}"
+
+
+def _redis_client() -> redis.Redis | None:
+    if not config.CACHE_ENABLE:
+        return None
+    return redis.Redis(
+        host=config.CACHE_REDIS_HOST,
+        port=config.CACHE_REDIS_PORT,
+        password=config.CACHE_REDIS_PASSWORD,
+        db=config.CACHE_REDIS_DB,
+        socket_timeout=1,
+    )
+
+
+response_cache = ResponseCache(_redis_client(), config.CACHE_DEFAULT_TIMEOUT)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+One-off compaction of the addresses and telecoms stored before they were deduplicated.
+
+Patient writes share addresses and telecoms by content hash (see `app.models.content_hash`), but
+rows written before that have no hash and one copy per period. `compact` hashes those rows,
+merges each group of duplicates into a single row, rewires the periods of the merged rows to it,
+drops the periods made redundant by the merge, and deletes the addresses and telecoms no period
+uses anymore. It can run again at any time. It can also run while patients are being written: at
+worst, a write reusing an unused row as it is deleted fails, and can be retried.
+
+Usage:
+    python scripts/compact_addresses_telecoms.py
+"""
+from typing import Type
+
+from loguru import logger
+from tortoise.expressions import Subquery
+from tortoise.models import Model
+from tortoise.transactions import in_transaction
+
+from app.models import (
+    PERIOD_ITEM_KEY_FIELDS,
+    Address,
+    AddressPatientPeriod,
+    Telecom,
+    TelecomPatientPeriod,
+    item_content_hash,
+)
+
+ITEM_MODELS: dict[str, tuple[Type[Model], Type[Model]]] = {
+    "address": (Address, AddressPatientPeriod),
+    "telecom": (Telecom, TelecomPatientPeriod),
+}
+
+
+class _Row:
+    """Attribute access to a `values()` row, for `item_content_hash`"""
+
+    def __init__(self, values: dict):
+        self.__dict__.update(values)
+
+
+async def compact(item_field: str, batch_size: int = 1000) -> dict[str, int]:
+    """
+    Compact the addresses or telecoms (`item_field`).
+
+    Returns:
+        dict: How many rows were hashed, merged into another row and deleted for being unused,
+            and how many redundant periods were deleted.
+    """
+    item_model, period_model = ITEM_MODELS[item_field]
+    item_id_field = f"{item_field}_id"
+    counts = {"hashed": 0, "merged": 0, "periods_deleted": 0, "unused_deleted": 0}
+
+    # Every batch hashes or deletes all of its rows, so the loop ends.
+    while (
+        rows := await item_model.filter(content_hash=None)
+        .limit(batch_size)
+        .values("id", *PERIOD_ITEM_KEY_FIELDS[item_field])
+    ):
+        hashes = {row["id"]: item_content_hash(item_field, _Row(row)) for row in rows}
+        canonical = dict(
+            await item_model.filter(content_hash__in=set(hashes.values())).values_list(
+                "content_hash", "id"
+            )
+        )
+        to_hash, merged = [], {}
+        for item_id, item_hash in hashes.items():
+            if item_hash in canonical:
+                merged.setdefault(canonical[item_hash], []).append(item_id)
+            else:
+                canonical[item_hash] = item_id
+                to_hash.append(item_model(id=item_id, content_hash=item_hash))
+
+        async with in_transaction():
+            duplicate_ids = [item_id for item_ids in merged.values() for item_id in item_ids]
+            for canonical_id, item_ids in merged.items():
+                await period_model.filter(**{f"{item_id_field}__in": item_ids}).update(
+                    **{item_id_field: canonical_id}
+                )
+            if duplicate_ids:
+                await item_model.filter(id__in=duplicate_ids).delete()
+            if to_hash:
+                await item_model.bulk_update(to_hash, fields=["content_hash"])
+            counts["periods_deleted"] += await _delete_redundant_periods(
+                period_model, item_id_field, list(merged)
+            )
+        counts["hashed"] += len(to_hash)
+        counts["merged"] += len(duplicate_ids)
+
+    counts["unused_deleted"] = await _delete_unused(item_model, period_model, item_field)
+    logger.info(f"Compacted {item_field} rows: {counts}")
+    return counts
+
+
+async def _delete_redundant_periods(
+    period_model: Type[Model], item_id_field: str, item_ids: list
+) -> int:
+    """Delete the periods repeating another period of the same patient, item and dates"""
+    if not item_ids:
+        return 0
+    seen, redundant = set(), []
+    periods = await period_model.filter(**{f"{item_id_field}__in": item_ids}).values_list(
+        "id", "patient_id", item_id_field, "period_start", "period_end"
+    )
+    for period_id, *key in periods:
+        if tuple(key) in seen:
+            redundant.append(period_id)
+        seen.add(tuple(key))
+    if redundant:
+        await period_model.filter(id__in=redundant).delete()
+    return len(redundant)
+
+
+async def _delete_unused(
+    item_model: Type[Model], period_model: Type[Model], item_field: str
+) -> int:
+    """Delete the addresses or telecoms without periods, left behind by patient updates"""
+    used = period_model.all().values_list(f"{item_field}_id", flat=True)
+    unused_ids = await item_model.exclude(id__in=Subquery(used)).values_list("id", flat=True)
+    if unused_ids:
+        await item_model.filter(id__in=unused_ids).delete()
+    return len(unused_ids)
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
+import os
 from secrets import token_bytes
 
-from . import getenv_or_action
+from . import getenv_list_or_action, getenv_or_action
 
 # Logging
 LOG_LEVEL = getenv_or_action("LOG_LEVEL", default="INFO")
@@ -13,6 +14,47 @@ JWT_ACCESS_TOKEN_EXPIRE_MINUTES = int(
     getenv_or_action("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", default="30")
 )
 
+# Pagination
+PAGE_SIZE_DEFAULT = int(getenv_or_action("PAGE_SIZE_DEFAULT", default="100"))
+PAGE_SIZE_MAX = int(getenv_or_action("PAGE_SIZE_MAX", default="1000"))
+EXPORT_BATCH_SIZE = int(getenv_or_action("EXPORT_BATCH_SIZE", default="1000"))
+
+# Bulk ingestion
+BULK_MAX_PATIENTS = int(getenv_or_action("BULK_MAX_PATIENTS", default="10000"))
+
+# Reference entities cache
+LOOKUP_CACHE_TTL = int(getenv_or_action("LOOKUP_CACHE_TTL", default="300"))
+
+# Password hashing threads
+PASSWORD_HASH_WORKERS = int(
+    getenv_or_action("PASSWORD_HASH_WORKERS", default=str(max(1, (os.cpu_count() or 2) // 2)))
+)
+
+# Authenticated principals cache
+PRINCIPAL_CACHE_TTL = int(getenv_or_action("PRINCIPAL_CACHE_TTL", default="60"))
+
+# Golden records (see app/golden.py)
+GOLDEN_RECORD_SOURCE_PRIORITY = getenv_list_or_action(
+    "GOLDEN_RECORD_SOURCE_PRIORITY", action="ignore"
+)
+GOLDEN_RECORD_RULE = getenv_or_action("GOLDEN_RECORD_RULE", default="most_recent")
+# Comma-separated "field:rule" pairs, e.g. "name:source_priority,birth_date:source_priority".
+GOLDEN_RECORD_FIELD_RULES = dict(
+    field_rule.split(":", 1)
+    for field_rule in getenv_list_or_action("GOLDEN_RECORD_FIELD_RULES", action="ignore")
+)
+
+# FHIR store sync (see app/sync.py), only required by scripts/sync_fhir_store.py
+FHIR_SYNC_PROJECT_ID = getenv_or_action("FHIR_SYNC_PROJECT_ID", action="ignore")
+FHIR_SYNC_LOCATION = getenv_or_action("FHIR_SYNC_LOCATION", action="ignore")
+FHIR_SYNC_DATASET_ID = getenv_or_action("FHIR_SYNC_DATASET_ID", action="ignore")
+FHIR_SYNC_FHIR_STORE_ID = getenv_or_action("FHIR_SYNC_FHIR_STORE_ID", action="ignore")
+# Data source of the patients pulled from the FHIR store.
+FHIR_SYNC_DATA_SOURCE = getenv_or_action("FHIR_SYNC_DATA_SOURCE", default="fhir-store")
+FHIR_SYNC_BATCH_SIZE = int(getenv_or_action("FHIR_SYNC_BATCH_SIZE", default="100"))
+FHIR_SYNC_INTERVAL = int(getenv_or_action("FHIR_SYNC_INTERVAL", default="30"))  # seconds
+FHIR_SYNC_RETENTION_DAYS = int(getenv_or_action("FHIR_SYNC_RETENTION_DAYS", default="7"))
+
 # Timezone configuration
 TIMEZONE = "America/Sao_Paulo"
 
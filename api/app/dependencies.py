@@ -7,12 +7,24 @@ from jose import JWTError, jwt
 
 from app import config
 from app.models import User
+from app.principals import PrincipalCache
 from app.pydantic_models import TokenData
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+principals = PrincipalCache(ttl=config.PRINCIPAL_CACHE_TTL)
+
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    """
+    Return the user authenticated by `token`, with its `data_source` fetched.
+
+    Principals are cached by token (see `app.principals`), so repeated requests with the same
+    token neither decode it again nor query the database.
+    """
+    user = principals.get(token)
+    if user is not None:
+        return user
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -26,7 +38,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = await User.get_or_none(username=token_data.username)
+    user = await principals.load(token, token_data.username, payload.get("exp"))
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Survivorship rules, merging the records a patient has in every data source into a single golden
+record.
+
+Each field of the golden record is taken from the first record, in the order given by the
+field's rule, where it is set:
+
+- "most_recent": the most recently written record first.
+- "source_priority": records from the data sources listed in `GOLDEN_RECORD_SOURCE_PRIORITY`
+  first, in that order, then the other records, most recent first.
+
+Addresses and telecoms are not picked but merged: the golden record has the entries of every
+record, in the order of the rule, without repeating an entry present in several records.
+"""
+from datetime import datetime
+
+from app.pydantic_models import PatientModel
+
+MOST_RECENT = "most_recent"
+SOURCE_PRIORITY = "source_priority"
+RULES = (MOST_RECENT, SOURCE_PRIORITY)
+
+# Fields merged from every record instead of picked from one.
+LIST_FIELDS = ("address", "telecom")
+# Fields equal in every record, or meaningless in the golden record.
+SKIPPED_FIELDS = ("cpf", "data_source_name")
+
+
+class Survivorship:
+    """
+    Survivorship rules.
+
+    Args:
+        source_priority (list[str], optional): Data source names, most trusted first.
+        default_rule (str, optional): Rule of the fields missing from `field_rules`. Defaults to
+            "most_recent".
+        field_rules (dict[str, str], optional): Rule of specific fields, by field name.
+
+    Raises:
+        ValueError: If a rule or a field is unknown.
+    """
+
+    def __init__(
+        self,
+        source_priority: list[str] = (),
+        default_rule: str = MOST_RECENT,
+        field_rules: dict[str, str] = None,
+    ):
+        field_rules = field_rules or {}
+        for field, rule in {None: default_rule, **field_rules}.items():
+            if rule not in RULES:
+                raise ValueError(f'Unknown survivorship rule "{rule}".')
+            if field is not None and field not in PatientModel.model_fields:
+                raise ValueError(f'Unknown patient field "{field}".')
+        self.source_priority = {name: rank for rank, name in enumerate(source_priority)}
+        self.default_rule = default_rule
+        self.field_rules = field_rules
+
+    def _rank(self, records: list[tuple[PatientModel, datetime]], rule: str) -> list[PatientModel]:
+        records = sorted(records, key=lambda record: record[1], reverse=True)
+        if rule == SOURCE_PRIORITY:
+            unlisted = len(self.source_priority)
+            records.sort(
+                key=lambda record: self.source_priority.get(record[0].data_source_name, unlisted)
+            )
+        return [patient for patient, _ in records]
+
+    def merge(
+        self, records: list[tuple[PatientModel, datetime]]
+    ) -> tuple[PatientModel, dict[str, str]]:
+        """
+        Merge the records of a patient, given with the time they were last written.
+
+        Returns:
+            tuple[PatientModel, dict[str, str]]: The golden record, and the data source each of
+                its picked fields comes from.
+        """
+        rankings = {rule: self._rank(records, rule) for rule in RULES}
+        values, sources = {"cpf": records[0][0].cpf}, {}
+        for field in PatientModel.model_fields:
+            if field in SKIPPED_FIELDS:
+                continue
+            ranked = rankings[self.field_rules.get(field, self.default_rule)]
+            if field in LIST_FIELDS:
+                values[field] = _union(getattr(patient, field) for patient in ranked)
+                continue
+            for patient in ranked:
+                value = getattr(patient, field)
+                if value is not None:
+                    values[field] = value
+                    sources[field] = patient.data_source_name
+                    break
+        return PatientModel(**values), sources
+
+
+def _union(entry_lists) -> list:
+    """Concatenate the address or telecom lists, skipping entries equal but for their period"""
+    seen, merged = set(), []
+    for entries in entry_lists:
+        for entry in entries or ():
+            key = entry.model_dump_json(exclude={"period"})
+            if key not in seen:
+                seen.add(key)
+                merged.append(entry)
+    return merged
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+In-process cache of the reference tables (genders, races, cities, data sources...).
+
+These tables are tiny and nearly static, yet every patient read or write needs them. The cache
+loads each table with a single query and serves lookups from memory until it is invalidated (the
+`/entities` routes do it after every write) or its TTL expires. The TTL bounds how long other
+worker processes, which do not see the invalidation, can serve stale entries.
+"""
+import time
+from typing import Hashable, Type
+
+from tortoise.models import Model
+
+
+def _get_path(instance: Model, path: str):
+    for attribute in path.split("__"):
+        instance = getattr(instance, attribute)
+    return instance
+
+
+class LookupTables:
+    """An immutable snapshot of the reference tables"""
+
+    def __init__(self, version: int, keys: dict, instances: dict[Type[Model], list[Model]]):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self._by_id = {}
+        self._by_key = {}
+        for model, instances_list in instances.items():
+            self._by_id[model] = {instance.pk: instance for instance in instances_list}
+            paths = keys[model]
+            if isinstance(paths, str):
+                self._by_key[model] = {_get_path(i, paths): i for i in instances_list}
+            else:
+                self._by_key[model] = {
+                    tuple(_get_path(i, path) for path in paths): i for i in instances_list
+                }
+
+    def get(self, model: Type[Model], key: Hashable) -> Model | None:
+        """Return the `model` instance with the given slug, name or key tuple"""
+        if not key:
+            return None
+        return self._by_key[model].get(key)
+
+    def keys(self, model: Type[Model]) -> list[Hashable]:
+        """Return the slugs, names or key tuples of the `model` instances"""
+        return list(self._by_key[model])
+
+    def get_by_id(self, model: Type[Model], pk) -> Model | None:
+        if pk is None:
+            return None
+        return self._by_id[model].get(pk)
+
+    def resolve(self, instance: Model, *fields: str) -> bool:
+        """
+        Set the foreign keys `fields` of `instance` to the cached related instances.
+
+        Returns:
+            bool: False if a related instance is missing from the snapshot.
+        """
+        found = True
+        for field in fields:
+            related_model = instance._meta.fields_map[field].related_model
+            pk = getattr(instance, f"{field}_id")
+            related = self.get_by_id(related_model, pk)
+            if pk is not None and related is None:
+                found = False
+                continue
+            # Tortoise keeps fetched relations in "_<field>", leaving "<field>_id" untouched.
+            setattr(instance, f"_{field}", related)
+        return found
+
+
+class LookupCache:
+    """
+    Versioned cache of reference tables.
+
+    Args:
+        keys (dict): The key of each cached model: a field name (e.g. "slug"), or a tuple of
+            field paths for composite keys (e.g. ("name", "state__name")). Relations used in
+            the paths are fetched along with the table.
+        ttl (float): Seconds after which the tables are reloaded even without invalidation.
+    """
+
+    def __init__(self, keys: dict[Type[Model], str | tuple[str, ...]], ttl: float):
+        self.keys = keys
+        self.ttl = ttl
+        self.version = 0
+        self._tables: LookupTables | None = None
+
+    async def load(self) -> LookupTables:
+        """Load every table, one query each"""
+        version = self.version
+        instances = {}
+        for model, paths in self.keys.items():
+            paths = (paths,) if isinstance(paths, str) else paths
+            relations = {path.rsplit("__", 1)[0] for path in paths if "__" in path}
+            instances[model] = await model.all().select_related(*relations)
+        # If the cache was invalidated while loading, these tables are already stale and their
+        # version tells `get` to load them again.
+        self._tables = LookupTables(version, self.keys, instances)
+        return self._tables
+
+    async def get(self) -> LookupTables:
+        """Return the current tables, loading them if they were invalidated or expired"""
+        tables = self._tables
+        if (
+            tables is None
+            or tables.version != self.version
+            or time.monotonic() - tables.loaded_at > self.ttl
+        ):
+            tables = await self.load()
+        return tables
+
+    def invalidate(self) -> None:
+        """Mark the tables as stale, after a write to any of them"""
+        self.version += 1
@@ -9,6 +9,8 @@ from tortoise.contrib.fastapi import register_tortoise
 
 from app import config
 from app.db import TORTOISE_ORM
+from app.models import lookups
+from app.responses import CodecJSONResponse
 from app.routers import auth, entities, patients, users
 
 logger.remove()
@@ -23,6 +25,7 @@ if config.SENTRY_ENABLE:
 
 app = FastAPI(
     title="FHIR Parser API",
+    default_response_class=CodecJSONResponse,
 )
 
 logger.debug("Configuring CORS with the following settings:")
@@ -53,3 +56,5 @@ register_tortoise(
     generate_schemas=False,
     add_exception_handlers=True,
 )
+# Warm the reference entities cache once the database connection is up.
+app.add_event_handler("startup", lookups.load)
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
-from tortoise import fields
-from tortoise.exceptions import NoValuesFetched
+import hashlib
+from datetime import date, datetime
+from typing import Iterable, Type
+
+from fhir_utils import PatientMapper
+from tortoise import fields, timezone
+from tortoise.exceptions import IntegrityError
 from tortoise.models import Model
+from tortoise.transactions import in_transaction
 
+from app import config
+from app.cache import patient_key, response_cache
+from app.golden import Survivorship
+from app.lookups import LookupCache, LookupTables
 from app.pydantic_models import (
     AddressModel,
     PatientModel,
@@ -19,32 +29,19 @@ class Address(Model):
     city = fields.ForeignKeyField("app.City", related_name="city")
     # state: contained in city.
     postal_code = fields.CharField(max_length=8, null=True)
-
-    @classmethod
-    async def create_from_pydantic_model(cls, address: AddressModel) -> "Address":
-        # Dump the Pydantic model to a dict.
-        address_data = address.model_dump()
-        # Parse the foreign keys.
-        # - use.
-        if address_data["use"]:
-            address_data["use"] = await AddressUse.get_or_none(slug=address_data.pop("use"))
-        # - type.
-        if address_data["type"]:
-            address_data["type"] = await AddressType.get_or_none(slug=address_data.pop("type"))
-        # - city.
-        address_data["city"] = await City.get_or_none(
-            name=address_data.pop("city"),
-            state__name=address_data.pop("state"),
-            state__country__name=address_data.pop("country"),
-        )
-        # Create the address.
-        return await Address.create(**address_data)
+    # Addresses are shared by every patient record living there (see `content_hash`). Rows created
+    # before deduplication have no hash until `app.compaction` merges them.
+    content_hash = fields.CharField(max_length=32, unique=True, null=True)
 
 
 class AddressPatientPeriod(Model):
     id = fields.UUIDField(pk=True)
-    address = fields.ForeignKeyField("app.Address", related_name="address_patient_periods")
-    patient = fields.ForeignKeyField("app.PatientRecord", related_name="address_patient_periods")
+    address = fields.ForeignKeyField(
+        "app.Address", related_name="address_patient_periods", index=True
+    )
+    patient = fields.ForeignKeyField(
+        "app.PatientRecord", related_name="address_patient_periods", index=True
+    )
     period_start = fields.DateField(null=True)
     period_end = fields.DateField(null=True)
 
@@ -67,11 +64,14 @@ class City(Model):
     state = fields.ForeignKeyField("app.State", related_name="cities")
     # country: contained in state.
 
+    class Meta:
+        indexes = (("state", "name"),)
+
 
 class Cns(Model):
     id = fields.UUIDField(pk=True)
     value = fields.CharField(max_length=16, unique=True)
-    patient = fields.ForeignKeyField("app.PatientRecord", related_name="cnss")
+    patient = fields.ForeignKeyField("app.PatientRecord", related_name="cnss", index=True)
     is_main = fields.BooleanField(default=False)
 
 
@@ -83,7 +83,7 @@ class Country(Model):
 class DataSource(Model):
     # TODO (future): data normalization pipeline will be associated with a data source.
     id = fields.UUIDField(pk=True)
-    name = fields.CharField(max_length=512)
+    name = fields.CharField(max_length=512, unique=True)
 
 
 class Ethnicity(Model):
@@ -98,6 +98,61 @@ class Gender(Model):
     name = fields.CharField(max_length=512)
 
 
+class GoldenRecord(Model):
+    """
+    The golden record of a patient, merging its records by the rules of `app.golden`.
+
+    Patient writes keep it up to date.
+    """
+
+    id = fields.IntField(pk=True)
+    patient = fields.OneToOneField("app.Patient", related_name="golden_record")
+    # A `PatientModel`, without data source.
+    data = fields.JSONField()
+    # The data source of each field of `data` picked from a single record.
+    sources = fields.JSONField()
+    updated_at = fields.DatetimeField()
+
+    @classmethod
+    async def refresh(cls, patient_ids: Iterable) -> None:
+        """
+        Recompute the golden records of the patients `patient_ids` from their current records,
+        with a fixed number of queries.
+
+        Two writes of the same patient from different data sources, concurrent with each other,
+        may leave its golden record with only one of them until the patient is written again;
+        `scripts/rebuild_golden_records.py` recomputes every golden record.
+        """
+        patient_ids = set(patient_ids)
+        if not patient_ids:
+            return
+        records = await PatientRecord.filter(patient_id__in=list(patient_ids))
+        candidates: dict = {}
+        for record, patient in zip(records, await PatientRecord.to_pydantic_models(records)):
+            candidates.setdefault(record.patient_id, []).append((patient, record.updated_at))
+
+        now = timezone.now()
+        golden_records = []
+        for patient_id, patient_records in candidates.items():
+            patient, sources = survivorship.merge(patient_records)
+            golden_records.append(
+                cls(
+                    patient_id=patient_id,
+                    data=patient.model_dump(mode="json", exclude={"data_source_name"}),
+                    sources=sources,
+                    updated_at=now,
+                )
+            )
+        if golden_records:
+            await cls.bulk_create(
+                golden_records,
+                on_conflict=("patient_id",),
+                update_fields=("data", "sources", "updated_at"),
+            )
+        if patient_ids - candidates.keys():
+            await cls.filter(patient_id__in=list(patient_ids - candidates.keys())).delete()
+
+
 class Nationality(Model):
     id = fields.UUIDField(pk=True)
     slug = fields.CharField(max_length=32, unique=True)
@@ -109,13 +164,36 @@ class Patient(Model):
     cpf = fields.CharField(max_length=11, unique=True)
 
 
+class PatientChange(Model):
+    """
+    A write of a patient record, waiting in the outbox to be pushed to the FHIR store.
+
+    Rows are created in the transaction of the write, so no write is lost if the process crashes,
+    and pushed by `app.sync.FhirSync` in `id` order. Pushed rows keep the FHIR version they
+    produced, to recognize it when it is pulled back.
+    """
+
+    id = fields.IntField(pk=True)
+    record = fields.ForeignKeyField("app.PatientRecord", related_name="changes", index=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    pushed_at = fields.DatetimeField(null=True)
+    fhir_version_id = fields.CharField(max_length=64, null=True, index=True)
+    # Failed pushes, retried after the changes that did not fail yet.
+    attempts = fields.IntField(default=0)
+    error = fields.TextField(null=True)
+
+    class Meta:
+        # The sync worker claims the pending changes in (attempts, id) order.
+        indexes = (("pushed_at", "attempts", "id"),)
+
+
 class PatientRecord(Model):
     patient = fields.ForeignKeyField("app.Patient", related_name="patient")
     data_source = fields.ForeignKeyField("app.DataSource", related_name="data_source")
 
     active = fields.BooleanField(default=True)
     birth_city = fields.ForeignKeyField("app.City", related_name="birth_patients", null=True)
-    birth_date = fields.DateField()
+    birth_date = fields.DateField(index=True)
     deceased = fields.BooleanField(default=False)
     deceased_date = fields.DateField(null=True)
     ethnicity = fields.ForeignKeyField("app.Ethnicity", related_name="ethnicity", null=True)
@@ -127,262 +205,569 @@ class PatientRecord(Model):
     naturalization = fields.CharField(max_length=512, null=True)
     protected_person = fields.BooleanField(null=True)
     race = fields.ForeignKeyField("app.Race", related_name="race", null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    updated_at = fields.DatetimeField(auto_now=True)
 
     class Meta:
         unique_together = (("patient", "data_source"),)
+        # Keyset pagination of `GET /patients` walks `id` within a data source or an update window.
+        indexes = (("data_source", "id"), ("updated_at", "id"))
 
     @classmethod
-    async def create_from_pydantic_model(cls, patient: PatientModel) -> "PatientRecord":
-        # Dump the Pydantic model to a dict.
-        patient_data = patient.model_dump()
-        # Check if the patient already exists using the CPF
-        patient_cpf = patient_data.pop("cpf")
-
-        patient_obj: Patient = await Patient.get_or_none(cpf=patient_cpf)
-        if not patient_obj:
-            patient_obj = await Patient.create(cpf=patient_cpf)
-        patient_data["patient"] = patient_obj
-
-        # Start by parsing the address.
-        raw_addresses = patient.address
-        addresses: list[Address] = []
-        if raw_addresses:
-            for address in raw_addresses:
-                address_obj: Address = await Address.create_from_pydantic_model(address)
-                addresses.append(address_obj)
-        # Parse the telecom.
-        raw_telecoms = patient.telecom
-        telecoms: list[Telecom] = []
-        if raw_telecoms:
-            for telecom in raw_telecoms:
-                telecom_obj: Telecom = await Telecom.create_from_pydantic_model(telecom)
-                telecoms.append(telecom_obj)
-        # Now parse the foreign keys.
-        # - birth_city.
-        if (
-            patient_data["birth_city"]
-            and patient_data["birth_state"]
-            and patient_data["birth_country"]
-        ):
-            patient_data["birth_city"] = await City.get_or_none(
-                name=patient_data.pop("birth_city"),
-                state__name=patient_data.pop("birth_state"),
-                state__country__name=patient_data.pop("birth_country"),
+    async def upsert_from_pydantic_model(
+        cls, patient: PatientModel
+    ) -> tuple["PatientRecord", bool]:
+        """
+        Create or update the record of `patient` for its data source.
+
+        Raises:
+            ValueError: If the patient cannot be written (see `upsert_from_pydantic_models`).
+
+        Returns:
+            tuple[PatientRecord, bool]: The record, and whether it was created.
+        """
+        written, errors = await cls.upsert_from_pydantic_models([patient])
+        if errors:
+            raise ValueError(errors[0])
+        record_id, created = written[0]
+        return await cls.get(id=record_id), created
+
+    @classmethod
+    async def upsert_from_pydantic_models(
+        cls, patients: list[PatientModel], record_changes: bool = True
+    ) -> tuple[dict[int, tuple[int, bool]], dict[int, str]]:
+        """
+        Create or update many patient records at once, atomically and idempotently.
+
+        Records are matched by CPF and data source and written with INSERT ... ON CONFLICT, so
+        sending a patient again updates its record in place. Addresses and telecoms are diffed
+        against the stored ones: unchanged entries are kept and only the stale or missing ones
+        are deleted or inserted.
+
+        Reference entities are resolved from the lookup cache and existing rows with set-based
+        queries, and every table is written with bulk statements inside a single transaction, so
+        the number of queries does not depend on the number of patients. Patients that cannot be
+        written (unknown data source or address city, repeated in the request, CNS assigned to
+        another record) are skipped and reported. The CNS owners are checked in the transaction
+        that writes them, so concurrent requests cannot assign one CNS to two records.
+
+        Every written record gets a `PatientChange` in the outbox of the FHIR store sync, unless
+        `record_changes` is False, e.g. for the records pulled from the FHIR store itself. The
+        cached reads of the written records are invalidated.
+
+        Returns:
+            tuple[dict[int, tuple[int, bool]], dict[int, str]]: The id of each written record and
+                whether it was created, and the error of each skipped patient, both keyed by the
+                index of the patient.
+        """
+        tables = await lookups.get()
+        if not all(_lookups_found(tables, patient) for patient in patients):
+            # Entities may have been created by another process since the tables were loaded.
+            lookups.invalidate()
+            tables = await lookups.get()
+        try:
+            return await cls._upsert(patients, tables, record_changes)
+        except IntegrityError:
+            # A concurrent writer assigned one of the new CNSs first and the transaction was
+            # rolled back: writing again reports that CNS as assigned to another record.
+            return await cls._upsert(patients, tables, record_changes)
+
+    @classmethod
+    async def _upsert(
+        cls, patients: list[PatientModel], tables: LookupTables, record_changes: bool
+    ) -> tuple[dict[int, tuple[int, bool]], dict[int, str]]:
+        errors: dict[int, str] = {}
+        async with in_transaction():
+            patients_by_cpf = await _lookup(Patient, "cpf", (p.cpf for p in patients))
+            # Records are identified by (cpf, data source id) until they have an id.
+            stored_records = {
+                (cpf, data_source_id): record_id
+                for record_id, cpf, data_source_id in await PatientRecord.filter(
+                    patient__cpf__in=list(patients_by_cpf)
+                ).values_list("id", "patient__cpf", "data_source_id")
+            }
+            # Lock the CNSs sent, so that none changes owner before this transaction commits.
+            # Those owned by records of other CPFs map to None.
+            record_keys = {record_id: key for key, record_id in stored_records.items()}
+            cns_owners = {
+                cns.value: record_keys.get(cns.patient_id)
+                for cns in await Cns.filter(
+                    value__in=[p.cns for p in patients if p.cns]
+                ).select_for_update()
+            }
+
+            # Validate every patient before writing anything.
+            valid, new_cnss = [], []
+            for index, patient in enumerate(patients):
+                data_source = tables.get(DataSource, patient.data_source_name)
+                key = (patient.cpf, data_source.id if data_source else None)
+                unknown_cities = [
+                    f"{address.city}/{address.state}/{address.country}"
+                    for address in patient.address or []
+                    if not tables.get(City, (address.city, address.state, address.country))
+                ]
+                if data_source is None:
+                    errors[index] = f'Unknown data source "{patient.data_source_name}".'
+                elif any(key == valid_key for _, _, valid_key in valid):
+                    errors[index] = "Patient is repeated in the request."
+                elif unknown_cities:
+                    errors[index] = f"Unknown address city: {', '.join(unknown_cities)}."
+                elif patient.cns and cns_owners.get(patient.cns, key) != key:
+                    errors[index] = f'CNS "{patient.cns}" is assigned to another patient record.'
+                else:
+                    if patient.cns and patient.cns not in cns_owners:
+                        cns_owners[patient.cns] = key
+                        new_cnss.append((key, patient.cns))
+                    valid.append((index, patient, key))
+            if not valid:
+                return {}, errors
+
+            new_cpfs = {patient.cpf for _, patient, _ in valid} - patients_by_cpf.keys()
+            if new_cpfs:
+                # A concurrent writer may insert the same CPFs first: use whichever row won.
+                await Patient.bulk_create(
+                    [Patient(cpf=cpf) for cpf in new_cpfs], ignore_conflicts=True
+                )
+                patients_by_cpf.update(await _lookup(Patient, "cpf", new_cpfs))
+
+            records = []
+            for _, patient, (cpf, data_source_id) in valid:
+                birth_city_key = (patient.birth_city, patient.birth_state, patient.birth_country)
+                records.append(
+                    PatientRecord(
+                        patient_id=patients_by_cpf[cpf].id,
+                        data_source_id=data_source_id,
+                        active=patient.active,
+                        birth_city=tables.get(City, birth_city_key),
+                        birth_date=patient.birth_date,
+                        deceased=patient.deceased,
+                        ethnicity=tables.get(Ethnicity, patient.ethnicity),
+                        father_name=patient.father,
+                        gender=tables.get(Gender, patient.gender),
+                        mother_name=patient.mother,
+                        name=patient.name,
+                        nationality=tables.get(Nationality, patient.nationality),
+                        naturalization=patient.naturalization,
+                        protected_person=patient.protected_person,
+                        race=tables.get(Race, patient.race),
+                    )
+                )
+            await PatientRecord.bulk_create(
+                records,
+                on_conflict=("patient_id", "data_source_id"),
+                update_fields=PATIENT_RECORD_UPSERT_FIELDS,
             )
-        else:
-            patient_data.pop("birth_city")
-            patient_data.pop("birth_state")
-            patient_data.pop("birth_country")
-        # - data_source.
-        patient_data["data_source"] = await DataSource.get_or_none(
-            name=patient_data.pop("data_source_name")
-        )
-        # - ethnicity.
-        if patient_data["ethnicity"]:
-            patient_data["ethnicity"] = await Ethnicity.get_or_none(
-                name=patient_data.pop("ethnicity")
+            # Bulk inserts do not return the generated serial ids, so read them back in one query.
+            record_ids = {
+                (cpf, data_source_id): record_id
+                for record_id, cpf, data_source_id in await PatientRecord.filter(
+                    patient__cpf__in=[cpf for _, _, (cpf, _) in valid]
+                ).values_list("id", "patient__cpf", "data_source_id")
+            }
+            if record_changes:
+                await PatientChange.bulk_create(
+                    [PatientChange(record_id=record_ids[key]) for _, _, key in valid]
+                )
+
+            # The CNS sent becomes the main one of its record; the record keeps its former CNSs,
+            # which stay assigned to the patient, as secondary ones.
+            main_cnss = {record_ids[key]: patient.cns for _, patient, key in valid if patient.cns}
+            if main_cnss:
+                await Cns.filter(patient_id__in=list(main_cnss), is_main=True).exclude(
+                    value__in=list(main_cnss.values())
+                ).update(is_main=False)
+                await Cns.filter(
+                    patient_id__in=list(main_cnss),
+                    value__in=list(main_cnss.values()),
+                    is_main=False,
+                ).update(is_main=True)
+            # New CNSs cannot be locked: the unique constraint rejects one inserted concurrently.
+            await Cns.bulk_create(
+                [
+                    Cns(patient_id=record_ids[key], value=value, is_main=True)
+                    for key, value in new_cnss
+                ]
             )
-        # - father_name.
-        if patient_data["father"]:
-            patient_data["father_name"] = patient_data.pop("father")
-        # - gender.
-        patient_data["gender"] = await Gender.get_or_none(
-            slug=patient_data.pop("gender")
-        )
-        # - mother_name.
-        if patient_data["mother"]:
-            patient_data["mother_name"] = patient_data.pop("mother")
-        # - nationality.
-        if patient_data["nationality"]:
-            patient_data["nationality"] = await Nationality.get_or_none(
-                name=patient_data.pop("nationality")
+            await _sync_patient_periods(
+                AddressPatientPeriod,
+                "address",
+                {
+                    record_ids[key]: [
+                        (
+                            Address(
+                                use=tables.get(AddressUse, address.use),
+                                type=tables.get(AddressType, address.type),
+                                line=address.line,
+                                city=tables.get(
+                                    City, (address.city, address.state, address.country)
+                                ),
+                                postal_code=address.postal_code,
+                            ),
+                            address.period,
+                        )
+                        for address in patient.address or []
+                    ]
+                    for _, patient, key in valid
+                },
             )
-        # - race.
-        if patient_data["race"]:
-            patient_data["race"] = await Race.get_or_none(name=patient_data.pop("race"))
-        # Create the patient.
-        patient_record = await PatientRecord.create(**patient_data)
-
-        patient_cns_value = patient_data.pop("cns")
-        if patient_cns_value:
-            patient_cns : Cns = await Cns.get_or_none(
-                patient=patient_record,
-                value=patient_cns_value
+            await _sync_patient_periods(
+                TelecomPatientPeriod,
+                "telecom",
+                {
+                    record_ids[key]: [
+                        (
+                            Telecom(
+                                system=tables.get(TelecomSystem, telecom.system),
+                                use=tables.get(TelecomUse, telecom.use),
+                                value=telecom.value,
+                                rank=telecom.rank,
+                            ),
+                            telecom.period,
+                        )
+                        for telecom in patient.telecom or []
+                    ]
+                    for _, patient, key in valid
+                },
             )
-            if not patient_cns:
-                await Cns.create(
-                    patient=patient_record,
-                    value=patient_cns_value
-                )
-
-        # Create the address_patient_periods.
-        try:
-            if raw_addresses:
-                for address, raw_address in zip(addresses, raw_addresses):
-
-                    # Verify existance of period value
-                    if not raw_address.period:
-                        period_start = None
-                        period_end = None
-                    else:
-                        period_start = raw_address.period.start
-                        period_end = raw_address.period.end
-
-                    await AddressPatientPeriod.create(
-                        address=address,
-                        patient=patient_record,
-                        period_start=period_start,
-                        period_end=period_end,
-                    )
-        except Exception as exc:
-            await patient_record.delete()
-            raise exc
-        # Create the telecom_patient_periods.
-        try:
-            if raw_telecoms:
-                for telecom, raw_telecom in zip(telecoms, raw_telecoms):
-
-                    # Verify existance of period value
-                    if not raw_telecom.period:
-                        period_start = None
-                        period_end = None
-                    else:
-                        period_start = raw_telecom.period.start
-                        period_end = raw_telecom.period.end
-
-                    await TelecomPatientPeriod.create(
-                        telecom=telecom,
-                        patient=patient_record,
-                        period_start=period_start,
-                        period_end=period_end,
-                    )
-        except Exception as exc:
-            await patient_record.delete()
-            raise exc
-        # Return the patient.
-        return patient_record
+            # In the transaction, so the golden records never lag behind committed records.
+            await GoldenRecord.refresh(patients_by_cpf[patient.cpf].id for _, patient, _ in valid)
+        await response_cache.delete(
+            *(patient_key(data_source_id, cpf) for _, _, (cpf, data_source_id) in valid)
+        )
+        written = {index: (record_ids[key], key not in stored_records) for index, _, key in valid}
+        return written, errors
 
     async def to_pydantic_model(self) -> PatientModel:
-        # Dump the patient.
-        active = self.active
+        return (await PatientRecord.to_pydantic_models([self]))[0]
+
+    @classmethod
+    async def to_pydantic_models(cls, patient_records: list["PatientRecord"]) -> list[PatientModel]:
+        """
+        Serialize a page of patient records.
+
+        Every relation of the page is loaded up front with one query per relation (see
+        `PATIENT_RECORD_RELATIONS`), so the number of queries does not depend on the page size.
+        """
+        await cls._fetch_relations(patient_records)
+        return [patient_record._to_pydantic_model() for patient_record in patient_records]
+
+    @classmethod
+    async def _fetch_relations(cls, patient_records: list["PatientRecord"]) -> None:
+        # Rows owned by the records are fetched in bulk; reference entities come from the cache.
+        if not patient_records:
+            return
+        await cls.fetch_for_list(patient_records, *PATIENT_RECORD_RELATIONS)
+        if not _resolve_lookups(await lookups.get(), patient_records):
+            # Entities were created by another process since the tables were loaded.
+            lookups.invalidate()
+            _resolve_lookups(await lookups.get(), patient_records)
 
+    @classmethod
+    async def to_fhir_resources(cls, patient_records: list["PatientRecord"]) -> list[dict]:
+        """Serialize a page of patient records as FHIR Patient resources, with `patient_mapper`"""
+        await cls._fetch_relations(patient_records)
+        resources = []
+        for patient_record in patient_records:
+            resource = patient_mapper.to_fhir(patient_record._to_fhir_record())
+            if patient_record.deceased_date:
+                del resource["deceasedBoolean"]
+                resource["deceasedDateTime"] = patient_record.deceased_date.isoformat()
+            resources.append(resource)
+        return resources
+
+    def _to_fhir_record(self) -> dict:
+        # The record of `patient_mapper`. Coded values are the keys of the lookup tables, i.e. the
+        # slugs, which follow the FHIR value sets, or the names, so that the resources pulled back
+        # by `app.sync` are written as they are.
+        birth_city = self.birth_city
+        main_cns = next((cns.value for cns in self.cnss if cns.is_main), None)
+        addresses = []
+        for address_patient_period in self.address_patient_periods:
+            address = address_patient_period.address
+            addresses.append(
+                {
+                    "use": address.use.slug if address.use else None,
+                    "type": address.type.slug if address.type else None,
+                    "line": address.line,
+                    "city": address.city.name,
+                    "state": address.city.state.name,
+                    "country": address.city.state.country.name,
+                    "postal_code": address.postal_code,
+                    "period": _period_resource(address_patient_period),
+                }
+            )
+        telecoms = []
+        for telecom_patient_period in self.telecom_patient_periods:
+            telecom = telecom_patient_period.telecom
+            telecoms.append(
+                {
+                    "system": telecom.system.slug if telecom.system else None,
+                    "use": telecom.use.slug if telecom.use else None,
+                    "value": telecom.value,
+                    "rank": telecom.rank,
+                    "period": _period_resource(telecom_patient_period),
+                }
+            )
+        return {
+            "cpf": self.patient.cpf,
+            "cns": main_cns or next((cns.value for cns in self.cnss), None),
+            "data_source_name": self.data_source.name,
+            "active": self.active,
+            "name": self.name,
+            "gender": self.gender.slug if self.gender else None,
+            "birth_date": self.birth_date.isoformat(),
+            "deceased": self.deceased,
+            "mother": self.mother_name,
+            "father": self.father_name,
+            "birth_city": birth_city.name if birth_city else None,
+            "birth_state": birth_city.state.name if birth_city else None,
+            "birth_country": birth_city.state.country.name if birth_city else None,
+            "race": self.race.name if self.race else None,
+            "ethnicity": self.ethnicity.name if self.ethnicity else None,
+            "nationality": self.nationality.name if self.nationality else None,
+            "naturalization": self.naturalization,
+            "protected_person": self.protected_person,
+            "address": addresses,
+            "telecom": telecoms,
+        }
+
+    def _to_pydantic_model(self) -> PatientModel:
+        # Builds the Pydantic model from relations already fetched by `to_pydantic_models`.
         birth_city, birth_state, birth_country = None, None, None
         if self.birth_city:
             birth_city = self.birth_city.name
+            birth_state = self.birth_city.state.name
+            birth_country = self.birth_city.state.country.name
 
-            if self.birth_city.state:
-                state = await self.birth_city.state
-                birth_state = state.name
-
-                if state.country:
-                    country = await state.country
-                    birth_country = country.name
-
-        birth_date = self.birth_date
-        cpf = self.patient.cpf
-        # Iterate over the patient's CNSs. If there is a main CNS, use it. Otherwise, use the first
-        # one.
+        # If there is a main CNS, use it. Otherwise, use the first one.
         cnss = []
-        try:
-            cnss_instances = await self.cnss.all()
-            for cns in cnss_instances:
-                if cns.is_main:
-                    cnss.insert(0, cns.value)
-                else:
-                    cnss.append(cns.value)
-        except NoValuesFetched:
-            pass
-        cns = cnss[0] if cnss else None
-        data_source_name = self.data_source.name
-        deceased = self.deceased
-        ethnicity = self.ethnicity.name if self.ethnicity else None
-        father = self.father_name
-        gender = self.gender.name if self.gender else None
-        mother = self.mother_name
-        name = self.name
-        nationality = self.nationality.name if self.nationality else None
-        naturalization = self.naturalization
-        protected_person = self.protected_person
-        race = self.race.name if self.race else None
+        for cns in self.cnss:
+            if cns.is_main:
+                cnss.insert(0, cns.value)
+            else:
+                cnss.append(cns.value)
+
         # Iterate over the patient's addresses.
         addresses = []
-        try:
-            address_patient_periods_instances = await self.address_patient_periods.all()
-            for address_patient_period in address_patient_periods_instances:
-                address = await address_patient_period.address.prefetch_related('use','type','city', 'city__state', 'city__state__country')
-
-                if address_patient_period.period_start:
-                    period = PeriodModel(
-                        start=address_patient_period.period_start,
-                        end=address_patient_period.period_end,
-                    )
-                else:
-                    period = None
-
-                addresses.append(
-                    AddressModel(
-                        use=address.use.name if address.use else None,
-                        type=address.type.name if address.type else None,
-                        line=address.line,
-                        city=address.city.name,
-                        state=address.city.state.name,
-                        country=address.city.state.country.name,
-                        postal_code=address.postal_code,
-                        period=period,
-                    )
+        for address_patient_period in self.address_patient_periods:
+            address = address_patient_period.address
+            addresses.append(
+                AddressModel(
+                    use=address.use.name if address.use else None,
+                    type=address.type.name if address.type else None,
+                    line=address.line,
+                    city=address.city.name,
+                    state=address.city.state.name,
+                    country=address.city.state.country.name,
+                    postal_code=address.postal_code,
+                    period=_period_model(address_patient_period),
                 )
-        except NoValuesFetched:
-            pass
+            )
         # Iterate over the patient's telecoms.
         telecoms = []
-        try:
-            telecom_patient_period_instances = await self.telecom_patient_periods.all()
-            for telecom_patient_period in telecom_patient_period_instances:
-                telecom = await telecom_patient_period.telecom.prefetch_related('use','system')
-
-                if telecom_patient_period.period_start:
-                    period = PeriodModel(
-                        start=telecom_patient_period.period_start,
-                        end=telecom_patient_period.period_end,
-                    )
-                else:
-                    period = None
-                telecoms.append(
-                    TelecomModel(
-                        system=telecom.system.name if telecom.system else None,
-                        use=telecom.use.name if telecom.use else None,
-                        value=telecom.value,
-                        rank=telecom.rank,
-                        period=period,
-                    )
+        for telecom_patient_period in self.telecom_patient_periods:
+            telecom = telecom_patient_period.telecom
+            telecoms.append(
+                TelecomModel(
+                    system=telecom.system.name if telecom.system else None,
+                    use=telecom.use.name if telecom.use else None,
+                    value=telecom.value,
+                    rank=telecom.rank,
+                    period=_period_model(telecom_patient_period),
                 )
-        except NoValuesFetched:
-            pass
+            )
         # Create the Pydantic model.
         return PatientModel(
-            active=active,
+            active=self.active,
             address=addresses,
             birth_city=birth_city,
             birth_state=birth_state,
             birth_country=birth_country,
-            birth_date=birth_date,
-            cpf=cpf,
-            cns=cns,
-            data_source_name=data_source_name,
-            deceased=deceased,
-            ethnicity=ethnicity,
-            father=father,
-            gender=gender,
-            mother=mother,
-            name=name,
-            nationality=nationality,
-            naturalization=naturalization,
-            protected_person=protected_person,
-            race=race,
+            birth_date=self.birth_date,
+            cpf=self.patient.cpf,
+            cns=cnss[0] if cnss else None,
+            data_source_name=self.data_source.name,
+            deceased=self.deceased,
+            ethnicity=self.ethnicity.name if self.ethnicity else None,
+            father=self.father_name,
+            gender=self.gender.name if self.gender else None,
+            mother=self.mother_name,
+            name=self.name,
+            nationality=self.nationality.name if self.nationality else None,
+            naturalization=self.naturalization,
+            protected_person=self.protected_person,
+            race=self.race.name if self.race else None,
             telecom=telecoms,
         )
 
 
+# Relations needed to serialize a `PatientRecord`, fetched in bulk by `to_pydantic_models`.
+# Reference entities (gender, city, address use...) are resolved from the lookup cache instead.
+PATIENT_RECORD_RELATIONS = (
+    "patient",
+    "cnss",
+    "address_patient_periods__address",
+    "telecom_patient_periods__telecom",
+)
+
+
+def _resolve_lookups(tables: LookupTables, patient_records: list["PatientRecord"]) -> bool:
+    found = True
+    for record in patient_records:
+        found &= tables.resolve(
+            record, "birth_city", "data_source", "ethnicity", "gender", "nationality", "race"
+        )
+        for address_patient_period in record.address_patient_periods:
+            found &= tables.resolve(address_patient_period.address, "use", "type", "city")
+        for telecom_patient_period in record.telecom_patient_periods:
+            found &= tables.resolve(telecom_patient_period.telecom, "system", "use")
+    return found
+
+
+def _lookups_found(tables: LookupTables, patient: PatientModel) -> bool:
+    # Whether the entities `upsert_from_pydantic_models` requires for `patient` are in `tables`.
+    return tables.get(DataSource, patient.data_source_name) is not None and all(
+        tables.get(City, (address.city, address.state, address.country))
+        for address in patient.address or []
+    )
+
+
+# Columns identifying an address or telecom, whose normalized values make up its `content_hash`.
+PERIOD_ITEM_KEY_FIELDS = {
+    "address": ("use_id", "type_id", "line", "city_id", "postal_code"),
+    "telecom": ("system_id", "use_id", "value", "rank"),
+}
+
+# Columns overwritten when upserting a `PatientRecord` that already exists.
+PATIENT_RECORD_UPSERT_FIELDS = (
+    "active",
+    "birth_city_id",
+    "birth_date",
+    "deceased",
+    "ethnicity_id",
+    "father_name",
+    "gender_id",
+    "mother_name",
+    "name",
+    "nationality_id",
+    "naturalization",
+    "protected_person",
+    "race_id",
+    "updated_at",
+)
+
+
+async def _lookup(model: Type[Model], field: str, values: Iterable) -> dict:
+    """Fetch the `model` instances whose `field` is in `values`, keyed by that field"""
+    values = {value for value in values if value}
+    if not values:
+        return {}
+    instances = await model.filter(**{f"{field}__in": values})
+    return {getattr(instance, field): instance for instance in instances}
+
+
+def content_hash(values: Iterable) -> str:
+    """
+    Hash `values` after normalizing them, so that values differing only in case or whitespace
+    hash the same.
+
+    >>> content_hash(["Rua  São Clemente, 10 ", None]) == content_hash(["rua são clemente, 10"])
+    False
+    >>> content_hash(["Rua  São Clemente, 10 "]) == content_hash(["rua são clemente, 10"])
+    True
+    """
+    normalized = (
+        " ".join(value.split()).casefold() if isinstance(value, str) else str(value)
+        for value in values
+    )
+    return hashlib.blake2b("\x1f".join(normalized).encode(), digest_size=16).hexdigest()
+
+
+def item_content_hash(item_field: str, item) -> str:
+    """The `content_hash` of an `Address` or `Telecom` (`item_field`), from its key columns"""
+    return content_hash(getattr(item, field) for field in PERIOD_ITEM_KEY_FIELDS[item_field])
+
+
+async def _get_or_create_items(item_model: Type[Model], items: list[Model]) -> dict[str, str]:
+    """
+    Insert the hashed `items` that are not stored yet, returning the id of the stored row of each
+    content hash.
+    """
+    by_hash = {item.content_hash: item for item in items}
+    await item_model.bulk_create(list(by_hash.values()), ignore_conflicts=True)
+    return dict(
+        await item_model.filter(content_hash__in=list(by_hash)).values_list("content_hash", "id")
+    )
+
+
+async def _sync_patient_periods(
+    period_model: Type[Model], item_field: str, desired: dict[int, list[tuple]]
+) -> None:
+    """
+    Make the addresses or telecoms (`item_field`) of each patient record match `desired`.
+
+    `desired` maps record ids to lists of (unsaved `Address` or `Telecom`, `PeriodModel`). Stored
+    entries equal to a desired one are kept, the other stored entries are deleted and the
+    desired entries left over are inserted. Entries are compared by content hash, and new
+    entries reuse the stored address or telecom with the same hash.
+    """
+    missing: dict[tuple, list] = {}
+    for record_id, items in desired.items():
+        for item, period in items:
+            item.content_hash = item_content_hash(item_field, item)
+            start, end = (_as_date(period.start), _as_date(period.end)) if period else (None, None)
+            missing.setdefault((record_id, item.content_hash, start, end), []).append(item)
+
+    stale = []
+    stored = await period_model.filter(patient_id__in=list(desired)).values_list(
+        "id", "patient_id", f"{item_field}__content_hash", "period_start", "period_end"
+    )
+    for period_id, *key in stored:
+        matches = missing.get(tuple(key))
+        if matches:
+            matches.pop()
+        else:
+            stale.append(period_id)
+    if stale:
+        # Addresses and telecoms may be shared with other records, so only the periods go.
+        await period_model.filter(id__in=stale).delete()
+
+    new = [(key, item) for key, items in missing.items() for item in items]
+    if new:
+        item_ids = await _get_or_create_items(type(new[0][1]), [item for _, item in new])
+        await period_model.bulk_create(
+            [
+                period_model(
+                    patient_id=record_id,
+                    period_start=start,
+                    period_end=end,
+                    **{f"{item_field}_id": item_ids[item_hash]},
+                )
+                for (record_id, item_hash, start, end), _ in new
+            ]
+        )
+
+
+def _as_date(value: date | None) -> date | None:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _period_resource(patient_period) -> dict | None:
+    # Dates, without the time of the `PeriodModel`s.
+    if not patient_period.period_start:
+        return None
+    return {
+        "start": patient_period.period_start.isoformat(),
+        "end": patient_period.period_end.isoformat() if patient_period.period_end else None,
+    }
+
+
+def _period_model(patient_period) -> PeriodModel | None:
+    if not patient_period.period_start:
+        return None
+    return PeriodModel(start=patient_period.period_start, end=patient_period.period_end)
+
+
 class Race(Model):
     id = fields.UUIDField(pk=True)
     slug = fields.CharField(max_length=32, unique=True)
@@ -400,6 +785,20 @@ class State(Model):
     name = fields.CharField(max_length=512)
     country = fields.ForeignKeyField("app.Country", related_name="states")
 
+    class Meta:
+        indexes = (("country", "name"),)
+
+
+class SyncWatermark(Model):
+    """
+    How far the sync with the FHIR store has read a resource type, as a `_lastUpdated` instant.
+    """
+
+    id = fields.IntField(pk=True)
+    name = fields.CharField(max_length=64, unique=True)
+    value = fields.CharField(max_length=64)
+    updated_at = fields.DatetimeField(auto_now=True)
+
 
 class Telecom(Model):
     id = fields.UUIDField(pk=True)
@@ -407,28 +806,18 @@ class Telecom(Model):
     use = fields.ForeignKeyField("app.TelecomUse", related_name="use", null=True)
     value = fields.CharField(max_length=512)
     rank = fields.IntField(null=True)
-
-    @classmethod
-    async def create_from_pydantic_model(cls, telecom: TelecomModel) -> "Telecom":
-        # Dump the Pydantic model to a dict.
-        telecom_data = telecom.model_dump()
-        # Parse the foreign keys.
-        # - system.
-        if telecom_data["system"]:
-            telecom_data["system"] = await TelecomSystem.get_or_none(
-                slug=telecom_data.pop("system")
-            )
-        # - use.
-        if telecom_data["use"]:
-            telecom_data["use"] = await TelecomUse.get_or_none(slug=telecom_data.pop("use"))
-        # Create the telecom.
-        return await Telecom.create(**telecom_data)
+    # Telecoms are shared like addresses (see `Address.content_hash`).
+    content_hash = fields.CharField(max_length=32, unique=True, null=True)
 
 
 class TelecomPatientPeriod(Model):
     id = fields.UUIDField(pk=True)
-    telecom = fields.ForeignKeyField("app.Telecom", related_name="telecom_patient_periods")
-    patient = fields.ForeignKeyField("app.PatientRecord", related_name="telecom_patient_periods")
+    telecom = fields.ForeignKeyField(
+        "app.Telecom", related_name="telecom_patient_periods", index=True
+    )
+    patient = fields.ForeignKeyField(
+        "app.PatientRecord", related_name="telecom_patient_periods", index=True
+    )
     period_start = fields.DateField(null=True)
     period_end = fields.DateField(null=True)
 
@@ -455,3 +844,30 @@ class User(Model):
     is_superuser = fields.BooleanField(default=False)
     created_at = fields.DatetimeField(auto_now_add=True)
     updated_at = fields.DatetimeField(auto_now=True)
+
+
+survivorship = Survivorship(
+    config.GOLDEN_RECORD_SOURCE_PRIORITY,
+    config.GOLDEN_RECORD_RULE,
+    config.GOLDEN_RECORD_FIELD_RULES,
+)
+
+patient_mapper = PatientMapper()
+
+lookups = LookupCache(
+    {
+        AddressType: "slug",
+        AddressUse: "slug",
+        City: ("name", "state__name", "state__country__name"),
+        Country: "name",
+        DataSource: "name",
+        Ethnicity: "name",
+        Gender: "slug",
+        Nationality: "name",
+        Race: "name",
+        State: ("name", "country__name"),
+        TelecomSystem: "slug",
+        TelecomUse: "slug",
+    },
+    ttl=config.LOOKUP_CACHE_TTL,
+)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar normalization of the raw patient extracts of the data sources.
+
+A `RawPatientRecord` keeps a patient as its data source sent it: CPFs with punctuation or lost
+leading zeros, names in capitals, dates in local formats, codes instead of lookup values.
+`Normalizer` cleans a batch of them one column at a time with pandas string and NumPy array
+operations instead of row by row in Python, and only builds the `PatientModel`s at the end:
+
+- CPF and CNS: non-digits are stripped and the check digits validated. A row with an invalid CPF
+  is rejected, an invalid CNS is dropped.
+- Names: whitespace is collapsed and words capitalized, except the particles (da, de, dos...).
+- Birth date: parsed with each of the configured formats in turn. A row without one is rejected.
+- Gender, race, ethnicity and nationality: mapped case-insensitively to the lookup tables, through
+  the aliases of the data source (e.g. "F" -> "female"). Unknown values are dropped.
+
+Usage:
+    python scripts/normalize_raw_patients.py vitacare
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from pydantic import ValidationError
+
+from app.lookups import LookupTables
+from app.models import (
+    Ethnicity,
+    Gender,
+    Nationality,
+    PatientRecord,
+    Race,
+    RawPatientRecord,
+    lookups,
+)
+from app.pagination import iter_batches
+from app.pydantic_models import PatientModel
+
+NAME_FIELDS = ("name", "mother", "father")
+TEXT_FIELDS = ("birth_city", "birth_state", "birth_country", "naturalization")
+BOOLEAN_FIELDS = ("active", "deceased", "protected_person")
+LOOKUP_FIELDS = {"gender": Gender, "race": Race, "ethnicity": Ethnicity, "nationality": Nationality}
+# Copied as they are, and validated by `PatientModel`.
+LIST_FIELDS = ("address", "telecom")
+FIELDS = ("cpf", "cns", "birth_date", *NAME_FIELDS, *TEXT_FIELDS, *BOOLEAN_FIELDS, *LIST_FIELDS)
+
+NAME_PARTICLES = ("da", "das", "de", "do", "dos", "e")
+# The particles between two words, once capitalized by `str.title`.
+PARTICLE_PATTERN = rf"(?<= )({'|'.join(particle.title() for particle in NAME_PARTICLES)})(?= )"
+BOOLEANS = {
+    **dict.fromkeys(("1", "true", "t", "s", "sim", "y", "yes"), True),
+    **dict.fromkeys(("0", "false", "f", "n", "nao", "não", "no"), False),
+}
+DEFAULT_ALIASES = {
+    "gender": {"m": "male", "masculino": "male", "f": "female", "feminino": "female"},
+}
+
+# Weights of the check digits of the CPF, and of the CNS (whose weighted sum is a multiple of 11).
+CPF_WEIGHTS = (np.arange(10, 1, -1), np.arange(11, 1, -1))
+CNS_WEIGHTS = np.arange(15, 0, -1)
+
+
+class Normalizer:
+    """
+    Normalizer of the raw patient records of a data source.
+
+    Args:
+        columns (dict[str, str], optional): Raw key of each patient field, for the fields whose
+            key is not the field name, e.g. {"cpf": "nu_cpf"}.
+        date_formats (tuple[str, ...], optional): `strptime` formats of the birth dates, tried in
+            order.
+        aliases (dict[str, dict[str, str]], optional): Per lookup field, the lookup value of raw
+            values (case-insensitive) that are not values of the lookup table, e.g.
+            {"race": {"01": "Branca"}}. Merged with `DEFAULT_ALIASES`.
+    """
+
+    def __init__(
+        self,
+        columns: dict[str, str] | None = None,
+        date_formats: tuple[str, ...] = ("%Y-%m-%d", "%d/%m/%Y"),
+        aliases: dict[str, dict[str, str]] | None = None,
+    ):
+        self.columns = {field: field for field in (*FIELDS, *LOOKUP_FIELDS)} | (columns or {})
+        self.date_formats = date_formats
+        self.aliases = {}
+        for field in LOOKUP_FIELDS:
+            field_aliases = DEFAULT_ALIASES.get(field, {}) | (aliases or {}).get(field, {})
+            self.aliases[field] = {raw.casefold(): value for raw, value in field_aliases.items()}
+
+    def normalize(
+        self, records: list[dict], tables: LookupTables, data_source_name: str
+    ) -> tuple[list[PatientModel], dict[int, str]]:
+        """
+        Normalize a batch of raw records.
+
+        Returns:
+            tuple[list[PatientModel], dict[int, str]]: The patients of the valid records, in
+                order, and the error of each rejected record by its index in `records`.
+        """
+        # `object` keeps integers as they are, where pandas would turn a column of integers with
+        # missing values into floats.
+        raw = pd.DataFrame.from_records(records, index=range(len(records))).astype(object)
+        column = {
+            field: raw[key] if key in raw else pd.Series(None, index=raw.index, dtype=object)
+            for field, key in self.columns.items()
+        }
+
+        patients = pd.DataFrame(index=raw.index)
+        patients["cpf"] = clean_digits(column["cpf"]).str.zfill(11)
+        patients["cns"] = clean_digits(column["cns"])
+        patients["cns"] = patients["cns"].where(valid_cns(patients["cns"]))
+        patients["birth_date"] = self.parse_dates(column["birth_date"])
+        for field in NAME_FIELDS:
+            patients[field] = clean_name(column[field])
+        for field in TEXT_FIELDS:
+            patients[field] = clean_text(column[field])
+        for field in BOOLEAN_FIELDS:
+            patients[field] = clean_text(column[field]).str.casefold().map(BOOLEANS)
+        for field, model in LOOKUP_FIELDS.items():
+            patients[field] = self.map_lookup(field, column[field], tables.keys(model))
+        patients["gender"] = patients["gender"].fillna("unknown")
+        for field in LIST_FIELDS:
+            patients[field] = column[field]
+        patients["data_source_name"] = data_source_name
+
+        errors = {}
+        for message, rejected in (
+            ("Invalid CPF", ~valid_cpf(patients["cpf"])),
+            ("Invalid birth date", patients["birth_date"].isna()),
+            ("Missing name", patients["name"].isna()),
+        ):
+            for index in patients.index[rejected]:
+                errors.setdefault(index, message)
+
+        patients["birth_date"] = patients["birth_date"].dt.date
+        patients = patients.drop(index=list(errors)).astype(object)
+        patients = patients.where(patients.notna(), None)
+        models = []
+        # Only the nested lists are left for Pydantic to check.
+        for index, patient in zip(patients.index, patients.to_dict("records")):
+            try:
+                models.append(
+                    PatientModel(**{field: v for field, v in patient.items() if v is not None})
+                )
+            except ValidationError as error:
+                errors[index] = str(error)
+        return models, dict(sorted(errors.items()))
+
+    def parse_dates(self, values: pd.Series) -> pd.Series:
+        """Parse the dates of `values` with the first of the `date_formats` that fits"""
+        values = clean_text(values)
+        # Seconds, as nanoseconds would only span the years 1677 to 2262.
+        dates = pd.Series(pd.NaT, index=values.index, dtype="datetime64[s]")
+        for date_format in self.date_formats:
+            missing = dates.isna()
+            if not missing.any():
+                break
+            parsed = pd.to_datetime(values[missing], format=date_format, errors="coerce")
+            dates[missing] = parsed.astype("datetime64[s]")
+        # A birth date in the future is a typo.
+        return dates.where(dates <= pd.Timestamp(date.today()))
+
+    def map_lookup(self, field: str, values: pd.Series, keys: list[str]) -> pd.Series:
+        """Map `values` to the `keys` of the lookup table, through the aliases of `field`"""
+        mapping = self.aliases[field] | {key.casefold(): key for key in keys}
+        return clean_text(values).str.casefold().map(mapping)
+
+
+def clean_text(values: pd.Series) -> pd.Series:
+    """Trim and collapse the whitespace of `values`, blank values becoming missing"""
+    values = values.astype("string").str.strip().str.replace(r"\s+", " ", regex=True)
+    return values.mask(values == "")
+
+
+def clean_digits(values: pd.Series) -> pd.Series:
+    """Strip the non-digits of `values`, e.g. the punctuation of a CPF"""
+    values = values.astype("string").str.replace(r"[^0-9]", "", regex=True)
+    return values.mask(values == "")
+
+
+def clean_name(values: pd.Series) -> pd.Series:
+    """
+    Capitalize the words of `values`, except the particles.
+
+    >>> clean_name(pd.Series(["  MARIA  DA CONCEIÇÃO ", "joão dos santos e silva"])).tolist()
+    ['Maria da Conceição', 'João dos Santos e Silva']
+    """
+    return (
+        clean_text(values)
+        .str.title()
+        .str.replace(PARTICLE_PATTERN, lambda match: match[0].lower(), regex=True)
+    )
+
+
+def _digit_matrix(values: pd.Series, width: int) -> np.ndarray:
+    # Strings of `width` ASCII digits, laid end to end, reshaped into one row of digits each.
+    buffer = "".join(values.tolist()).encode("ascii")
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(-1, width).astype(np.int64) - ord("0")
+
+
+def valid_cpf(values: pd.Series) -> pd.Series:
+    """
+    Whether each of `values` is a CPF of 11 digits with valid check digits.
+
+    >>> valid_cpf(pd.Series(["52998224725", "52998224715", "11111111111", None])).tolist()
+    [True, False, False, False]
+    """
+    valid = values.str.fullmatch(r"[0-9]{11}").fillna(False).astype(bool)
+    digits = _digit_matrix(values[valid], 11)
+    checks = np.ones(len(digits), dtype=bool)
+    for position, weights in zip((9, 10), CPF_WEIGHTS):
+        check_digit = (digits[:, :position] @ weights) * 10 % 11 % 10
+        checks &= check_digit == digits[:, position]
+    # Repeated digits pass the checks but are placeholders.
+    checks &= ~(digits == digits[:, :1]).all(axis=1)
+    valid[valid] = checks
+    return valid
+
+
+def valid_cns(values: pd.Series) -> pd.Series:
+    """
+    Whether each of `values` is a CNS of 15 digits with a valid checksum.
+
+    >>> valid_cns(pd.Series(["700000000000005", "700000000000001", "300000000000003"])).tolist()
+    [True, False, False]
+    """
+    valid = values.str.fullmatch(r"[12789][0-9]{14}").fillna(False).astype(bool)
+    digits = _digit_matrix(values[valid], 15)
+    valid[valid] = digits @ CNS_WEIGHTS % 11 == 0
+    return valid
+
+
+async def normalize_data_source(
+    data_source_name: str, normalizer: Normalizer, batch_size: int = 10000
+) -> tuple[int, int]:
+    """
+    Normalize the raw records of a data source and write them as its patient records.
+
+    Returns:
+        tuple[int, int]: How many records were written, and how many were rejected.
+    """
+    written = rejected = 0
+    queryset = RawPatientRecord.filter(data_source__name=data_source_name)
+    async for raw_records in iter_batches(queryset, batch_size):
+        tables = await lookups.get()
+        patients, errors = normalizer.normalize(
+            [raw_record.data for raw_record in raw_records], tables, data_source_name
+        )
+        for index, error in errors.items():
+            logger.warning(f'Raw patient "{raw_records[index].id}" was rejected: {error}')
+        records, write_errors = await PatientRecord.upsert_from_pydantic_models(patients)
+        for index, error in write_errors.items():
+            logger.warning(f'Patient "{patients[index].cpf}" was not written: {error}')
+        written += len(records)
+        rejected += len(errors) + len(write_errors)
+        logger.info(f"{data_source_name}: {written} patients written, {rejected} rejected")
+    return written, rejected
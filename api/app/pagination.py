@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset (cursor) pagination.
+
+Pages are ordered by primary key and the cursor encodes the last key of the previous page, so
+fetching page N costs the same as fetching the first one, and rows inserted while a client walks
+the pages are neither skipped nor repeated.
+"""
+import base64
+import binascii
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request, Response
+from tortoise.queryset import QuerySet
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Raises:
+        HTTPException: 400 if the cursor was not produced by `encode_cursor`.
+    """
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+async def paginate(queryset: QuerySet, cursor: str | None, limit: int) -> tuple[list, str | None]:
+    """
+    Fetch the page of `queryset` following `cursor`.
+
+    Returns:
+        tuple[list, str | None]: The page and the cursor of the next page, or None on the last page.
+    """
+    if cursor:
+        queryset = queryset.filter(id__gt=decode_cursor(cursor))
+    # One extra row tells whether there is a next page without a COUNT query.
+    rows = await queryset.order_by("id").limit(limit + 1)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].id)
+
+
+async def iter_batches(queryset: QuerySet, batch_size: int) -> AsyncIterator[list]:
+    """Walk the whole `queryset` by primary key, holding a single batch in memory"""
+    last_id = None
+    while True:
+        batch_queryset = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = await batch_queryset.order_by("id").limit(batch_size)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+def set_next_link(request: Request, response: Response, next_cursor: str | None) -> None:
+    """Advertise the next page in the `Link` header, as in RFC 8288"""
+    if next_cursor:
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
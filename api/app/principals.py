@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+In-process cache of authenticated principals, keyed by access token.
+
+Without it, every authenticated request decodes its JWT, loads the user and then loads the
+user's data source. A cached principal is the `User` with its data source already fetched, kept
+for at most `ttl` seconds and never past the expiry of its token. The `/users` routes invalidate
+a user's entries when they update or delete it; the TTL bounds how long other worker processes,
+which do not see the invalidation, keep serving the old principal.
+"""
+import time
+from collections import OrderedDict
+
+from app.models import User
+
+
+class PrincipalCache:
+    """
+    Bounded LRU of `User`s (with their `data_source` fetched) by access token.
+
+    Args:
+        ttl (float): Seconds a principal is kept after it is loaded.
+        max_entries (int, optional): Tokens kept at most. Defaults to 10000.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, User]] = OrderedDict()
+
+    def get(self, token: str) -> User | None:
+        """Return the cached principal of `token`, if any"""
+        item = self._entries.get(token)
+        if item is None:
+            return None
+        expires_at, user = item
+        if expires_at < time.time():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return user
+
+    async def load(self, token: str, username: str, token_expires_at: float = None) -> User | None:
+        """Load the user named `username` and its data source, caching it under `token`"""
+        user = await User.get_or_none(username=username).select_related("data_source")
+        if user is None or self.ttl <= 0:
+            return user
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        self._entries[token] = (expires_at, user)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None) -> None:
+        """Forget the principals of the user `user_id`, or every principal"""
+        if user_id is None:
+            self._entries.clear()
+            return
+        for token, (_, user) in list(self._entries.items()):
+            if str(user.id) == str(user_id):
+                del self._entries[token]
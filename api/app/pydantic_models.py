@@ -2,7 +2,6 @@
 from datetime import date, datetime
 
 from pydantic import BaseModel
-from tortoise.contrib.pydantic import pydantic_model_creator
 
 
 class PeriodModel(BaseModel):
@@ -59,3 +58,20 @@ class PatientModel(BaseModel):
     protected_person: bool | None = None
     race: str | None = None
     telecom: list[TelecomModel] | None = None
+
+
+class GoldenPatientModel(PatientModel):
+    sources: dict[str, str]
+    updated_at: datetime
+
+
+class BulkPatientError(BaseModel):
+    index: int
+    cpf: str
+    detail: str
+
+
+class BulkPatientResult(BaseModel):
+    created: int
+    updated: int
+    errors: list[BulkPatientError]
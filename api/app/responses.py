@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from fhir_utils import codec
+
+
+class CodecJSONResponse(JSONResponse):
+    """JSON response rendered with the fastest codec available to `fhir_utils` (e.g. orjson)."""
+
+    def render(self, content: Any) -> bytes:
+        return codec.dumps(content)
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 from typing import Annotated
+from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Request
 from tortoise.contrib.pydantic import pydantic_model_creator
 
-from app.dependencies import get_current_active_user
+from app.cache import PATIENTS_PREFIX, entities_key, response_cache
+from app.dependencies import get_current_active_user, principals
 from app.models import (
     AddressType,
     AddressUse,
@@ -19,6 +21,7 @@ from app.models import (
     TelecomSystem,
     TelecomUse,
     User,
+    lookups,
 )
 
 AddressTypeInput = pydantic_model_creator(AddressType, name="AddressTypeInput", exclude=("id",))
@@ -62,11 +65,45 @@ TelecomUseOutput = pydantic_model_creator(TelecomUse, name="TelecomUseOutput")
 router = APIRouter(prefix="/entities", tags=["entities"])
 
 
+ENTITIES = (
+    "address_type",
+    "address_use",
+    "city",
+    "country",
+    "data_source",
+    "ethnicity",
+    "gender",
+    "nationality",
+    "race",
+    "state",
+    "telecom_system",
+    "telecom_use",
+)
+
+
+async def invalidate_entities() -> None:
+    """
+    Drop the cached copies of the entity tables after a write to any of them. Every list is
+    dropped, since deletes cascade (e.g. from a state to its cities). Cached principals hold
+    their data source, and cached patients the names and slugs of their entities, so they are
+    dropped too.
+    """
+    lookups.invalidate()
+    principals.invalidate()
+    await response_cache.delete(*(entities_key(entity) for entity in ENTITIES))
+    await response_cache.delete_prefix(PATIENTS_PREFIX)
+
+
 @router.get("/address_type", response_model=list[AddressTypeOutput])
 async def get_address_types(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[AddressTypeOutput]:
-    return await AddressTypeOutput.from_queryset(AddressType.all())
+    return await response_cache.respond(
+        request,
+        entities_key("address_type"),
+        lambda: AddressTypeOutput.from_queryset(AddressType.all()),
+    )
 
 
 @router.post("/address_type", response_model=AddressTypeOutput, status_code=201)
@@ -75,35 +112,43 @@ async def create_address_type(
     address_type_input: AddressTypeInput,
 ) -> AddressTypeOutput:
     address_type = await AddressType.create(**address_type_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await AddressTypeOutput.from_tortoise_orm(address_type)
 
 
 @router.patch("/address_type/{address_type_id}", response_model=AddressTypeOutput)
 async def update_address_type(
     _: Annotated[User, Depends(get_current_active_user)],
-    address_type_id: int,
+    address_type_id: UUID,
     address_type_input: AddressTypeInput,
 ) -> AddressTypeOutput:
     await AddressType.filter(id=address_type_id).update(
         **address_type_input.dict(exclude_unset=True)
     )
+    await invalidate_entities()
     return await AddressTypeOutput.from_queryset_single(AddressType.get(id=address_type_id))
 
 
 @router.delete("/address_type/{address_type_id}", response_model=dict[str, bool])
 async def delete_address_type(
     _: Annotated[User, Depends(get_current_active_user)],
-    address_type_id: int,
+    address_type_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await AddressType.filter(id=address_type_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/address_use", response_model=list[AddressUseOutput])
 async def get_address_uses(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[AddressUseOutput]:
-    return await AddressUseOutput.from_queryset(AddressUse.all())
+    return await response_cache.respond(
+        request,
+        entities_key("address_use"),
+        lambda: AddressUseOutput.from_queryset(AddressUse.all()),
+    )
 
 
 @router.post("/address_use", response_model=AddressUseOutput, status_code=201)
@@ -112,33 +157,41 @@ async def create_address_use(
     address_use_input: AddressUseInput,
 ) -> AddressUseOutput:
     address_use = await AddressUse.create(**address_use_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await AddressUseOutput.from_tortoise_orm(address_use)
 
 
 @router.patch("/address_use/{address_use_id}", response_model=AddressUseOutput)
 async def update_address_use(
     _: Annotated[User, Depends(get_current_active_user)],
-    address_use_id: int,
+    address_use_id: UUID,
     address_use_input: AddressUseInput,
 ) -> AddressUseOutput:
     await AddressUse.filter(id=address_use_id).update(**address_use_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await AddressUseOutput.from_queryset_single(AddressUse.get(id=address_use_id))
 
 
 @router.delete("/address_use/{address_use_id}", response_model=dict[str, bool])
 async def delete_address_use(
     _: Annotated[User, Depends(get_current_active_user)],
-    address_use_id: int,
+    address_use_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await AddressUse.filter(id=address_use_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/city", response_model=list[CityOutput])
 async def get_cities(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[CityOutput]:
-    return await CityOutput.from_queryset(City.all())
+    return await response_cache.respond(
+        request,
+        entities_key("city"),
+        lambda: CityOutput.from_queryset(City.all()),
+    )
 
 
 @router.post("/city", response_model=CityOutput, status_code=201)
@@ -147,33 +200,41 @@ async def create_city(
     city_input: CityInput,
 ) -> CityOutput:
     city = await City.create(**city_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await CityOutput.from_tortoise_orm(city)
 
 
 @router.patch("/city/{city_id}", response_model=CityOutput)
 async def update_city(
     _: Annotated[User, Depends(get_current_active_user)],
-    city_id: int,
+    city_id: UUID,
     city_input: CityInput,
 ) -> CityOutput:
     await City.filter(id=city_id).update(**city_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await CityOutput.from_queryset_single(City.get(id=city_id))
 
 
 @router.delete("/city/{city_id}", response_model=dict[str, bool])
 async def delete_city(
     _: Annotated[User, Depends(get_current_active_user)],
-    city_id: int,
+    city_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await City.filter(id=city_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/country", response_model=list[CountryOutput])
 async def get_countries(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[CountryOutput]:
-    return await CountryOutput.from_queryset(Country.all())
+    return await response_cache.respond(
+        request,
+        entities_key("country"),
+        lambda: CountryOutput.from_queryset(Country.all()),
+    )
 
 
 @router.post("/country", response_model=CountryOutput, status_code=201)
@@ -182,33 +243,41 @@ async def create_country(
     country_input: CountryInput,
 ) -> CountryOutput:
     country = await Country.create(**country_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await CountryOutput.from_tortoise_orm(country)
 
 
 @router.patch("/country/{country_id}", response_model=CountryOutput)
 async def update_country(
     _: Annotated[User, Depends(get_current_active_user)],
-    country_id: int,
+    country_id: UUID,
     country_input: CountryInput,
 ) -> CountryOutput:
     await Country.filter(id=country_id).update(**country_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await CountryOutput.from_queryset_single(Country.get(id=country_id))
 
 
 @router.delete("/country/{country_id}", response_model=dict[str, bool])
 async def delete_country(
     _: Annotated[User, Depends(get_current_active_user)],
-    country_id: int,
+    country_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await Country.filter(id=country_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/data_source", response_model=list[DataSourceOutput])
 async def get_data_sources(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[DataSourceOutput]:
-    return await DataSourceOutput.from_queryset(DataSource.all())
+    return await response_cache.respond(
+        request,
+        entities_key("data_source"),
+        lambda: DataSourceOutput.from_queryset(DataSource.all()),
+    )
 
 
 @router.post("/data_source", response_model=DataSourceOutput, status_code=201)
@@ -217,33 +286,41 @@ async def create_data_source(
     data_source_input: DataSourceInput,
 ) -> DataSourceOutput:
     data_source = await DataSource.create(**data_source_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await DataSourceOutput.from_tortoise_orm(data_source)
 
 
 @router.patch("/data_source/{data_source_id}", response_model=DataSourceOutput)
 async def update_data_source(
     _: Annotated[User, Depends(get_current_active_user)],
-    data_source_id: int,
+    data_source_id: UUID,
     data_source_input: DataSourceInput,
 ) -> DataSourceOutput:
     await DataSource.filter(id=data_source_id).update(**data_source_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await DataSourceOutput.from_queryset_single(DataSource.get(id=data_source_id))
 
 
 @router.delete("/data_source/{data_source_id}", response_model=dict[str, bool])
 async def delete_data_source(
     _: Annotated[User, Depends(get_current_active_user)],
-    data_source_id: int,
+    data_source_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await DataSource.filter(id=data_source_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/ethnicity", response_model=list[EthnicityOutput])
 async def get_ethnicities(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[EthnicityOutput]:
-    return await EthnicityOutput.from_queryset(Ethnicity.all())
+    return await response_cache.respond(
+        request,
+        entities_key("ethnicity"),
+        lambda: EthnicityOutput.from_queryset(Ethnicity.all()),
+    )
 
 
 @router.post("/ethnicity", response_model=EthnicityOutput, status_code=201)
@@ -252,33 +329,41 @@ async def create_ethnicity(
     ethnicity_input: EthnicityInput,
 ) -> EthnicityOutput:
     ethnicity = await Ethnicity.create(**ethnicity_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await EthnicityOutput.from_tortoise_orm(ethnicity)
 
 
 @router.patch("/ethnicity/{ethnicity_id}", response_model=EthnicityOutput)
 async def update_ethnicity(
     _: Annotated[User, Depends(get_current_active_user)],
-    ethnicity_id: int,
+    ethnicity_id: UUID,
     ethnicity_input: EthnicityInput,
 ) -> EthnicityOutput:
     await Ethnicity.filter(id=ethnicity_id).update(**ethnicity_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await EthnicityOutput.from_queryset_single(Ethnicity.get(id=ethnicity_id))
 
 
 @router.delete("/ethnicity/{ethnicity_id}", response_model=dict[str, bool])
 async def delete_ethnicity(
     _: Annotated[User, Depends(get_current_active_user)],
-    ethnicity_id: int,
+    ethnicity_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await Ethnicity.filter(id=ethnicity_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/gender", response_model=list[GenderOutput])
 async def get_genders(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[GenderOutput]:
-    return await GenderOutput.from_queryset(Gender.all())
+    return await response_cache.respond(
+        request,
+        entities_key("gender"),
+        lambda: GenderOutput.from_queryset(Gender.all()),
+    )
 
 
 @router.post("/gender", response_model=GenderOutput, status_code=201)
@@ -287,33 +372,41 @@ async def create_gender(
     gender_input: GenderInput,
 ) -> GenderOutput:
     gender = await Gender.create(**gender_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await GenderOutput.from_tortoise_orm(gender)
 
 
 @router.patch("/gender/{gender_id}", response_model=GenderOutput)
 async def update_gender(
     _: Annotated[User, Depends(get_current_active_user)],
-    gender_id: int,
+    gender_id: UUID,
     gender_input: GenderInput,
 ) -> GenderOutput:
     await Gender.filter(id=gender_id).update(**gender_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await GenderOutput.from_queryset_single(Gender.get(id=gender_id))
 
 
 @router.delete("/gender/{gender_id}", response_model=dict[str, bool])
 async def delete_gender(
     _: Annotated[User, Depends(get_current_active_user)],
-    gender_id: int,
+    gender_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await Gender.filter(id=gender_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/nationality", response_model=list[NationalityOutput])
 async def get_nationalities(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[NationalityOutput]:
-    return await NationalityOutput.from_queryset(Nationality.all())
+    return await response_cache.respond(
+        request,
+        entities_key("nationality"),
+        lambda: NationalityOutput.from_queryset(Nationality.all()),
+    )
 
 
 @router.post("/nationality", response_model=NationalityOutput, status_code=201)
@@ -322,33 +415,41 @@ async def create_nationality(
     nationality_input: NationalityInput,
 ) -> NationalityOutput:
     nationality = await Nationality.create(**nationality_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await NationalityOutput.from_tortoise_orm(nationality)
 
 
 @router.patch("/nationality/{nationality_id}", response_model=NationalityOutput)
 async def update_nationality(
     _: Annotated[User, Depends(get_current_active_user)],
-    nationality_id: int,
+    nationality_id: UUID,
     nationality_input: NationalityInput,
 ) -> NationalityOutput:
     await Nationality.filter(id=nationality_id).update(**nationality_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await NationalityOutput.from_queryset_single(Nationality.get(id=nationality_id))
 
 
 @router.delete("/nationality/{nationality_id}", response_model=dict[str, bool])
 async def delete_nationality(
     _: Annotated[User, Depends(get_current_active_user)],
-    nationality_id: int,
+    nationality_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await Nationality.filter(id=nationality_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/race", response_model=list[RaceOutput])
 async def get_races(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[RaceOutput]:
-    return await RaceOutput.from_queryset(Race.all())
+    return await response_cache.respond(
+        request,
+        entities_key("race"),
+        lambda: RaceOutput.from_queryset(Race.all()),
+    )
 
 
 @router.post("/race", response_model=RaceOutput, status_code=201)
@@ -357,33 +458,41 @@ async def create_race(
     race_input: RaceInput,
 ) -> RaceOutput:
     race = await Race.create(**race_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await RaceOutput.from_tortoise_orm(race)
 
 
 @router.patch("/race/{race_id}", response_model=RaceOutput)
 async def update_race(
     _: Annotated[User, Depends(get_current_active_user)],
-    race_id: int,
+    race_id: UUID,
     race_input: RaceInput,
 ) -> RaceOutput:
     await Race.filter(id=race_id).update(**race_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await RaceOutput.from_queryset_single(Race.get(id=race_id))
 
 
 @router.delete("/race/{race_id}", response_model=dict[str, bool])
 async def delete_race(
     _: Annotated[User, Depends(get_current_active_user)],
-    race_id: int,
+    race_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await Race.filter(id=race_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/state", response_model=list[StateOutput])
 async def get_states(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[StateOutput]:
-    return await StateOutput.from_queryset(State.all())
+    return await response_cache.respond(
+        request,
+        entities_key("state"),
+        lambda: StateOutput.from_queryset(State.all()),
+    )
 
 
 @router.post("/state", response_model=StateOutput, status_code=201)
@@ -392,33 +501,41 @@ async def create_state(
     state_input: StateInput,
 ) -> StateOutput:
     state = await State.create(**state_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await StateOutput.from_tortoise_orm(state)
 
 
 @router.patch("/state/{state_id}", response_model=StateOutput)
 async def update_state(
     _: Annotated[User, Depends(get_current_active_user)],
-    state_id: int,
+    state_id: UUID,
     state_input: StateInput,
 ) -> StateOutput:
     await State.filter(id=state_id).update(**state_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await StateOutput.from_queryset_single(State.get(id=state_id))
 
 
 @router.delete("/state/{state_id}", response_model=dict[str, bool])
 async def delete_state(
     _: Annotated[User, Depends(get_current_active_user)],
-    state_id: int,
+    state_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await State.filter(id=state_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/telecom_system", response_model=list[TelecomSystemOutput])
 async def get_telecom_systems(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[TelecomSystemOutput]:
-    return await TelecomSystemOutput.from_queryset(TelecomSystem.all())
+    return await response_cache.respond(
+        request,
+        entities_key("telecom_system"),
+        lambda: TelecomSystemOutput.from_queryset(TelecomSystem.all()),
+    )
 
 
 @router.post("/telecom_system", response_model=TelecomSystemOutput, status_code=201)
@@ -427,35 +544,43 @@ async def create_telecom_system(
     telecom_system_input: TelecomSystemInput,
 ) -> TelecomSystemOutput:
     telecom_system = await TelecomSystem.create(**telecom_system_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await TelecomSystemOutput.from_tortoise_orm(telecom_system)
 
 
 @router.patch("/telecom_system/{telecom_system_id}", response_model=TelecomSystemOutput)
 async def update_telecom_system(
     _: Annotated[User, Depends(get_current_active_user)],
-    telecom_system_id: int,
+    telecom_system_id: UUID,
     telecom_system_input: TelecomSystemInput,
 ) -> TelecomSystemOutput:
     await TelecomSystem.filter(id=telecom_system_id).update(
         **telecom_system_input.dict(exclude_unset=True)
     )
+    await invalidate_entities()
     return await TelecomSystemOutput.from_queryset_single(TelecomSystem.get(id=telecom_system_id))
 
 
 @router.delete("/telecom_system/{telecom_system_id}", response_model=dict[str, bool])
 async def delete_telecom_system(
     _: Annotated[User, Depends(get_current_active_user)],
-    telecom_system_id: int,
+    telecom_system_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await TelecomSystem.filter(id=telecom_system_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
 
 
 @router.get("/telecom_use", response_model=list[TelecomUseOutput])
 async def get_telecom_uses(
     _: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
 ) -> list[TelecomUseOutput]:
-    return await TelecomUseOutput.from_queryset(TelecomUse.all())
+    return await response_cache.respond(
+        request,
+        entities_key("telecom_use"),
+        lambda: TelecomUseOutput.from_queryset(TelecomUse.all()),
+    )
 
 
 @router.post("/telecom_use", response_model=TelecomUseOutput, status_code=201)
@@ -464,23 +589,26 @@ async def create_telecom_use(
     telecom_use_input: TelecomUseInput,
 ) -> TelecomUseOutput:
     telecom_use = await TelecomUse.create(**telecom_use_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await TelecomUseOutput.from_tortoise_orm(telecom_use)
 
 
 @router.patch("/telecom_use/{telecom_use_id}", response_model=TelecomUseOutput)
 async def update_telecom_use(
     _: Annotated[User, Depends(get_current_active_user)],
-    telecom_use_id: int,
+    telecom_use_id: UUID,
     telecom_use_input: TelecomUseInput,
 ) -> TelecomUseOutput:
     await TelecomUse.filter(id=telecom_use_id).update(**telecom_use_input.dict(exclude_unset=True))
+    await invalidate_entities()
     return await TelecomUseOutput.from_queryset_single(TelecomUse.get(id=telecom_use_id))
 
 
 @router.delete("/telecom_use/{telecom_use_id}", response_model=dict[str, bool])
 async def delete_telecom_use(
     _: Annotated[User, Depends(get_current_active_user)],
-    telecom_use_id: int,
+    telecom_use_id: UUID,
 ) -> dict[str, bool]:
     deleted_count = await TelecomUse.filter(id=telecom_use_id).delete()
+    await invalidate_entities()
     return {"deleted": deleted_count == 1}
@@ -1,51 +1,270 @@
 # -*- coding: utf-8 -*-
-from typing import Annotated
+import zlib
+from datetime import date, datetime
+from typing import Annotated, AsyncIterator, Literal
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fhir_utils import codec
+from tortoise.queryset import QuerySet
 
+from app import config
+from app.cache import patient_key, response_cache
 from app.dependencies import get_current_active_user
 from app.models import (
+    GoldenRecord,
     PatientRecord,
     User,
 )
+from app.pagination import iter_batches, paginate, set_next_link
 from app.pydantic_models import (
+    BulkPatientError,
+    BulkPatientResult,
+    GoldenPatientModel,
     PatientModel,
 )
 
 router = APIRouter(prefix="/patients", tags=["patients"])
 
 
-@router.get("", response_model=list[PatientModel])
-async def get_patients(
+async def filter_patients(
     current_user: Annotated[User, Depends(get_current_active_user)],
-) -> list[PatientModel]:
+    cpf: str | None = None,
+    cns: str | None = None,
+    name: Annotated[str | None, Query(description="Case-insensitive name prefix")] = None,
+    birth_date_from: date | None = None,
+    birth_date_to: date | None = None,
+    updated_since: datetime | None = None,
+) -> QuerySet[PatientRecord]:
+    """The patient records visible to the user, narrowed down by the query filters"""
     if current_user.is_superuser:
-        patients = await PatientRecord.all()
-    elif not current_user.data_source:
+        queryset = PatientRecord.all()
+    elif not current_user.data_source_id:
         raise HTTPException(
             status_code=400,
             detail="User does not have a data source associated with it.",
         )
     else:
-        data_source = await current_user.data_source
-        patients = await PatientRecord.filter(data_source__name=data_source.name).prefetch_related(
-            'patient','data_source', 'ethnicity','race','gender','nationality','birth_city'
+        queryset = PatientRecord.filter(data_source_id=current_user.data_source_id)
+
+    if cpf:
+        queryset = queryset.filter(patient__cpf=cpf)
+    if cns:
+        queryset = queryset.filter(cnss__value=cns)
+    if name:
+        queryset = queryset.filter(name__istartswith=name)
+    if birth_date_from:
+        queryset = queryset.filter(birth_date__gte=birth_date_from)
+    if birth_date_to:
+        queryset = queryset.filter(birth_date__lte=birth_date_to)
+    if updated_since:
+        queryset = queryset.filter(updated_at__gte=updated_since)
+    return queryset
+
+
+@router.get("", response_model=list[PatientModel])
+async def get_patients(
+    queryset: Annotated[QuerySet[PatientRecord], Depends(filter_patients)],
+    request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=config.PAGE_SIZE_MAX)] = config.PAGE_SIZE_DEFAULT,
+) -> list[PatientModel]:
+    """
+    List patient records, one page at a time.
+
+    When there are more records, the `Link` response header holds the URL of the next page.
+    """
+    patients, next_cursor = await paginate(queryset, cursor, limit)
+    set_next_link(request, response, next_cursor)
+    return await PatientRecord.to_pydantic_models(patients)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_patients(
+    queryset: Annotated[QuerySet[PatientRecord], Depends(filter_patients)],
+    request: Request,
+    format: Literal["ndjson", "fhir"] = "ndjson",
+) -> StreamingResponse:
+    """
+    Stream every matching patient record as NDJSON, one `PatientModel` (or, with
+    `format=fhir`, one FHIR Patient resource) per line.
+
+    Records are read and serialized in batches of `EXPORT_BATCH_SIZE`, so memory use does not
+    depend on the number of records. The stream is gzip-compressed when the client accepts it.
+    """
+    if format == "fhir":
+        serialize, media_type = _patients_as_fhir, "application/fhir+ndjson"
+    else:
+        serialize, media_type = _patients_as_dicts, "application/x-ndjson"
+    chunks = _export_chunks(queryset, serialize)
+    headers = {"Vary": "Accept-Encoding"}
+    if _accepts_gzip(request.headers.get("accept-encoding", "")):
+        chunks = _gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Whether an `Accept-Encoding` header value allows gzip: gzip, or else `*`, is listed with a
+    non-zero q-value.
+    """
+    qvalues = {}
+    for coding in accept_encoding.split(","):
+        name, *params = (part.strip() for part in coding.split(";"))
+        qvalue = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[name.lower()] = qvalue
+    for name in ("gzip", "x-gzip", "*"):
+        if name in qvalues:
+            return qvalues[name] > 0
+    return False
+
+
+async def _patients_as_dicts(patient_records: list[PatientRecord]) -> list[dict]:
+    patients = await PatientRecord.to_pydantic_models(patient_records)
+    return [patient.model_dump(mode="json") for patient in patients]
+
+
+async def _patients_as_fhir(patient_records: list[PatientRecord]) -> list[dict]:
+    return await PatientRecord.to_fhir_resources(patient_records)
+
+
+async def _export_chunks(queryset: QuerySet, serialize) -> AsyncIterator[bytes]:
+    async for patient_records in iter_batches(queryset, config.EXPORT_BATCH_SIZE):
+        items = await serialize(patient_records)
+        yield b"".join(codec.dumps(item) + b"\n" for item in items)
+
+
+async def _gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        # Sync flush so each batch reaches the client as soon as it is serialized.
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+@router.get("/{cpf}", response_model=PatientModel)
+async def get_patient(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    request: Request,
+    cpf: str,
+) -> PatientModel:
+    """
+    Read the record of a patient for the user's data source.
+
+    Responses are cached per data source and carry an ETag, so clients can revalidate them with
+    `If-None-Match`.
+    """
+    if not current_user.data_source_id:
+        raise HTTPException(
+            status_code=400,
+            detail="User does not have a data source associated with it.",
+        )
+
+    async def build() -> PatientModel:
+        patient = await PatientRecord.get_or_none(
+            patient__cpf=cpf, data_source_id=current_user.data_source_id
         )
-    return [await patient.to_pydantic_model() for patient in patients]
+        if patient is None:
+            raise HTTPException(status_code=404, detail="Patient not found.")
+        return await patient.to_pydantic_model()
+
+    return await response_cache.respond(
+        request, patient_key(current_user.data_source_id, cpf), build
+    )
+
+
+@router.get("/{cpf}/golden", response_model=GoldenPatientModel)
+async def get_golden_patient(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    cpf: str,
+) -> GoldenPatientModel:
+    """
+    Read the golden record of a patient: the merge of its records from every data source, kept
+    up to date on every write. Only superusers can read it, as it spans every data source.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="You don't have permission to do this.")
+    golden_record = await GoldenRecord.get_or_none(patient__cpf=cpf)
+    if golden_record is None:
+        raise HTTPException(status_code=404, detail="Patient not found.")
+    return GoldenPatientModel(
+        **golden_record.data,
+        sources=golden_record.sources,
+        updated_at=golden_record.updated_at,
+    )
 
 
 @router.post("", response_model=PatientModel, status_code=201)
 async def create_patient(
     current_user: Annotated[User, Depends(get_current_active_user)],
     patient_input: PatientModel,
+    response: Response,
 ) -> PatientModel:
-
-    user_data_source = await current_user.data_source
+    """
+    Create the patient record, or update it if the patient already has a record for the user's
+    data source (answering 200 instead of 201).
+    """
+    user_data_source = current_user.data_source
     if not user_data_source:
         raise HTTPException(
             status_code=400,
             detail=f"User does not have a data source associated with it",
         )
     patient_input.data_source_name = user_data_source.name
-    patient = await PatientRecord.create_from_pydantic_model(patient_input)
-    return await patient.to_pydantic_model()
+    try:
+        patient, created = await PatientRecord.upsert_from_pydantic_model(patient_input)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if not created:
+        response.status_code = 200
+    patient_output = await patient.to_pydantic_model()
+    # Write-through: the next read of this patient is served from the cache.
+    await response_cache.set(
+        patient_key(patient.data_source_id, patient_output.cpf), patient_output
+    )
+    return patient_output
+
+
+@router.post("/bulk", response_model=BulkPatientResult)
+async def create_patients_bulk(
+    current_user: Annotated[User, Depends(get_current_active_user)],
+    patients_input: list[PatientModel],
+) -> BulkPatientResult:
+    """
+    Create or update up to `BULK_MAX_PATIENTS` patients in a single transaction.
+
+    Patients that cannot be written are skipped and reported in `errors` by their index in the
+    request body; the others are written. Sending the same patients again is safe.
+    """
+    if not current_user.data_source_id:
+        raise HTTPException(
+            status_code=400,
+            detail="User does not have a data source associated with it",
+        )
+    if len(patients_input) > config.BULK_MAX_PATIENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {config.BULK_MAX_PATIENTS} patients can be written at once.",
+        )
+    user_data_source = current_user.data_source
+    for patient_input in patients_input:
+        patient_input.data_source_name = user_data_source.name
+    written, errors = await PatientRecord.upsert_from_pydantic_models(patients_input)
+    created = sum(created for _, created in written.values())
+    return BulkPatientResult(
+        created=created,
+        updated=len(written) - created,
+        errors=[
+            BulkPatientError(index=index, cpf=patients_input[index].cpf, detail=detail)
+            for index, detail in errors.items()
+        ],
+    )
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 from typing import Annotated
+from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException
 from tortoise.contrib.pydantic import pydantic_model_creator
 
-from app.dependencies import get_current_active_user
+from app.dependencies import get_current_active_user, principals
 from app.models import User
 from app.utils import password_hash
 
@@ -28,7 +29,7 @@ async def create_user(
     if not current_user.is_superuser:
         raise HTTPException(status_code=403, detail="You don't have permission to do this.")
     user_input_data = user_input.model_dump()
-    user_input_data["password"] = password_hash(user_input_data["password"])
+    user_input_data["password"] = await password_hash(user_input_data["password"])
     user = await User.create(**user_input_data)
     return await UserCreateOutput.from_tortoise_orm(user)
 
@@ -40,7 +41,7 @@ async def read_my_user(current_user: Annotated[User, Depends(get_current_active_
 
 @router.get("/{user_id}", response_model=UserCreateOutput)
 async def read_user(
-    current_user: Annotated[User, Depends(get_current_active_user)], user_id: int
+    current_user: Annotated[User, Depends(get_current_active_user)], user_id: UUID
 ) -> UserCreateOutput:
     if not current_user.is_superuser:
         raise HTTPException(status_code=403, detail="You don't have permission to do this.")
@@ -51,23 +52,25 @@ async def read_user(
 @router.patch("/{user_id}", response_model=UserCreateOutput)
 async def update_user(
     current_user: Annotated[User, Depends(get_current_active_user)],
-    user_id: int,
+    user_id: UUID,
     user_input: UserUpdateInput,
 ) -> UserCreateOutput:
     if not current_user.is_superuser:
         raise HTTPException(status_code=403, detail="You don't have permission to do this.")
     user = await User.get(id=user_id)
     user_input_data = user_input.model_dump()
-    user_input_data["password"] = password_hash(user_input_data["password"])
+    user_input_data["password"] = await password_hash(user_input_data["password"])
     await user.update_from_dict(user_input_data).save()
+    principals.invalidate(user.id)
     return await UserCreateOutput.from_tortoise_orm(user)
 
 
 @router.delete("/{user_id}")
 async def delete_user(
-    current_user: Annotated[User, Depends(get_current_active_user)], user_id: int
+    current_user: Annotated[User, Depends(get_current_active_user)], user_id: UUID
 ):
     if not current_user.is_superuser:
         raise HTTPException(status_code=403, detail="You don't have permission to do this.")
     await User.filter(id=user_id).delete()
+    principals.invalidate(user_id)
     return {"message": "User deleted successfully."}
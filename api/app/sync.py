@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental sync between the patient records and a FHIR store.
+
+Push: every patient write leaves a `PatientChange` in the outbox, in the transaction of the write.
+`FhirSync.push` takes the pending changes in batches, sends the current state of their records
+with `patient_update`, a conditional update by CPF, and marks the changes pushed. A crash between
+the update and the mark only sends the batch again, with the same result.
+
+Pull: `FhirSync.pull` reads the Patient resources updated since the last pull, in `_lastUpdated`
+order, and writes them as records of the `FHIR_SYNC_DATA_SOURCE` data source. The watermark, the
+`_lastUpdated` of the last resource read, is saved in the transaction writing each batch, so a
+crash resumes right after the last written batch. Resources updated at the watermark instant
+itself are read again, since a batch may have stopped between two of them: writing them again
+changes nothing. The watermark does not move past a resource that could not be written, which is
+read again by the next pull.
+
+Changes do not bounce back and forth: records pulled from the FHIR store are not put in the
+outbox, and the resource versions created by our own pushes are skipped when pulled.
+
+Usage:
+    python scripts/sync_fhir_store.py
+"""
+import asyncio
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from fhir_utils import AsyncFastCRUD
+from loguru import logger
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+
+from app import config
+from app.models import PatientChange, PatientRecord, SyncWatermark, patient_mapper
+from app.pydantic_models import PatientModel
+
+PATIENT_WATERMARK = "Patient"
+# Watermark of the first pull, which reads the whole FHIR store.
+EPOCH = "1970-01-01T00:00:00Z"
+
+
+class FhirSync:
+    """
+    Sync worker between the patient records and a FHIR store.
+
+    Args:
+        crud (AsyncFastCRUD): Client of the Healthcare API.
+        dataset_id (str): Dataset of the FHIR store.
+        fhir_store_id (str): The FHIR store.
+        data_source_name (str, optional): Data source of the patients pulled from the FHIR store.
+        batch_size (int, optional): Changes pushed, or resources pulled, per batch.
+    """
+
+    def __init__(
+        self,
+        crud: AsyncFastCRUD,
+        dataset_id: str,
+        fhir_store_id: str,
+        data_source_name: str = config.FHIR_SYNC_DATA_SOURCE,
+        batch_size: int = config.FHIR_SYNC_BATCH_SIZE,
+    ):
+        self.crud = crud
+        self.dataset_id = dataset_id
+        self.fhir_store_id = fhir_store_id
+        self.data_source_name = data_source_name
+        self.batch_size = batch_size
+
+    async def push(self) -> int:
+        """Push the pending changes, returning how many were pushed"""
+        pushed = 0
+        # Changes that fail are retried after the others, so the loop ends once only failing
+        # changes are left; they are retried by the next push.
+        while count := await self.push_batch():
+            pushed += count
+        return pushed
+
+    async def push_batch(self) -> int:
+        """
+        Push a batch of pending changes, returning how many were pushed.
+
+        The batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED in a transaction held until
+        the changes are marked, so concurrent workers push disjoint batches.
+        """
+        async with in_transaction():
+            changes = (
+                await PatientChange.filter(pushed_at=None)
+                .order_by("attempts", "id")
+                .limit(self.batch_size)
+                .select_for_update(skip_locked=True)
+            )
+            return await self._push_changes(changes) if changes else 0
+
+    async def _push_changes(self, changes: list[PatientChange]) -> int:
+        last_change = {}
+        for change in changes:
+            last_change[change.record_id] = max(change.id, last_change.get(change.record_id, 0))
+        records = await PatientRecord.filter(id__in=list(last_change))
+        resources = await PatientRecord.to_fhir_resources(records)
+        # A patient with records in several data sources is a single resource in the FHIR store:
+        # send the record written last. Concurrent conditional updates of the same CPF could also
+        # create the resource twice.
+        latest = {}
+        for record, resource in sorted(
+            zip(records, resources), key=lambda pair: last_change[pair[0].id]
+        ):
+            latest[record.patient.cpf] = resource
+        responses = await asyncio.gather(
+            *(
+                self.crud.patient_update(self.dataset_id, self.fhir_store_id, cpf, resource)
+                for cpf, resource in latest.items()
+            ),
+            return_exceptions=True,
+        )
+        results = {}
+        for cpf, response in zip(latest, responses):
+            if isinstance(response, Exception):
+                results[cpf] = (None, repr(response))
+            elif not response.ok:
+                results[cpf] = (None, f"{response.status_code}: {response.content.decode()}")
+            else:
+                results[cpf] = ((response.body or {}).get("meta", {}).get("versionId"), None)
+
+        record_cpfs = {record.id: record.patient.cpf for record in records}
+        now, pushed = timezone.now(), 0
+        for change in changes:
+            # Changes of records deleted since are done with.
+            version_id, error = results.get(record_cpfs.get(change.record_id), (None, None))
+            if error is None:
+                change.pushed_at, change.fhir_version_id, change.error = now, version_id, None
+                pushed += 1
+            else:
+                change.attempts, change.error = change.attempts + 1, error
+        await PatientChange.bulk_update(
+            changes, fields=("pushed_at", "fhir_version_id", "attempts", "error")
+        )
+        if pushed < len(changes):
+            logger.warning(f"{len(changes) - pushed} patient changes failed to be pushed")
+        return pushed
+
+    async def pull(self) -> int:
+        """Pull the Patient resources updated since the last pull, returning how many were read"""
+        watermark = await SyncWatermark.get_or_none(name=PATIENT_WATERMARK)
+        since = watermark.value if watermark else EPOCH
+        resources = self.crud.search_iter(
+            self.dataset_id,
+            self.fhir_store_id,
+            "Patient",
+            f"_lastUpdated=ge{quote(since)}&_sort=_lastUpdated",
+            count=self.batch_size,
+        )
+        pulled, batch, rejected_at = 0, [], None
+        async for resource in resources:
+            batch.append(resource)
+            if len(batch) == self.batch_size:
+                rejected_at = await self._pull_batch(batch, rejected_at)
+                pulled, batch = pulled + len(batch), []
+        if batch:
+            await self._pull_batch(batch, rejected_at)
+            pulled += len(batch)
+        return pulled
+
+    async def _pull_batch(self, resources: list[dict], rejected_at: str | None) -> str | None:
+        """
+        Write a batch of pulled resources and move the watermark, returning the `_lastUpdated`
+        of the first resource rejected so far, if any.
+
+        The watermark stops at the first rejected resource, given as `rejected_at` by the batches
+        before, so that the next pull reads it again: the resources after it are written anyway.
+        A resource that keeps being rejected holds the watermark until it is fixed in the store.
+        """
+        own_versions = set(
+            await PatientChange.filter(
+                fhir_version_id__in=[resource["meta"]["versionId"] for resource in resources]
+            ).values_list("fhir_version_id", flat=True)
+        )
+        patients, pulled_resources, rejected = [], [], []
+        for resource in resources:
+            if resource["meta"]["versionId"] in own_versions:
+                continue
+            patient = patient_from_resource(resource, self.data_source_name)
+            if patient is None:
+                logger.warning(f'Patient "{resource.get("id")}" is not a valid patient')
+                rejected.append(resource)
+            else:
+                patients.append(patient)
+                pulled_resources.append(resource)
+
+        async with in_transaction():
+            _, errors = await PatientRecord.upsert_from_pydantic_models(
+                patients, record_changes=False
+            )
+            rejected.extend(pulled_resources[index] for index in errors)
+            if rejected_at is None and rejected:
+                rejected_at = min(resource["meta"]["lastUpdated"] for resource in rejected)
+            await SyncWatermark.update_or_create(
+                {"value": rejected_at or resources[-1]["meta"]["lastUpdated"]},
+                name=PATIENT_WATERMARK,
+            )
+        for index, error in errors.items():
+            logger.warning(f'Patient "{patients[index].cpf}" was not pulled: {error}')
+        return rejected_at
+
+    async def prune(self, retention_days: int = config.FHIR_SYNC_RETENTION_DAYS) -> int:
+        """
+        Delete the changes pushed more than `retention_days` ago, returning how many were deleted.
+        Their versions are no longer recognized when pulled, so pulls must not lag that far.
+        """
+        cutoff = timezone.now() - timedelta(days=retention_days)
+        return await PatientChange.filter(pushed_at__lt=cutoff).delete()
+
+    async def run_once(self) -> dict[str, int]:
+        """Push, pull and prune once, returning how many changes or resources each handled"""
+        counts = {"pushed": await self.push(), "pulled": await self.pull()}
+        counts["pruned"] = await self.prune()
+        logger.info(f"FHIR store sync: {counts}")
+        return counts
+
+    async def run_forever(self, interval: float = config.FHIR_SYNC_INTERVAL) -> None:
+        """Sync every `interval` seconds. Failures are logged and retried at the next round."""
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("FHIR store sync failed")
+            await asyncio.sleep(interval)
+
+
+def patient_from_resource(resource: dict, data_source_name: str) -> PatientModel | None:
+    """
+    Build a patient from a FHIR Patient resource, e.g. one of `PatientRecord.to_fhir_resources`.
+
+    Returns:
+        PatientModel | None: The patient, or None if the resource is not valid, e.g. it has no
+            CPF or birth date.
+    """
+    patient = {
+        field: value
+        for field, value in patient_mapper.from_fhir(resource).items()
+        if value is not None
+    }
+    patient["data_source_name"] = data_source_name
+    patient.setdefault("gender", "unknown")
+    patient.setdefault("deceased", "deceasedDateTime" in resource)
+    try:
+        for item in (*patient.get("address", ()), *patient.get("telecom", ())):
+            item["period"] = _period(item["period"])
+        return PatientModel(**patient)
+    except ValueError:
+        # Also raised by Pydantic as `ValidationError`.
+        return None
+
+
+def _period(period: dict | None) -> dict | None:
+    # FHIR periods may be plain dates, as the ones of `PatientRecord.to_fhir_resources`.
+    if not period or not period["start"]:
+        return None
+    return {
+        "start": datetime.fromisoformat(period["start"]),
+        "end": datetime.fromisoformat(period["end"]) if period["end"] else None,
+    }
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from jose import jwt
@@ -9,6 +11,13 @@ from app.models import User
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is deliberately slow (~100-300 ms per call) and releases the GIL while hashing, so it
+# runs in these threads instead of blocking the event loop. The pool size caps how many CPU cores
+# a login burst can take from request handling; further calls wait in the pool's queue.
+password_pool = ThreadPoolExecutor(
+    max_workers=config.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+
 
 async def authenticate_user(username: str, password: str) -> User:
     """Authenticate a user.
@@ -23,7 +32,7 @@ async def authenticate_user(username: str, password: str) -> User:
     user = await User.get_or_none(username=username)
     if not user:
         return None
-    if not password_verify(password, user.password):
+    if not await password_verify(password, user.password):
         return None
     return user
 
@@ -49,8 +58,8 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def password_hash(password: str) -> str:
-    """Hash a password.
+async def password_hash(password: str) -> str:
+    """Hash a password, in the `password_pool`.
 
     Args:
         password (str): The password to hash.
@@ -58,11 +67,12 @@ def password_hash(password: str) -> str:
     Returns:
         str: The hashed password.
     """
-    return pwd_context.hash(password)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_pool, pwd_context.hash, password)
 
 
-def password_verify(password: str, hashed: str) -> bool:
-    """Verify a password against a hash.
+async def password_verify(password: str, hashed: str) -> bool:
+    """Verify a password against a hash, in the `password_pool`.
 
     Args:
         password (str): The password to verify.
@@ -71,4 +81,5 @@ def password_verify(password: str, hashed: str) -> bool:
     Returns:
         bool: True if the password matches the hash, False otherwise.
     """
-    return pwd_context.verify(password, hashed)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_pool, pwd_context.verify, password, hashed)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the latency of an unrelated endpoint while a burst of logins is being processed.
+
+A probe requests `GET /entities/gender` at a fixed interval, first alone and then during a burst
+of concurrent `POST /auth/token` calls. With bcrypt running in the password pool, the probe's p99
+stays close to its idle value; `--inline` runs bcrypt on the event loop instead, as before, for
+comparison. The app runs in-process on an in-memory SQLite database.
+
+Usage:
+    ENVIRONMENT=dev python benchmarks/bench_login_burst.py [--logins 50] [--inline]
+"""
+import asyncio
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import Executor, Future
+from pathlib import Path
+
+import httpx
+from tortoise import Tortoise
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import utils  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import DataSource, Gender, User  # noqa: E402
+
+
+class InlineExecutor(Executor):
+    """Run submitted calls immediately, in the calling thread"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+async def probe(client: httpx.AsyncClient, headers: dict, stop: asyncio.Event, interval: float):
+    """
+    Request the probe endpoint every `interval` seconds until `stop` is set. Latencies are
+    measured from when each request was due, so time spent waiting for a blocked event loop
+    counts.
+    """
+    latencies = []
+    due = time.perf_counter()
+    while not stop.is_set():
+        response = await client.get("/entities/gender", headers=headers)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - due)
+        due = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def summary(name: str, latencies: list[float]) -> str:
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return (
+        f"{name:<8}{len(latencies):>8}{p50 * 1000:>12.1f}{p99 * 1000:>12.1f}"
+        f"{latencies[-1] * 1000:>12.1f}"
+    )
+
+
+async def run(logins: int, duration: float, interval: float):
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"app": ["app.models"]})
+    await Tortoise.generate_schemas()
+    await Gender.create(slug="male", name="Masculino")
+    data_source = await DataSource.create(name="vitacare")
+    await User.create(
+        username="vitacare",
+        email="vitacare@example.com",
+        password=await utils.password_hash("secret"),
+        data_source=data_source,
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        form = {"username": "vitacare", "password": "secret"}
+        token = (await client.post("/auth/token", data=form)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        stop = asyncio.Event()
+        idle = asyncio.create_task(probe(client, headers, stop, interval))
+        await asyncio.sleep(duration)
+        stop.set()
+        idle_latencies = await idle
+
+        stop = asyncio.Event()
+        burst = asyncio.create_task(probe(client, headers, stop, interval))
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *(client.post("/auth/token", data=form) for _ in range(logins))
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        burst_latencies = await burst
+    await Tortoise.close_connections()
+
+    assert all(response.status_code == 200 for response in responses)
+    print(f"{logins} logins in {elapsed:.2f} s ({logins / elapsed:.1f} logins/s)")
+    print(f"{'probe':<8}{'requests':>8}{'p50 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+    print(summary("idle", idle_latencies))
+    print(summary("burst", burst_latencies))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds of idle probing")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between probes")
+    parser.add_argument("--inline", action="store_true", help="Hash on the event loop")
+    args = parser.parse_args()
+
+    if args.inline:
+        utils.password_pool = InlineExecutor()
+    asyncio.run(run(args.logins, args.duration, args.interval))
+
+
+if __name__ == "__main__":
+    main()
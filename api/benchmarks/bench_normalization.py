@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the throughput of the raw patient normalization on a single core, without the database.
+
+The target is 1M records in under 2 minutes, i.e. about 8.5k records/s.
+
+Usage:
+    ENVIRONMENT=dev python benchmarks/bench_normalization.py [--records 100000] [--batch 10000]
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.lookups import LookupTables  # noqa: E402
+from app.models import Gender, Race, lookups  # noqa: E402
+from app.normalization import Normalizer  # noqa: E402
+
+TARGET = 1_000_000 / 120
+
+
+def make_cpf(index: int) -> str:
+    """A punctuated CPF with valid check digits"""
+    digits = [int(digit) for digit in f"{index % 10**9:09d}"]
+    for position in (9, 10):
+        total = sum(digit * weight for digit, weight in zip(digits, range(position + 1, 1, -1)))
+        digits.append(total * 10 % 11 % 10)
+    cpf = "".join(map(str, digits))
+    return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+
+
+def make_raw(index: int) -> dict:
+    """Build a raw record shaped like a data source extract"""
+    return {
+        "nu_cpf": make_cpf(index),
+        "cns": f"7{index:013d}0",
+        "name": f"MARIA JOSÉ DA CONCEIÇÃO {index}",
+        "mother": "ANA DA CONCEIÇÃO",
+        "birth_date": f"{index % 28 + 1:02d}/03/1985",
+        "sexo": "MF"[index % 2],
+        "race": "parda",
+        "deceased": "N",
+        "address": [
+            {
+                "use": "home",
+                "type": "physical",
+                "line": f"Rua São Clemente, {index % 1000}",
+                "city": "Rio de Janeiro",
+                "state": "Rio de Janeiro",
+                "country": "Brasil",
+                "period": {"start": "2020-01-01T00:00:00"},
+            }
+        ],
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    args = parser.parse_args()
+
+    instances = {model: [] for model in lookups.keys}
+    instances[Gender] = [Gender(slug="male"), Gender(slug="female")]
+    instances[Race] = [Race(name="Parda")]
+    tables = LookupTables(0, lookups.keys, instances)
+    normalizer = Normalizer(columns={"cpf": "nu_cpf", "gender": "sexo"})
+    records = [make_raw(index) for index in range(args.records)]
+
+    start, normalized = time.perf_counter(), 0
+    for start_index in range(0, args.records, args.batch):
+        end_index = start_index + args.batch
+        patients, _ = normalizer.normalize(records[start_index:end_index], tables, "bench")
+        normalized += len(patients)
+    rate = args.records / (time.perf_counter() - start)
+    print(f"{normalized:,} of {args.records:,} records normalized")
+    print(f"{'records/s':<12}{rate:>14,.0f}{'met' if rate >= TARGET else 'missed':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures of the pytest-benchmark suite.
+
+The app runs in-process against `BENCH_DB_URL` (an in-memory SQLite by default) seeded with
+`BENCH_PATIENTS` synthetic patients. Every benchmark records the database queries of a single
+call in its `extra_info`, which pytest-benchmark includes in its JSON output.
+"""
+import asyncio
+import logging
+import os
+
+import httpx
+import pytest
+from tortoise import Tortoise
+
+from load import PASSWORD, USERNAME, QueryCounter, prepare_in_process
+
+BENCH_DB_URL = os.getenv("BENCH_DB_URL", "sqlite://:memory:")
+BENCH_PATIENTS = int(os.getenv("BENCH_PATIENTS", "10000"))
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def client(loop):
+    app = loop.run_until_complete(prepare_in_process(BENCH_DB_URL, BENCH_PATIENTS))
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    form = {"username": USERNAME, "password": PASSWORD}
+    response = loop.run_until_complete(client.post("/auth/token", data=form))
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    yield client
+    loop.run_until_complete(client.aclose())
+    loop.run_until_complete(Tortoise.close_connections())
+
+
+@pytest.fixture
+def run(loop, benchmark):
+    """
+    Benchmark `request()`, an async callable returning a response, after counting the queries of
+    one call.
+    """
+    counter = QueryCounter()
+    db_logger = logging.getLogger("tortoise.db_client")
+
+    def run(request, rounds: int = 50) -> httpx.Response:
+        level = db_logger.level
+        db_logger.setLevel(logging.DEBUG)
+        db_logger.addHandler(counter)
+        try:
+            response = loop.run_until_complete(request())
+        finally:
+            db_logger.removeHandler(counter)
+            db_logger.setLevel(level)
+        response.raise_for_status()
+        benchmark.extra_info["queries"] = counter.count
+        benchmark.extra_info["patients"] = BENCH_PATIENTS
+        return benchmark.pedantic(
+            lambda: loop.run_until_complete(request()), rounds=rounds, warmup_rounds=1
+        )
+
+    return run
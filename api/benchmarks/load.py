@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous load generator for the API.
+
+Each scenario keeps `--concurrency` clients requesting one endpoint for `--duration` seconds and
+reports the throughput, the p50/p95/p99 latencies and, when the app runs in-process, the database
+queries per request. Results are written as JSON; pass a previous results file as `--baseline` to
+print the change of each metric and fail when throughput or p99 regress beyond `--tolerance`.
+
+By default the app runs in-process against a database seeded with `--patients` synthetic
+patients (`--db-url`, defaults to an in-memory SQLite). With `--url`, a running deployment is
+targeted instead, authenticating as `--username`/`--password`; its database is not seeded.
+
+Usage:
+    ENVIRONMENT=dev python benchmarks/load.py --patients 10000 --output results.json
+    ENVIRONMENT=dev python benchmarks/load.py --baseline results.json
+    python benchmarks/load.py --url http://localhost:8001 --username u --password p
+"""
+import asyncio
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from itertools import count
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from synthetic import DATA_SOURCE, init_database, make_patient, seed_patients  # noqa: E402
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+
+
+class QueryCounter(logging.Handler):
+    """Count the SQL statements Tortoise sends to the database"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+
+
+class Scenarios:
+    """The benchmarked requests, each an `async (client) -> Response` method"""
+
+    def __init__(self, patients: int, username: str, password: str):
+        self.patients = patients
+        self.username = username
+        self.password = password
+        # Created patients get indexes after the seeded ones, so every request is a creation.
+        self.new_indexes = count(10**9)
+
+    def random_cpf(self) -> str:
+        return make_patient(random.randint(1, max(self.patients, 1))).cpf
+
+    async def patients_list(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get("/patients", params={"limit": 100})
+
+    async def patients_filter(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get("/patients", params={"cpf": self.random_cpf()})
+
+    async def patient_read(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get(f"/patients/{self.random_cpf()}")
+
+    async def patient_create(self, client: httpx.AsyncClient) -> httpx.Response:
+        patient = make_patient(next(self.new_indexes))
+        return await client.post("/patients", content=patient.model_dump_json())
+
+    async def auth(self, client: httpx.AsyncClient) -> httpx.Response:
+        form = {"username": self.username, "password": self.password}
+        return await client.post("/auth/token", data=form)
+
+    async def entities(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get("/entities/gender")
+
+
+SCENARIOS = (
+    "patients_list",
+    "patients_filter",
+    "patient_read",
+    "patient_create",
+    "auth",
+    "entities",
+)
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    request,
+    concurrency: int,
+    duration: float,
+    counter: QueryCounter | None,
+) -> dict:
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await request(client)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    if counter is not None:
+        counter.count = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+    if counter is not None:
+        result["queries_per_request"] = counter.count / len(latencies)
+    return result
+
+
+async def prepare_in_process(db_url: str, patients: int):
+    """Seed the database and return the in-process app"""
+    # Imported here so that targeting a deployment does not require the app's settings.
+    from app.main import app
+    from app.models import DataSource, PatientRecord, User
+    from app.utils import password_hash
+
+    await init_database(db_url)
+    data_source = await DataSource.get(name=DATA_SOURCE)
+    seeded = await PatientRecord.filter(data_source=data_source).count()
+    if seeded < patients:
+        await seed_patients(patients - seeded, seeded + 1)
+    if not await User.exists(username=USERNAME):
+        await User.create(
+            username=USERNAME,
+            email=f"{USERNAME}@example.com",
+            password=await password_hash(PASSWORD),
+            data_source=data_source,
+        )
+    return app
+
+
+async def run(args) -> dict:
+    if args.url:
+        transport, base_url, counter = None, args.url, None
+        username, password = args.username, args.password
+    else:
+        app = await prepare_in_process(args.db_url, args.patients)
+        transport, base_url = httpx.ASGITransport(app=app), "http://benchmark"
+        username, password = USERNAME, PASSWORD
+        counter = QueryCounter()
+        db_logger = logging.getLogger("tortoise.db_client")
+        db_logger.setLevel(logging.DEBUG)
+        db_logger.addHandler(counter)
+    scenarios = Scenarios(args.patients, username, password)
+
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) as client:
+        response = await scenarios.auth(client)
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        for name in args.scenarios:
+            request = getattr(scenarios, name)
+            # Warm up connections and caches before measuring.
+            await run_scenario(client, request, args.concurrency, min(args.duration, 1), None)
+            results[name] = await run_scenario(
+                client, request, args.concurrency, args.duration, counter
+            )
+            print(format_result(name, results[name]), flush=True)
+    if not args.url:
+        from tortoise import Tortoise
+
+        await Tortoise.close_connections()
+
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "target": args.url or args.db_url.split("://")[0],
+            "patients": args.patients,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+        },
+        "results": results,
+    }
+
+
+def format_result(name: str, result: dict) -> str:
+    queries = result.get("queries_per_request")
+    return (
+        f"{name:<16}{result['requests_per_second']:>10,.1f}{result['p50_ms']:>10.1f}"
+        f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+        f"{'-' if queries is None else f'{queries:.1f}':>10}{result['errors']:>8}"
+    )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Print the change of each metric, returning the regressions beyond `tolerance`"""
+    regressions = []
+    print(f"\n{'change':<16}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'queries':>10}")
+    for name, result in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        changes = {
+            metric: result[metric] / before[metric] - 1 if before[metric] else 0.0
+            for metric in ("requests_per_second", "p50_ms", "p95_ms", "p99_ms")
+        }
+        queries = result.get("queries_per_request", 0) - before.get("queries_per_request", 0)
+        print(
+            f"{name:<16}"
+            + "".join(f"{change:>+10.0%}" for change in changes.values())
+            + f"{queries:>+10.1f}"
+        )
+        if changes["requests_per_second"] < -tolerance:
+            regressions.append(f"{name}: throughput {changes['requests_per_second']:+.0%}")
+        if changes["p99_ms"] > tolerance:
+            regressions.append(f"{name}: p99 latency {changes['p99_ms']:+.0%}")
+        if queries > 0:
+            regressions.append(f"{name}: {queries:+.1f} queries per request")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--url", help="Target a running deployment instead of the app in-process")
+    parser.add_argument("--username", default=USERNAME)
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--db-url", default="sqlite://:memory:")
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"{'scenario':<16}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", end="")
+    print(f"{'queries':>10}{'errors':>8}")
+    results = asyncio.run(run(args))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
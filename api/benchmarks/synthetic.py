@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data for the benchmarks: the reference entities of `scripts/database_initial_data.py`
+and deterministic patients, generated lazily so that 1M patients never live in memory at once.
+
+Usage, to seed a database outside of the benchmarks:
+    ENVIRONMENT=dev python benchmarks/synthetic.py --db-url postgres://... --patients 100000
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from tortoise import Tortoise, run_async
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.models import (  # noqa: E402
+    AddressType,
+    AddressUse,
+    City,
+    Country,
+    DataSource,
+    Ethnicity,
+    Gender,
+    Nationality,
+    PatientRecord,
+    Race,
+    State,
+    TelecomSystem,
+    TelecomUse,
+    lookups,
+)
+from app.pydantic_models import (  # noqa: E402
+    AddressModel,
+    PatientModel,
+    PeriodModel,
+    TelecomModel,
+)
+
+DATA_SOURCE = "vitacare"
+FIRST_NAMES = ("Maria", "José", "Ana", "João", "Antônio", "Francisca", "Carlos", "Adriana")
+SURNAMES = ("Silva", "Santos", "Oliveira", "Souza", "Rodrigues", "Ferreira", "Alves", "Pereira")
+STREETS = ("Rua São Clemente", "Avenida Brasil", "Rua Voluntários da Pátria", "Rua do Catete")
+
+
+async def init_database(db_url: str = "sqlite://:memory:") -> None:
+    """Connect to `db_url`, create the tables if needed and seed the reference entities"""
+    await Tortoise.init(db_url=db_url, modules={"app": ["app.models"]})
+    await Tortoise.generate_schemas(safe=True)
+    if not await DataSource.exists(name=DATA_SOURCE):
+        await seed_entities()
+    lookups.invalidate()
+
+
+async def seed_entities() -> None:
+    country = await Country.create(name="Brasil")
+    state = await State.create(name="Rio de Janeiro", country=country)
+    await City.create(name="Rio de Janeiro", state=state)
+    await DataSource.create(name=DATA_SOURCE)
+    await Gender.create(slug="male", name="Masculino")
+    await Race.create(slug="parda", name="Parda")
+    await Ethnicity.create(slug="pataxo", name="PATAXO")
+    await Nationality.create(slug="b", name="B")
+    await AddressUse.create(slug="home", name="Residencial")
+    await AddressType.create(slug="physical", name="Físico")
+    await TelecomUse.create(slug="home", name="Residencial")
+    await TelecomSystem.create(slug="phone", name="Telefone")
+
+
+def make_patient(index: int, data_source_name: str = DATA_SOURCE) -> PatientModel:
+    """Build the patient number `index`: the same index always yields the same patient"""
+    period = PeriodModel(start="2020-01-01T00:00:00")
+    return PatientModel(
+        birth_city="Rio de Janeiro",
+        birth_state="Rio de Janeiro",
+        birth_country="Brasil",
+        birth_date=date(1940, 1, 1) + timedelta(days=index * 7 % 30000),
+        cpf=f"{index:011d}",
+        cns=f"7{index:014d}",
+        data_source_name=data_source_name,
+        ethnicity="PATAXO",
+        gender="male",
+        name=(
+            f"{FIRST_NAMES[index % len(FIRST_NAMES)]} "
+            f"{SURNAMES[index // len(FIRST_NAMES) % len(SURNAMES)]} {index}"
+        ),
+        nationality="B",
+        race="Parda",
+        address=[
+            AddressModel(
+                use="home",
+                type="physical",
+                line=f"{STREETS[(index + number) % len(STREETS)]}, {index % 1000 + number}",
+                city="Rio de Janeiro",
+                state="Rio de Janeiro",
+                country="Brasil",
+                period=period,
+            )
+            for number in range(1 + index % 2)
+        ],
+        telecom=[
+            TelecomModel(system="phone", use="home", value=f"21{index % 10**9:09d}", period=period)
+        ],
+    )
+
+
+def generate_patients(count: int, start: int = 1) -> Iterator[PatientModel]:
+    for index in range(start, start + count):
+        yield make_patient(index)
+
+
+async def seed_patients(count: int, start: int = 1, batch_size: int = 1000) -> None:
+    """Write `count` synthetic patients, `batch_size` at a time"""
+    patients = generate_patients(count, start)
+    while batch := list(islice(patients, batch_size)):
+        _, errors = await PatientRecord.upsert_from_pydantic_models(batch)
+        if errors:
+            raise ValueError(f"Unable to seed patients: {errors}")
+
+
+async def run(db_url: str, count: int, batch_size: int):
+    await init_database(db_url)
+    start = time.perf_counter()
+    await seed_patients(count, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"{count} patients written in {elapsed:.1f} s ({count / elapsed:,.0f} patients/s)")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--db-url", required=True)
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    run_async(run(args.db_url, args.patients, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
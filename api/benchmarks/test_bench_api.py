@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Latency of the main endpoints, with pytest-benchmark.
+
+Usage:
+    ENVIRONMENT=dev pytest benchmarks --benchmark-json=results.json
+    ENVIRONMENT=dev pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:10%
+"""
+from itertools import count
+
+from synthetic import make_patient
+
+new_indexes = count(10**9)
+
+
+def test_patients_list(client, run):
+    response = run(lambda: client.get("/patients", params={"limit": 100}))
+    assert len(response.json()) == 100
+
+
+def test_patients_filter_by_cpf(client, run):
+    response = run(lambda: client.get("/patients", params={"cpf": make_patient(1).cpf}))
+    assert len(response.json()) == 1
+
+
+def test_patient_read(client, run):
+    response = run(lambda: client.get(f"/patients/{make_patient(1).cpf}"))
+    assert response.json()["cpf"] == make_patient(1).cpf
+
+
+def test_patient_create(client, run):
+    def create():
+        patient = make_patient(next(new_indexes))
+        return client.post("/patients", content=patient.model_dump_json())
+
+    assert run(create).status_code == 201
+
+
+def test_auth(client, run):
+    form = {"username": "benchmark", "password": "benchmark"}
+    response = run(lambda: client.post("/auth/token", data=form), rounds=5)
+    assert "access_token" in response.json()
+
+
+def test_entities(client, run):
+    response = run(lambda: client.get("/entities/gender"))
+    assert response.json()[0]["slug"] == "male"
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "patientrecord"
+            ADD "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP;
+        ALTER TABLE "patientrecord"
+            ADD "updated_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP;
+        CREATE INDEX "idx_patientreco_birth_d_28d092" ON "patientrecord" ("birth_date");
+        CREATE INDEX "idx_patientreco_data_so_7a3d38" ON "patientrecord" ("data_source_id", "id");
+        CREATE INDEX "idx_patientreco_updated_127ba0" ON "patientrecord" ("updated_at", "id");
+        CREATE INDEX "idx_patientreco_name_upper"
+            ON "patientrecord" (UPPER(CAST("name" AS VARCHAR)) text_pattern_ops);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_patientreco_name_upper";
+        DROP INDEX IF EXISTS "idx_patientreco_updated_127ba0";
+        DROP INDEX IF EXISTS "idx_patientreco_data_so_7a3d38";
+        DROP INDEX IF EXISTS "idx_patientreco_birth_d_28d092";
+        ALTER TABLE "patientrecord" DROP COLUMN "updated_at";
+        ALTER TABLE "patientrecord" DROP COLUMN "created_at";"""
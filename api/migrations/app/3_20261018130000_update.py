@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Data sources were not unique by name: merge the duplicates into the first of each name
+    # before indexing it. When a patient has records in several of them, the most recently
+    # updated record is kept, and takes over the CNSs, addresses and telecoms of the others
+    # before they are deleted.
+    return """
+        CREATE TEMPORARY TABLE "datasource_merge" AS
+            SELECT "id", FIRST_VALUE("id") OVER (PARTITION BY "name" ORDER BY "id") AS "kept_id"
+            FROM "datasource";
+        DELETE FROM "datasource_merge" WHERE "id" = "kept_id";
+        CREATE TEMPORARY TABLE "patientrecord_merge" AS
+            SELECT "id", "kept_id" FROM (
+                SELECT r."id", FIRST_VALUE(r."id") OVER (
+                    PARTITION BY r."patient_id", COALESCE(m."kept_id", r."data_source_id")
+                    ORDER BY r."updated_at" DESC, r."id" DESC
+                ) AS "kept_id"
+                FROM "patientrecord" r LEFT JOIN "datasource_merge" m ON m."id" = r."data_source_id"
+            ) ranked
+            WHERE "id" != "kept_id";
+        UPDATE "cns" SET "patient_id" = m."kept_id", "is_main" = FALSE
+            FROM "patientrecord_merge" m WHERE "cns"."patient_id" = m."id";
+        UPDATE "addresspatientperiod" SET "patient_id" = m."kept_id"
+            FROM "patientrecord_merge" m WHERE "addresspatientperiod"."patient_id" = m."id";
+        UPDATE "telecompatientperiod" SET "patient_id" = m."kept_id"
+            FROM "patientrecord_merge" m WHERE "telecompatientperiod"."patient_id" = m."id";
+        DELETE FROM "patientrecord" WHERE "id" IN (SELECT "id" FROM "patientrecord_merge");
+        UPDATE "patientrecord" SET "data_source_id" = m."kept_id"
+            FROM "datasource_merge" m WHERE "patientrecord"."data_source_id" = m."id";
+        UPDATE "rawpatientrecord" SET "data_source_id" = m."kept_id"
+            FROM "datasource_merge" m WHERE "rawpatientrecord"."data_source_id" = m."id";
+        UPDATE "user" SET "data_source_id" = m."kept_id"
+            FROM "datasource_merge" m WHERE "user"."data_source_id" = m."id";
+        DELETE FROM "datasource" WHERE "id" IN (SELECT "id" FROM "datasource_merge");
+        DROP TABLE "patientrecord_merge";
+        DROP TABLE "datasource_merge";
+        CREATE UNIQUE INDEX "uid_datasource_name_4726cf" ON "datasource" ("name");
+        CREATE INDEX "idx_state_country_a897e8" ON "state" ("country_id", "name");
+        CREATE INDEX "idx_city_state_i_9807ba" ON "city" ("state_id", "name");
+        CREATE INDEX "idx_cns_patient_d43cd4" ON "cns" ("patient_id");
+        CREATE INDEX "idx_addresspati_address_6b6dd3" ON "addresspatientperiod" ("address_id");
+        CREATE INDEX "idx_addresspati_patient_c4f59f" ON "addresspatientperiod" ("patient_id");
+        CREATE INDEX "idx_telecompati_patient_139242" ON "telecompatientperiod" ("patient_id");
+        CREATE INDEX "idx_telecompati_telecom_192bd2" ON "telecompatientperiod" ("telecom_id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_telecompati_telecom_192bd2";
+        DROP INDEX IF EXISTS "idx_telecompati_patient_139242";
+        DROP INDEX IF EXISTS "idx_addresspati_patient_c4f59f";
+        DROP INDEX IF EXISTS "idx_addresspati_address_6b6dd3";
+        DROP INDEX IF EXISTS "idx_cns_patient_d43cd4";
+        DROP INDEX IF EXISTS "idx_city_state_i_9807ba";
+        DROP INDEX IF EXISTS "idx_state_country_a897e8";
+        DROP INDEX IF EXISTS "uid_datasource_name_4726cf";"""
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "address" ADD "content_hash" VARCHAR(32)  UNIQUE;
+        ALTER TABLE "telecom" ADD "content_hash" VARCHAR(32)  UNIQUE;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "telecom" DROP COLUMN "content_hash";
+        ALTER TABLE "address" DROP COLUMN "content_hash";"""
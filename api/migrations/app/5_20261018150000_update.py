@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "goldenrecord" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "data" JSONB NOT NULL,
+    "sources" JSONB NOT NULL,
+    "updated_at" TIMESTAMPTZ NOT NULL,
+    "patient_id" UUID NOT NULL UNIQUE REFERENCES "patient" ("id") ON DELETE CASCADE
+);
+COMMENT ON TABLE "goldenrecord" IS
+    'The golden record of a patient, merging its records by the rules of `app.golden`.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "goldenrecord";"""
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "patientchange" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "pushed_at" TIMESTAMPTZ,
+    "fhir_version_id" VARCHAR(64),
+    "attempts" INT NOT NULL  DEFAULT 0,
+    "error" TEXT,
+    "record_id" INT NOT NULL REFERENCES "patientrecord" ("id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "idx_patientchan_fhir_ve_ea88fd" ON "patientchange" ("fhir_version_id");
+CREATE INDEX IF NOT EXISTS "idx_patientchan_record__8e563f" ON "patientchange" ("record_id");
+CREATE INDEX IF NOT EXISTS "idx_patientchan_pushed__201fd9"
+    ON "patientchange" ("pushed_at", "attempts", "id");
+COMMENT ON TABLE "patientchange" IS
+    'A write of a patient record, waiting in the outbox to be pushed to the FHIR store.';
+        CREATE TABLE IF NOT EXISTS "syncwatermark" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "name" VARCHAR(64) NOT NULL UNIQUE,
+    "value" VARCHAR(64) NOT NULL,
+    "updated_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE "syncwatermark" IS
+    'How far the sync with the FHIR store has read a resource type, '
+    'as a `_lastUpdated` instant.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "syncwatermark";
+        DROP TABLE IF EXISTS "patientchange";"""
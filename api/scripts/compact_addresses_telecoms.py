@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from argparse import ArgumentParser
+
+from tortoise import Tortoise, run_async
+
+from app.compaction import ITEM_MODELS, compact
+from app.db import TORTOISE_ORM
+
+
+async def run(batch_size: int):
+    await Tortoise.init(config=TORTOISE_ORM)
+    for item_field in ITEM_MODELS:
+        await compact(item_field, batch_size)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    run_async(run(args.batch_size))
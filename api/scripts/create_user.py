@@ -17,7 +17,7 @@ async def run(username: str, password: str, is_admin: bool):
     await User.create(
         username=username,
         email=f"{username}@example.com",
-        password=password_hash(password),
+        password=await password_hash(password),
         is_active=True,
         is_superuser=is_admin,
     )
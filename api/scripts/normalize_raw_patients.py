@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import json
+from argparse import ArgumentParser
+
+from loguru import logger
+from tortoise import Tortoise, run_async
+
+from app.db import TORTOISE_ORM
+from app.normalization import Normalizer, normalize_data_source
+
+
+async def run(data_source_name: str, config_path: str | None, batch_size: int):
+    await Tortoise.init(config=TORTOISE_ORM)
+    # The columns, date formats and aliases of the data source, as the `Normalizer` arguments.
+    options = {}
+    if config_path:
+        with open(config_path) as config_file:
+            options = json.load(config_file)
+    options["date_formats"] = tuple(options.get("date_formats", Normalizer().date_formats))
+    written, rejected = await normalize_data_source(
+        data_source_name, Normalizer(**options), batch_size
+    )
+    logger.info(f"{data_source_name}: {written} patients written, {rejected} rejected")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("data_source", help="Name of the data source to normalize")
+    parser.add_argument("--config", help="JSON file of the normalizer arguments")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+    run_async(run(args.data_source, args.config, args.batch_size))
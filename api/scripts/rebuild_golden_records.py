@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from argparse import ArgumentParser
+
+from loguru import logger
+from tortoise import Tortoise, run_async
+
+from app.db import TORTOISE_ORM
+from app.models import GoldenRecord, Patient
+from app.pagination import iter_batches
+
+
+async def run(batch_size: int):
+    await Tortoise.init(config=TORTOISE_ORM)
+    rebuilt = 0
+    async for patients in iter_batches(Patient.all(), batch_size):
+        await GoldenRecord.refresh(patient.id for patient in patients)
+        rebuilt += len(patients)
+        logger.info(f"{rebuilt} golden records rebuilt")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    run_async(run(args.batch_size))
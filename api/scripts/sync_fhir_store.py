@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from argparse import ArgumentParser
+
+from fhir_utils import AsyncFastCRUD
+from tortoise import Tortoise, run_async
+
+from app import config
+from app.db import TORTOISE_ORM
+from app.models import DataSource, lookups
+from app.sync import FhirSync
+
+
+async def run(once: bool):
+    await Tortoise.init(config=TORTOISE_ORM)
+    # The patients pulled from the FHIR store are written as records of their own data source.
+    _, created = await DataSource.get_or_create(name=config.FHIR_SYNC_DATA_SOURCE)
+    if created:
+        lookups.invalidate()
+    async with AsyncFastCRUD(config.FHIR_SYNC_PROJECT_ID, config.FHIR_SYNC_LOCATION) as crud:
+        sync = FhirSync(crud, config.FHIR_SYNC_DATASET_ID, config.FHIR_SYNC_FHIR_STORE_ID)
+        if once:
+            await sync.run_once()
+        else:
+            await sync.run_forever()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--once", action="store_true", help="Sync once instead of forever")
+    args = parser.parse_args()
+    run_async(run(args.once))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import date
+
+import fakeredis
+import httpx
+import pytest
+from tortoise import Tortoise
+
+# Imported before Tortoise is initialized, as in production, so that the Pydantic models of the
+# routers do not pick up reverse relations.
+from app.cache import response_cache
+from app.dependencies import principals
+from app.main import app
+from app.models import (
+    AddressType,
+    AddressUse,
+    City,
+    Country,
+    DataSource,
+    Ethnicity,
+    Gender,
+    Nationality,
+    Race,
+    State,
+    TelecomSystem,
+    TelecomUse,
+    User,
+    lookups,
+)
+from app.pydantic_models import AddressModel, PatientModel, PeriodModel, TelecomModel
+from app.utils import create_access_token
+
+
+class QueryCounter(logging.Handler):
+    """Count the SQL statements Tortoise sends to the database"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+
+
+@pytest.fixture
+async def db():
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"app": ["app.models"]})
+    await Tortoise.generate_schemas()
+    lookups.invalidate()
+    response_cache.local.clear()
+    principals.invalidate()
+    yield
+    await Tortoise.close_connections()
+
+
+@pytest.fixture
+async def entities(db):
+    await create_entities()
+
+
+async def create_entities():
+    """Create the reference entities of `scripts/database_initial_data.py`"""
+    country = await Country.create(name="Brasil")
+    state = await State.create(name="Rio de Janeiro", country=country)
+    await City.create(name="Rio de Janeiro", state=state)
+    await DataSource.create(name="vitacare")
+    await Gender.create(slug="male", name="Masculino")
+    await Race.create(slug="parda", name="Parda")
+    await Ethnicity.create(slug="pataxo", name="PATAXO")
+    await Nationality.create(slug="b", name="B")
+    await AddressUse.create(slug="home", name="Residencial")
+    await AddressType.create(slug="physical", name="Físico")
+    await TelecomUse.create(slug="home", name="Residencial")
+    await TelecomSystem.create(slug="phone", name="Telefone")
+    lookups.invalidate()
+
+
+@pytest.fixture
+async def client(db):
+    # The ASGI transport does not run the lifespan events, so the app uses the `db` connection.
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://testserver"
+    ) as client:
+        yield client
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """Back the response cache with an in-process Redis stand-in"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(response_cache, "redis", fakeredis.aioredis.FakeRedis(server=server))
+    return server
+
+
+async def create_user(username: str, data_source_name: str = None, **kwargs) -> User:
+    data_source = await DataSource.get(name=data_source_name) if data_source_name else None
+    return await User.create(
+        username=username,
+        email=f"{username}@example.com",
+        data_source=data_source,
+        **{"password": "not-a-hash", **kwargs},
+    )
+
+
+def auth_headers(user: User) -> dict:
+    return {"Authorization": f"Bearer {create_access_token({'sub': user.username})}"}
+
+
+@pytest.fixture
+def query_counter():
+    counter = QueryCounter()
+    db_logger = logging.getLogger("tortoise.db_client")
+    level = db_logger.level
+    db_logger.setLevel(logging.DEBUG)
+    db_logger.addHandler(counter)
+    yield counter
+    db_logger.removeHandler(counter)
+    db_logger.setLevel(level)
+
+
+def make_patient(index: int, data_source_name: str = "vitacare") -> PatientModel:
+    """Build a patient referencing the `entities` fixture"""
+    period = PeriodModel(start="2020-01-01T00:00:00")
+    return PatientModel(
+        birth_city="Rio de Janeiro",
+        birth_state="Rio de Janeiro",
+        birth_country="Brasil",
+        birth_date=date(1990, 1, 1),
+        cpf=f"{index:011d}",
+        cns=f"{index:015d}",
+        data_source_name=data_source_name,
+        ethnicity="PATAXO",
+        gender="male",
+        name=f"Paciente {index}",
+        nationality="B",
+        race="Parda",
+        address=[
+            AddressModel(
+                use="home",
+                type="physical",
+                line=f"Rua {index}, {number}",
+                city="Rio de Janeiro",
+                state="Rio de Janeiro",
+                country="Brasil",
+                period=period,
+            )
+            for number in range(2)
+        ],
+        telecom=[
+            TelecomModel(system="phone", use="home", value=f"21{index:09d}", period=period),
+        ],
+    )
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from app.utils import password_hash, password_verify
+from tests.conftest import create_user
+
+
+async def test_login(client, entities):
+    await create_user("vitacare", "vitacare", password=await password_hash("secret"))
+
+    response = await client.post("/auth/token", data={"username": "vitacare", "password": "secret"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    response = await client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["username"] == "vitacare"
+
+    response = await client.post("/auth/token", data={"username": "vitacare", "password": "wrong"})
+    assert response.status_code == 401
+
+
+async def test_password_hashing_does_not_block_the_event_loop():
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.001)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0)
+    hashed = await password_hash("secret")
+    assert await password_verify("secret", hashed)
+    ticker.cancel()
+
+    # Hashing twice with bcrypt takes hundreds of milliseconds, during which the loop kept running.
+    assert ticks > 10
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import time
+
+from app.cache import KEY_PREFIX, LocalCache, patient_key, response_cache
+from app.models import DataSource, PatientRecord, lookups
+from tests.conftest import auth_headers, create_user, make_patient
+
+
+def test_local_cache_evicts_least_recently_used_and_expired_entries(monkeypatch):
+    cache = LocalCache(max_entries=2)
+    cache.set("a", b"1", 10)
+    cache.set("b", b"2", 10)
+    assert cache.get("a") == b"1"
+    cache.set("c", b"3", 10)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("c") is None
+
+
+async def test_entities_list_is_cached_with_etag(client, entities, redis_server):
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    response = await client.get("/entities/gender", headers=headers)
+    assert response.status_code == 200
+    assert [gender["slug"] for gender in response.json()] == ["male"]
+    etag = response.headers["etag"]
+    assert await response_cache.redis.exists(f"{KEY_PREFIX}:entities:gender")
+
+    response = await client.get("/entities/gender", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = await client.post(
+        "/entities/gender", json={"slug": "female", "name": "Feminino"}, headers=headers
+    )
+    assert response.status_code == 201
+    response = await client.get("/entities/gender", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert [gender["slug"] for gender in response.json()] == ["male", "female"]
+
+
+async def test_entity_updates_invalidate_the_cached_list(client, entities, redis_server):
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+    (gender,) = (await client.get("/entities/gender", headers=headers)).json()
+
+    response = await client.patch(
+        f"/entities/gender/{gender['id']}",
+        json={"slug": "male", "name": "Homem"},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    response = await client.get("/entities/gender", headers=headers)
+    assert [gender["name"] for gender in response.json()] == ["Homem"]
+
+    response = await client.delete(f"/entities/gender/{gender['id']}", headers=headers)
+    assert response.json() == {"deleted": True}
+    assert (await client.get("/entities/gender", headers=headers)).json() == []
+
+
+async def test_patient_reads_are_namespaced_by_data_source(client, entities, redis_server):
+    await DataSource.create(name="other")
+    lookups.invalidate()
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    other_patient = make_patient(1, "other")
+    other_patient.name = "Outro Nome"
+    other_patient.cns = make_patient(2).cns
+    await PatientRecord.upsert_from_pydantic_model(other_patient)
+    vitacare = auth_headers(await create_user("vitacare", "vitacare"))
+    other = auth_headers(await create_user("other", "other"))
+
+    for _ in range(2):
+        assert (await client.get("/patients/00000000001", headers=vitacare)).json()[
+            "name"
+        ] == "Paciente 1"
+        assert (await client.get("/patients/00000000001", headers=other)).json()[
+            "name"
+        ] == "Outro Nome"
+    assert (await client.get("/patients/00000000002", headers=other)).status_code == 404
+
+
+async def test_patient_writes_update_the_cache(client, entities, redis_server):
+    user = await create_user("vitacare", "vitacare")
+    headers = auth_headers(user)
+    payload = make_patient(1).model_dump(mode="json")
+    await client.post("/patients", json=payload, headers=headers)
+    key = f"{KEY_PREFIX}:{patient_key(user.data_source_id, '00000000001')}"
+    assert await response_cache.redis.exists(key)
+
+    payload["name"] = "Nome Novo"
+    await client.post("/patients/bulk", json=[payload], headers=headers)
+    assert not await response_cache.redis.exists(key)
+
+    response = await client.get("/patients/00000000001", headers=headers)
+    assert response.json()["name"] == "Nome Novo"
+
+
+async def test_upserts_outside_the_routes_invalidate_the_cache(client, entities, redis_server):
+    user = await create_user("vitacare", "vitacare")
+    headers = auth_headers(user)
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    await client.get("/patients/00000000001", headers=headers)
+    key = f"{KEY_PREFIX}:{patient_key(user.data_source_id, '00000000001')}"
+    assert await response_cache.redis.exists(key)
+
+    patient = make_patient(1)
+    patient.name = "Nome Novo"
+    await PatientRecord.upsert_from_pydantic_models([patient], record_changes=False)
+
+    assert not await response_cache.redis.exists(key)
+    response = await client.get("/patients/00000000001", headers=headers)
+    assert response.json()["name"] == "Nome Novo"
+
+
+async def test_entity_updates_invalidate_the_cached_patients(client, entities, redis_server):
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+    assert (await client.get("/patients/00000000001", headers=headers)).json()[
+        "gender"
+    ] == "Masculino"
+    (gender,) = (await client.get("/entities/gender", headers=headers)).json()
+
+    await client.patch(
+        f"/entities/gender/{gender['id']}",
+        json={"slug": "male", "name": "Homem"},
+        headers=headers,
+    )
+    response = await client.get("/patients/00000000001", headers=headers)
+    assert response.json()["gender"] == "Homem"
+
+
+async def test_falls_back_to_local_tier_when_redis_is_down(client, entities, redis_server):
+    redis_server.connected = False
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    first = await client.get("/entities/gender", headers=headers)
+    second = await client.get(
+        "/entities/gender", headers={**headers, "If-None-Match": first.headers["etag"]}
+    )
+
+    assert first.status_code == 200
+    assert second.status_code == 304
+    assert response_cache.local.get(f"{KEY_PREFIX}:entities:gender") is not None
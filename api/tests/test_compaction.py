@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from app.compaction import compact
+from app.models import Address, AddressPatientPeriod, PatientRecord, Telecom, TelecomPatientPeriod
+from tests.conftest import make_patient
+
+
+async def test_addresses_and_telecoms_are_shared(entities):
+    first = make_patient(1)
+    second = make_patient(2)
+    second.address = first.address
+    second.address[0].line = f"  {second.address[0].line.upper()} "
+    second.telecom = first.telecom
+
+    await PatientRecord.upsert_from_pydantic_models([first, second])
+
+    assert await Address.all().count() == 2
+    assert await Telecom.all().count() == 1
+    assert await AddressPatientPeriod.all().count() == 4
+
+    # Removing the address from a patient keeps it for the other one.
+    first.address = []
+    record, _ = await PatientRecord.upsert_from_pydantic_model(first)
+    assert (await record.to_pydantic_model()).address == []
+    assert await Address.all().count() == 2
+    record = await PatientRecord.get(patient__cpf=second.cpf)
+    assert len((await record.to_pydantic_model()).address) == 2
+
+
+async def test_compaction_merges_legacy_duplicates(entities):
+    records = []
+    for index in (1, 2):
+        record, _ = await PatientRecord.upsert_from_pydantic_model(make_patient(index))
+        records.append(record)
+    # Rows written before deduplication: unhashed, one copy per period.
+    legacy = await Address.get(line="Rua 1, 0")
+    for record in records:
+        copy = await Address.create(
+            use_id=legacy.use_id,
+            type_id=legacy.type_id,
+            line="RUA 1, 0",
+            city_id=legacy.city_id,
+        )
+        await AddressPatientPeriod.create(address=copy, patient=record, period_start=None)
+        await AddressPatientPeriod.create(address=copy, patient=record, period_start=None)
+    orphan = await Telecom.create(value="21999999999")
+    await Address.filter(id=legacy.id).update(content_hash=None)
+    before = [await record.to_pydantic_model() for record in records]
+
+    counts = await compact("address", batch_size=2)
+
+    assert counts == {"hashed": 1, "merged": 2, "periods_deleted": 2, "unused_deleted": 0}
+    assert await Address.filter(content_hash=None).count() == 0
+    assert await Address.filter(line__in=["Rua 1, 0", "RUA 1, 0"]).count() == 1
+    assert await AddressPatientPeriod.all().count() == 6
+    after = [await record.to_pydantic_model() for record in records]
+    assert [len(patient.address) for patient in after] == [3, 3]
+    assert [len(patient.address) for patient in before] == [4, 4]
+
+    assert (await compact("telecom"))["unused_deleted"] == 1
+    assert not await Telecom.exists(id=orphan.id)
+    assert await TelecomPatientPeriod.all().count() == 2
+    assert await compact("address") == {
+        "hashed": 0,
+        "merged": 0,
+        "periods_deleted": 0,
+        "unused_deleted": 0,
+    }
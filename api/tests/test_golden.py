@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.golden import SOURCE_PRIORITY, Survivorship
+from app.models import DataSource, GoldenRecord, PatientRecord, lookups
+from tests.conftest import auth_headers, create_user, make_patient
+
+NOW = datetime(2026, 1, 1)
+
+
+def test_survivorship_rules():
+    vitacare, other = make_patient(1), make_patient(1, "other")
+    vitacare.name, vitacare.mother = "Nome Antigo", "Mãe"
+    other.name, other.mother = "Nome Novo", None
+    other.address = other.address[:1]
+    other.address[0].period.start = NOW
+    records = [(vitacare, NOW - timedelta(days=1)), (other, NOW)]
+
+    patient, sources = Survivorship().merge(records)
+
+    assert patient.name == "Nome Novo"
+    assert patient.mother == "Mãe"
+    assert sources["name"] == "other"
+    assert sources["mother"] == "vitacare"
+    # The address in both records is only kept once.
+    assert [address.line for address in patient.address] == ["Rua 1, 0", "Rua 1, 1"]
+    assert patient.data_source_name is None
+
+    survivorship = Survivorship(["vitacare"], field_rules={"name": SOURCE_PRIORITY})
+    patient, sources = survivorship.merge(records)
+    assert (patient.name, sources["name"]) == ("Nome Antigo", "vitacare")
+
+
+def test_survivorship_rejects_unknown_rules():
+    with pytest.raises(ValueError, match="Unknown survivorship rule"):
+        Survivorship(default_rule="oldest")
+    with pytest.raises(ValueError, match="Unknown patient field"):
+        Survivorship(field_rules={"nickname": SOURCE_PRIORITY})
+
+
+async def test_golden_record_is_maintained_on_writes(client, entities):
+    await DataSource.create(name="other")
+    lookups.invalidate()
+    headers = auth_headers(await create_user("admin", is_superuser=True))
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+
+    response = await client.get("/patients/00000000001/golden", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "Paciente 1"
+    assert response.json()["sources"]["name"] == "vitacare"
+
+    other = make_patient(1, "other")
+    other.name = "Paciente Renomeado"
+    other.cns = None
+    other.telecom[0].value = "21999999999"
+    await PatientRecord.upsert_from_pydantic_models([other, make_patient(2)])
+
+    response = await client.get("/patients/00000000001/golden", headers=headers)
+    golden = response.json()
+    assert golden["name"] == "Paciente Renomeado"
+    assert golden["sources"]["name"] == "other"
+    assert golden["cns"] == make_patient(1).cns
+    assert golden["sources"]["cns"] == "vitacare"
+    assert {telecom["value"] for telecom in golden["telecom"]} == {"21000000001", "21999999999"}
+    assert await GoldenRecord.all().count() == 2
+
+
+async def test_golden_record_requires_a_superuser(client, entities):
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+    response = await client.get("/patients/00000000001/golden", headers=headers)
+    assert response.status_code == 403
+
+    headers = auth_headers(await create_user("admin", is_superuser=True))
+    response = await client.get("/patients/00000000002/golden", headers=headers)
+    assert response.status_code == 404
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from app.models import City, DataSource, Gender, PatientRecord, lookups
+from tests.conftest import auth_headers, create_user, make_patient
+
+
+async def test_lookup_tables_are_cached(entities, query_counter):
+    tables = await lookups.get()
+    query_counter.count = 0
+
+    assert await lookups.get() is tables
+    assert query_counter.count == 0
+    assert tables.get(Gender, "male").name == "Masculino"
+    city = tables.get(City, ("Rio de Janeiro", "Rio de Janeiro", "Brasil"))
+    assert tables.get_by_id(City, city.id) is city
+    assert tables.get(Gender, "unknown") is None
+
+
+async def test_invalidate_reloads_tables(entities):
+    tables = await lookups.get()
+    lookups.invalidate()
+
+    reloaded = await lookups.get()
+
+    assert reloaded is not tables
+    assert reloaded.version == lookups.version
+
+
+async def test_entities_routes_invalidate_the_cache(client, entities):
+    headers = auth_headers(await create_user("admin", "vitacare", is_superuser=True))
+    patient = make_patient(1)
+    patient.gender = "female"
+    await lookups.get()
+
+    response = await client.post(
+        "/entities/gender", json={"slug": "female", "name": "Feminino"}, headers=headers
+    )
+    assert response.status_code == 201, response.text
+    record, _ = await PatientRecord.upsert_from_pydantic_model(patient)
+
+    assert (await record.to_pydantic_model()).gender == "Feminino"
+
+
+async def test_serialization_reloads_tables_missing_an_entity(entities):
+    await lookups.get()
+    await Gender.create(slug="female", name="Feminino")
+    record, _ = await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    await PatientRecord.filter(id=record.id).update(gender_id=(await Gender.get(slug="female")).id)
+    record = await PatientRecord.get(id=record.id)
+
+    assert (await record.to_pydantic_model()).gender == "Feminino"
+
+
+async def test_upsert_reloads_tables_missing_an_entity(entities):
+    await lookups.get()
+    await DataSource.create(name="other")
+
+    written, errors = await PatientRecord.upsert_from_pydantic_models([make_patient(1, "other")])
+
+    assert errors == {}
+    assert list(written) == [0]
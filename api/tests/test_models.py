@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from app.models import (
+    AddressPatientPeriod,
+    Cns,
+    Patient,
+    PatientRecord,
+    TelecomPatientPeriod,
+    lookups,
+)
+from app.sync import patient_from_resource
+from tests.conftest import make_patient
+
+
+async def test_patient_record_round_trip(entities):
+    patient = make_patient(1)
+    record, _ = await PatientRecord.upsert_from_pydantic_model(patient)
+
+    serialized = await record.to_pydantic_model()
+
+    assert serialized.cpf == patient.cpf
+    assert serialized.cns == patient.cns
+    assert serialized.gender == "Masculino"
+    assert serialized.race == "Parda"
+    assert (serialized.birth_city, serialized.birth_state, serialized.birth_country) == (
+        "Rio de Janeiro",
+        "Rio de Janeiro",
+        "Brasil",
+    )
+    assert sorted(address.line for address in serialized.address) == ["Rua 1, 0", "Rua 1, 1"]
+    assert {address.use for address in serialized.address} == {"Residencial"}
+    assert serialized.address[0].period.start.year == 2020
+    assert [telecom.value for telecom in serialized.telecom] == ["21000000001"]
+    assert serialized.telecom[0].system == "Telefone"
+
+
+async def test_fhir_resource_round_trip(entities):
+    patient = make_patient(1)
+    patient.mother, patient.father = "Mãe do Paciente", "Pai do Paciente"
+    patient.naturalization, patient.protected_person = "2001-01-01", True
+    record, _ = await PatientRecord.upsert_from_pydantic_model(patient)
+
+    (resource,) = await PatientRecord.to_fhir_resources([record])
+
+    assert resource["meta"] == {"source": "vitacare"}
+    assert resource["gender"] == "male"
+    # Mother and father; birth place, race, ethnicity, nationality, naturalization, protection.
+    assert (len(resource["contact"]), len(resource["extension"])) == (2, 6)
+    pulled = patient_from_resource(resource, "vitacare")
+    pulled.address.sort(key=lambda address: address.line)
+    assert pulled == patient
+
+
+async def test_to_pydantic_models_query_count_is_constant(entities, query_counter):
+    query_counts = {}
+    created = 0
+    for page_size in (1, 10, 50):
+        while created < page_size:
+            created += 1
+            await PatientRecord.upsert_from_pydantic_model(make_patient(created))
+        query_counter.count = 0
+        records = await PatientRecord.all().limit(page_size)
+        serialized = await PatientRecord.to_pydantic_models(records)
+        assert len(serialized) == page_size
+        assert all(len(patient.address) == 2 for patient in serialized)
+        query_counts[page_size] = query_counter.count
+
+    assert len(set(query_counts.values())) == 1, query_counts
+
+
+async def test_to_pydantic_models_empty_page(db, query_counter):
+    assert await PatientRecord.to_pydantic_models([]) == []
+    assert query_counter.count == 0
+
+
+async def test_upsert_is_idempotent(entities):
+    first, created = await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    assert created
+    period_ids = set(await AddressPatientPeriod.all().values_list("id", flat=True))
+
+    second, created = await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+
+    assert not created
+    assert second.id == first.id
+    assert await Patient.all().count() == 1
+    assert await Cns.all().count() == 1
+    assert set(await AddressPatientPeriod.all().values_list("id", flat=True)) == period_ids
+    assert await TelecomPatientPeriod.all().count() == 1
+
+
+async def test_upsert_diffs_addresses_and_telecoms(entities):
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    kept_id = await AddressPatientPeriod.get(address__line="Rua 1, 0").values_list("id", flat=True)
+    patient = make_patient(1)
+    patient.name = "Paciente Renomeado"
+    patient.address[1].line = "Rua Nova, 1"
+    patient.telecom = []
+
+    record, created = await PatientRecord.upsert_from_pydantic_model(patient)
+
+    serialized = await record.to_pydantic_model()
+    assert not created
+    assert serialized.name == "Paciente Renomeado"
+    assert sorted(address.line for address in serialized.address) == ["Rua 1, 0", "Rua Nova, 1"]
+    assert serialized.telecom == []
+    assert await AddressPatientPeriod.filter(id=kept_id).exists()
+    assert await AddressPatientPeriod.all().count() == 2
+
+
+async def test_upsert_makes_the_new_cns_the_main_one(entities):
+    first_cns, second_cns = make_patient(1).cns, make_patient(2).cns
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    patient = make_patient(1)
+
+    for cns in (second_cns, first_cns):
+        patient.cns = cns
+        record, _ = await PatientRecord.upsert_from_pydantic_model(patient)
+
+        assert (await record.to_pydantic_model()).cns == cns
+        assert set(await Cns.filter(patient_id=record.id).values_list("value", "is_main")) == {
+            (first_cns, cns == first_cns),
+            (second_cns, cns == second_cns),
+        }
+
+
+async def test_concurrent_upserts_do_not_share_a_new_cns(entities):
+    first, second = make_patient(1), make_patient(2)
+    second.cns = first.cns
+
+    results = await asyncio.gather(
+        *(PatientRecord.upsert_from_pydantic_models([patient]) for patient in (first, second))
+    )
+
+    assert sorted(len(written) for written, _ in results) == [0, 1]
+    assert [errors for _, errors in results if errors] == [
+        {0: f'CNS "{first.cns}" is assigned to another patient record.'}
+    ]
+    assert await Cns.filter(value=first.cns).count() == 1
+
+
+async def test_upsert_query_count_is_constant(entities, query_counter):
+    await lookups.get()
+    query_counts = []
+    for start, count in ((1, 1), (100, 40)):
+        query_counter.count = 0
+        patients = [make_patient(index) for index in range(start, start + count)]
+        written, errors = await PatientRecord.upsert_from_pydantic_models(patients)
+        assert errors == {}
+        assert all(created for _, created in written.values())
+        query_counts.append(query_counter.count)
+
+    assert query_counts[0] == query_counts[1]
+    assert await PatientRecord.all().count() == 41
+
+
+async def test_upsert_reports_invalid_patients(entities):
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    unknown_city = make_patient(3)
+    unknown_city.address[0].city = "Atlantis"
+    taken_cns = make_patient(4)
+    taken_cns.cns = make_patient(1).cns
+
+    written, errors = await PatientRecord.upsert_from_pydantic_models(
+        [
+            make_patient(1),
+            make_patient(2),
+            make_patient(2),
+            unknown_city,
+            taken_cns,
+            make_patient(5, "unknown"),
+        ]
+    )
+
+    assert {index: created for index, (_, created) in written.items()} == {0: False, 1: True}
+    assert errors == {
+        2: "Patient is repeated in the request.",
+        3: "Unknown address city: Atlantis/Rio de Janeiro/Brasil.",
+        4: f'CNS "{make_patient(1).cns}" is assigned to another patient record.',
+        5: 'Unknown data source "unknown".',
+    }
+    assert await PatientRecord.all().count() == 2
+
+
+async def test_upsert_raises_for_invalid_patient(entities):
+    with pytest.raises(ValueError, match="Unknown data source"):
+        await PatientRecord.upsert_from_pydantic_model(make_patient(1, "unknown"))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from app.models import DataSource, PatientRecord, RawPatientRecord, lookups
+from app.normalization import Normalizer, normalize_data_source
+
+ADDRESS = {
+    "use": "home",
+    "type": "physical",
+    "line": "Rua 1, 10",
+    "city": "Rio de Janeiro",
+    "state": "Rio de Janeiro",
+    "country": "Brasil",
+    "period": {"start": "2020-01-01T00:00:00"},
+}
+
+
+def make_raw(cpf, **data) -> dict:
+    return {
+        "nu_cpf": cpf,
+        "cns": "700000000000013",
+        "name": "PACIENTE DA SILVA",
+        "birth_date": "21/03/1985",
+        "sexo": "M",
+        **data,
+    }
+
+
+async def test_normalize(entities):
+    normalizer = Normalizer(
+        columns={"cpf": "nu_cpf", "gender": "sexo"}, aliases={"race": {"04": "Parda"}}
+    )
+    records = [
+        make_raw(
+            "123.456.789-09",
+            name="  maria  DOS santos E silva ",
+            mother="ANA DA CONCEIÇÃO",
+            birth_date="1985-03-21",
+            race="04",
+            ethnicity="pataxó",
+            nationality="b",
+            deceased="N",
+            birth_city=" Rio de Janeiro ",
+            address=[ADDRESS],
+        ),
+        # Leading zeros lost by a numeric column, invalid CNS and unknown lookups.
+        make_raw(19100, cns="700000000000014", sexo="X", race="Azul", active="não"),
+        make_raw("123.456.789-00"),
+        make_raw("987.654.321-00", birth_date="31/02/1985"),
+        make_raw("987.654.321-00", birth_date="2999-01-01"),
+        make_raw("987.654.321-00", name=" "),
+        make_raw("987.654.321-00", address=[{"line": "Rua 1"}]),
+        # Non-ASCII digits are not digits of a CPF.
+        make_raw("١٢٣٤٥٦٧٨٩٠٩"),
+    ]
+
+    patients, errors = normalizer.normalize(records, await lookups.get(), "vitacare")
+
+    assert [patient.cpf for patient in patients] == ["12345678909", "00000019100"]
+    first, second = patients
+    assert first.name == "Maria dos Santos e Silva"
+    assert first.mother == "Ana da Conceição"
+    assert first.father is None
+    assert first.birth_date == date(1985, 3, 21)
+    assert first.cns == "700000000000013"
+    assert (first.gender, first.race, first.nationality) == ("male", "Parda", "B")
+    # Not a value of the lookup table: accents are not folded.
+    assert first.ethnicity is None
+    assert (first.active, first.deceased) == (True, False)
+    assert first.birth_city == "Rio de Janeiro"
+    assert first.address[0].city == "Rio de Janeiro"
+    assert first.data_source_name == "vitacare"
+
+    assert second.name == "Paciente da Silva"
+    assert second.birth_date == date(1985, 3, 21)
+    assert second.cns is None
+    assert (second.gender, second.race, second.active) == ("unknown", None, False)
+
+    assert list(errors) == [2, 3, 4, 5, 6, 7]
+    assert errors[2] == errors[7] == "Invalid CPF"
+    assert errors[3] == errors[4] == "Invalid birth date"
+    assert errors[5] == "Missing name"
+    assert "address" in errors[6]
+
+
+async def test_normalize_data_source(entities):
+    data_source = await DataSource.get(name="vitacare")
+    other = await DataSource.create(name="other")
+    lookups.invalidate()
+    for cpf in ("123.456.789-09", "000.000.191-00", "987.654.321-00", "111.111.111-11"):
+        await RawPatientRecord.create(data=make_raw(cpf, cns=None), data_source=data_source)
+    await RawPatientRecord.create(data=make_raw("52998224725"), data_source=other)
+
+    normalizer = Normalizer(columns={"cpf": "nu_cpf", "gender": "sexo"})
+    assert await normalize_data_source("vitacare", normalizer, batch_size=3) == (3, 1)
+
+    records = await PatientRecord.all().prefetch_related("patient", "data_source")
+    assert sorted(record.patient.cpf for record in records) == [
+        "00000019100",
+        "12345678909",
+        "98765432100",
+    ]
+    assert {record.data_source.name for record in records} == {"vitacare"}
+    assert {record.name for record in records} == {"Paciente da Silva"}
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import date
+
+import pytest
+from fhir_utils.patient import CNS_SYSTEM, CPF_SYSTEM
+
+from app import config
+from app.models import DataSource, PatientRecord, lookups
+from tests.conftest import auth_headers, create_user, make_patient
+
+
+async def create_patients(count: int, data_source_name: str = "vitacare", start: int = 1):
+    for index in range(start, start + count):
+        await PatientRecord.upsert_from_pydantic_model(make_patient(index, data_source_name))
+
+
+async def test_get_patients_walks_pages_with_cursor(client, entities):
+    await create_patients(7)
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    cpfs, url, pages = [], "/patients?limit=3", 0
+    while url:
+        response = await client.get(url, headers=headers)
+        assert response.status_code == 200
+        cpfs.extend(patient["cpf"] for patient in response.json())
+        url = response.links.get("next", {}).get("url")
+        pages += 1
+
+    assert pages == 3
+    assert cpfs == [f"{index:011d}" for index in range(1, 8)]
+
+
+async def test_get_patients_is_restricted_to_the_user_data_source(client, entities):
+    await DataSource.create(name="other")
+    lookups.invalidate()
+    await create_patients(2)
+    await create_patients(3, "other", start=10)
+
+    response = await client.get(
+        "/patients", headers=auth_headers(await create_user("other", "other"))
+    )
+    assert {patient["data_source_name"] for patient in response.json()} == {"other"}
+    assert len(response.json()) == 3
+    assert "link" not in response.headers
+
+    response = await client.get(
+        "/patients", headers=auth_headers(await create_user("admin", is_superuser=True))
+    )
+    assert len(response.json()) == 5
+
+
+async def test_get_patients_filters(client, entities):
+    await create_patients(3)
+    record = await PatientRecord.get(patient__cpf="00000000003")
+    record.birth_date = date(2000, 5, 1)
+    await record.save()
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    async def cpfs(query: str) -> list[str]:
+        response = await client.get(f"/patients?{query}", headers=headers)
+        assert response.status_code == 200
+        return [patient["cpf"] for patient in response.json()]
+
+    assert await cpfs("cpf=00000000002") == ["00000000002"]
+    assert await cpfs("cns=000000000000001") == ["00000000001"]
+    assert await cpfs("name=paciente%202") == ["00000000002"]
+    assert await cpfs("birth_date_from=1999-01-01") == ["00000000003"]
+    assert await cpfs("birth_date_to=1999-01-01") == ["00000000001", "00000000002"]
+    assert await cpfs("updated_since=2100-01-01T00:00:00") == []
+
+
+async def test_get_patients_validates_limit_and_cursor(client, entities):
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    assert (await client.get("/patients?limit=0", headers=headers)).status_code == 422
+    assert (await client.get("/patients?limit=100000", headers=headers)).status_code == 422
+    assert (await client.get("/patients?cursor=%%%", headers=headers)).status_code == 400
+
+
+async def test_export_patients_streams_ndjson_in_batches(client, entities, monkeypatch):
+    monkeypatch.setattr(config, "EXPORT_BATCH_SIZE", 2)
+    await create_patients(5)
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    response = await client.get(
+        "/patients/export", headers={**headers, "Accept-Encoding": "identity"}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "content-encoding" not in response.headers
+    lines = response.content.splitlines()
+    assert [json.loads(line)["cpf"] for line in lines] == [f"{i:011d}" for i in range(1, 6)]
+
+
+async def test_export_patients_as_gzipped_fhir(client, entities):
+    await create_patients(3)
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    response = await client.get(
+        "/patients/export?format=fhir&cpf=00000000002",
+        headers={**headers, "Accept-Encoding": "gzip"},
+    )
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"] == "application/fhir+ndjson"
+    (resource,) = [json.loads(line) for line in response.text.splitlines()]
+    assert resource["resourceType"] == "Patient"
+    assert resource["identifier"] == [
+        {"system": CPF_SYSTEM, "value": "00000000002"},
+        {"system": CNS_SYSTEM, "value": "000000000000002"},
+    ]
+    assert resource["gender"] == "male"
+    assert resource["telecom"][0] == {
+        "system": "phone",
+        "use": "home",
+        "value": "21000000002",
+        "period": {"start": "2020-01-01"},
+    }
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, gzipped",
+    [
+        ("gzip, deflate", True),
+        ("br;q=1.0, gzip;q=0.5", True),
+        ("*", True),
+        ("gzip;q=0", False),
+        ("gzip;q=0.0, *;q=1", False),
+        ("identity, *;q=0", False),
+        ("deflate", False),
+        ("", False),
+    ],
+)
+async def test_export_patients_honors_accept_encoding_qvalues(
+    client, entities, accept_encoding, gzipped
+):
+    await create_patients(1)
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+
+    response = await client.get(
+        "/patients/export", headers={**headers, "Accept-Encoding": accept_encoding}
+    )
+
+    assert response.status_code == 200
+    assert (response.headers.get("content-encoding") == "gzip") is gzipped
+    assert json.loads(response.text)["cpf"] == "00000000001"
+
+
+async def test_create_patients_bulk(client, entities):
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+    payload = [make_patient(index).model_dump(mode="json") for index in (1, 2, 2)]
+
+    response = await client.post("/patients/bulk", json=payload, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "created": 2,
+        "updated": 0,
+        "errors": [
+            {"index": 2, "cpf": "00000000002", "detail": "Patient is repeated in the request."}
+        ],
+    }
+    response = await client.get("/patients", headers=headers)
+    assert [patient["cpf"] for patient in response.json()] == ["00000000001", "00000000002"]
+
+
+async def test_create_patient_twice_updates_the_record(client, entities):
+    headers = auth_headers(await create_user("vitacare", "vitacare"))
+    payload = make_patient(1).model_dump(mode="json")
+
+    assert (await client.post("/patients", json=payload, headers=headers)).status_code == 201
+    payload["name"] = "Outro Nome"
+    response = await client.post("/patients", json=payload, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["name"] == "Outro Nome"
+    assert await PatientRecord.all().count() == 1
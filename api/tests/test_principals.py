@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from app.dependencies import principals
+from tests.conftest import auth_headers, create_user
+
+
+async def test_principal_is_cached_by_token(client, entities, query_counter):
+    user = await create_user("vitacare", "vitacare")
+    headers = auth_headers(user)
+    response = await client.get("/users/me", headers=headers)
+    assert response.status_code == 200
+    query_counter.count = 0
+
+    response = await client.get("/users/me", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["username"] == "vitacare"
+    assert query_counter.count == 0
+    cached = principals.get(headers["Authorization"].removeprefix("Bearer "))
+    assert cached.data_source.name == "vitacare"
+
+
+async def test_users_routes_invalidate_principals(client, entities):
+    admin_headers = auth_headers(await create_user("admin", is_superuser=True))
+    user = await create_user("vitacare", "vitacare")
+    headers = auth_headers(user)
+    assert (await client.get("/users/me", headers=headers)).status_code == 200
+
+    response = await client.patch(
+        f"/users/{user.id}",
+        json={
+            "username": "vitacare",
+            "email": "vitacare@example.com",
+            "password": "secret",
+            "is_active": False,
+            "is_superuser": False,
+        },
+        headers=admin_headers,
+    )
+    assert response.status_code == 200
+    response = await client.get("/users/me", headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Inactive user"
+
+    assert (await client.delete(f"/users/{user.id}", headers=admin_headers)).status_code == 200
+    assert (await client.get("/users/me", headers=headers)).status_code == 401
+
+
+async def test_invalid_token_is_rejected(client, db):
+    response = await client.get("/users/me", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == 401
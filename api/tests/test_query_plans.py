@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Check that the hot-path queries use the indexes of the migrations, on PostgreSQL.
+
+The schema is built by running the aerich migrations, as in production, and seeded with enough
+patients for the planner to prefer the indexes. Set `TEST_POSTGRES_URL` to a server where a
+throwaway database can be created (e.g. "postgres://postgres@localhost:5432/fhir_test_{}", the
+"{}" is replaced by a random suffix) to run these tests; they are skipped otherwise.
+"""
+import importlib.util
+import json
+import os
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+from tortoise import Tortoise
+from tortoise.exceptions import IntegrityError
+
+from app.models import (
+    AddressPatientPeriod,
+    Cns,
+    DataSource,
+    PatientRecord,
+    TelecomPatientPeriod,
+    lookups,
+)
+from tests.conftest import create_entities, make_patient
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+MIGRATIONS = Path(__file__).resolve().parents[1] / "migrations" / "app"
+PATIENTS = 5000
+
+pytestmark = pytest.mark.skipif(not TEST_POSTGRES_URL, reason="TEST_POSTGRES_URL is not set")
+
+
+async def run_migrations():
+    connection = Tortoise.get_connection("default")
+    for path in sorted(MIGRATIONS.glob("*.py"), key=lambda path: int(path.name.split("_")[0])):
+        spec = importlib.util.spec_from_file_location(path.stem, path)
+        migration = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(migration)
+        await connection.execute_script(await migration.upgrade(connection))
+
+
+@pytest.fixture
+async def postgres():
+    await Tortoise.init(
+        db_url=TEST_POSTGRES_URL.replace("{}", uuid4().hex[:8]),
+        modules={"app": ["app.models"]},
+        _create_db=True,
+    )
+    try:
+        await run_migrations()
+        await create_entities()
+        lookups.invalidate()
+        for start in range(1, PATIENTS + 1, 1000):
+            patients = [make_patient(index) for index in range(start, start + 1000)]
+            _, errors = await PatientRecord.upsert_from_pydantic_models(patients)
+            assert errors == {}
+        await Tortoise.get_connection("default").execute_script("ANALYZE")
+        yield
+    finally:
+        await Tortoise._drop_databases()
+
+
+def scans(plan: dict) -> set[tuple[str, str]]:
+    """The (relation, node type) of every scan in a JSON `EXPLAIN` plan"""
+    found = set()
+    if "Relation Name" in plan:
+        found.add((plan["Relation Name"], plan["Node Type"]))
+    for child in plan.get("Plans", ()):
+        found |= scans(child)
+    return found
+
+
+async def assert_index_scans(queryset, *relations: str):
+    result = (await queryset.explain())[0]["QUERY PLAN"]
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+    found = scans(plan)
+    for relation in relations:
+        nodes = {node for scanned, node in found if scanned == relation}
+        assert nodes, (relation, found)
+        assert all("Index" in node for node in nodes), (relation, found)
+
+
+async def test_hot_path_queries_use_indexes(postgres):
+    data_source = await DataSource.get(name="vitacare")
+    record_ids = (
+        await PatientRecord.filter(data_source=data_source).limit(100).values_list("id", flat=True)
+    )
+
+    await assert_index_scans(
+        PatientRecord.filter(data_source=data_source, id__gt=record_ids[0])
+        .order_by("id")
+        .limit(101),
+        "patientrecord",
+    )
+    await assert_index_scans(
+        PatientRecord.filter(patient__cpf=make_patient(42).cpf), "patient", "patientrecord"
+    )
+    await assert_index_scans(PatientRecord.filter(cnss__value=make_patient(42).cns), "cns")
+    await assert_index_scans(
+        PatientRecord.filter(name__istartswith="Paciente 421"), "patientrecord"
+    )
+    for model in (Cns, AddressPatientPeriod, TelecomPatientPeriod):
+        await assert_index_scans(model.filter(patient_id__in=record_ids), model._meta.db_table)
+
+
+async def test_data_source_name_is_unique(postgres):
+    with pytest.raises(IntegrityError):
+        await DataSource.create(name="vitacare")
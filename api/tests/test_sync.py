@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import json
+import uuid
+from itertools import count
+
+import httpx
+import pytest
+from fhir_utils import AsyncFastCRUD, HealthcareApiError
+from fhir_utils.patient import CPF_SYSTEM
+from google.auth.credentials import AnonymousCredentials
+
+from app.cache import patient_key, response_cache
+from app.models import (
+    DataSource,
+    PatientChange,
+    PatientRecord,
+    SyncWatermark,
+    lookups,
+)
+from app.sync import PATIENT_WATERMARK, FhirSync
+from tests.conftest import make_patient
+
+
+class FakeFhirStore:
+    """Patient resources of a FHIR store, answering conditional updates and searches"""
+
+    def __init__(self):
+        self.patients = {}
+        self.requests = []
+        self.clock = count(1)
+        # Status code of the next updates, and page from which searches fail.
+        self.update_status = 200
+        self.fail_after_pages = None
+
+    def write(self, cpf: str, resource: dict) -> dict:
+        resource = {
+            **resource,
+            "id": self.patients.get(cpf, {}).get("id", uuid.uuid4().hex),
+            "meta": {
+                "versionId": uuid.uuid4().hex,
+                "lastUpdated": f"2026-10-18T12:00:00.{next(self.clock):06d}+00:00",
+            },
+        }
+        self.patients[cpf] = resource
+        return resource
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        params = request.url.params
+        if request.method == "PUT":
+            if self.update_status != 200:
+                return httpx.Response(self.update_status, json={"issue": []})
+            cpf = params["identifier"].rpartition("|")[2]
+            return httpx.Response(200, json=self.write(cpf, json.loads(request.content)))
+
+        page = int(params.get("_page_token", 0))
+        if self.fail_after_pages is not None and page >= self.fail_after_pages:
+            return httpx.Response(400, json={"issue": []})
+        since = params["_lastUpdated"].removeprefix("ge")
+        found = sorted(
+            (
+                resource
+                for resource in self.patients.values()
+                if resource["meta"]["lastUpdated"] >= since
+            ),
+            key=lambda resource: resource["meta"]["lastUpdated"],
+        )
+        start, end = page * int(params["_count"]), (page + 1) * int(params["_count"])
+        bundle = {
+            "resourceType": "Bundle",
+            "entry": [{"resource": resource} for resource in found[start:end]],
+            "link": [],
+        }
+        if end < len(found):
+            url = request.url.copy_merge_params({"_page_token": page + 1})
+            bundle["link"].append({"relation": "next", "url": str(url)})
+        return httpx.Response(200, json=bundle)
+
+
+@pytest.fixture
+async def store(entities):
+    await DataSource.create(name="fhir-store")
+    await DataSource.create(name="other")
+    lookups.invalidate()
+    return FakeFhirStore()
+
+
+@pytest.fixture
+async def crud(store):
+    async with AsyncFastCRUD(
+        "project",
+        "location",
+        credentials=AnonymousCredentials(),
+        http_transport=httpx.MockTransport(store.handle),
+    ) as crud:
+        yield crud
+
+
+def fhir_sync(crud, batch_size: int = 2) -> FhirSync:
+    return FhirSync(crud, "dataset", "store", "fhir-store", batch_size)
+
+
+async def test_writes_are_pushed_in_batches(store, crud):
+    other = make_patient(1, "other")
+    other.name, other.cns = "Paciente Renomeado", None
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    await PatientRecord.upsert_from_pydantic_model(other)
+    await PatientRecord.upsert_from_pydantic_models([make_patient(2), make_patient(3)])
+    assert await PatientChange.filter(pushed_at=None).count() == 4
+
+    assert await fhir_sync(crud).push() == 4
+    assert sorted(store.patients) == ["00000000001", "00000000002", "00000000003"]
+    # Both records of the first patient were in the first batch: only the last written is sent.
+    assert len(store.requests) == 3
+    assert store.patients["00000000001"]["name"] == [{"text": "Paciente Renomeado"}]
+    identifiers = store.patients["00000000002"]["identifier"]
+    assert {"system": CPF_SYSTEM, "value": "00000000002"} in identifiers
+    assert await PatientChange.filter(pushed_at=None).count() == 0
+    assert await PatientChange.filter(fhir_version_id=None).count() == 0
+
+    assert await fhir_sync(crud).push() == 0
+    await PatientRecord.upsert_from_pydantic_model(make_patient(2))
+    assert await fhir_sync(crud).push() == 1
+
+
+async def test_failed_pushes_are_retried(store, crud):
+    await PatientRecord.upsert_from_pydantic_models([make_patient(1), make_patient(2)])
+    store.update_status = 422
+
+    assert await fhir_sync(crud).push() == 0
+    change = await PatientChange.filter(pushed_at=None).first()
+    assert change.attempts == 1
+    assert change.error.startswith("422")
+
+    store.update_status = 200
+    assert await fhir_sync(crud).push() == 2
+    assert len(store.patients) == 2
+
+
+async def test_pull_resumes_after_the_last_written_batch(store, crud):
+    sync = fhir_sync(crud, batch_size=1)
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    await sync.push()
+    # Patients written in the FHIR store by another system.
+    resource = store.patients["00000000001"]
+    for cpf in ("00000000002", "00000000003"):
+        store.write(
+            cpf,
+            {
+                **resource,
+                "identifier": [{"system": CPF_SYSTEM, "value": cpf}],
+                "name": [{"given": ["Paciente"], "family": f"Externo {cpf[-1]}"}],
+            },
+        )
+
+    # The second page fails: the first batch is kept, and the pull starts again after it.
+    store.fail_after_pages = 1
+    with pytest.raises(HealthcareApiError):
+        await sync.pull()
+    watermark = await SyncWatermark.get(name=PATIENT_WATERMARK)
+    # The pushed patient is not pulled back.
+    assert watermark.value == store.patients["00000000001"]["meta"]["lastUpdated"]
+    assert not await PatientRecord.exists(data_source__name="fhir-store")
+
+    store.fail_after_pages = None
+    assert await sync.pull() == 3
+    assert store.requests[-3].url.params["_lastUpdated"] == f"ge{watermark.value}"
+    pulled = await PatientRecord.filter(data_source__name="fhir-store").order_by("id")
+    assert [record.name for record in pulled] == ["Paciente Externo 2", "Paciente Externo 3"]
+    patient = await pulled[0].to_pydantic_model()
+    assert patient.address[0].line == "Rua 1, 0"
+    assert patient.telecom[0].value == "21000000001"
+    # Pulled records are not pushed back.
+    assert await PatientChange.filter(pushed_at=None).count() == 0
+    assert (await SyncWatermark.get(name=PATIENT_WATERMARK)).value == (
+        store.patients["00000000003"]["meta"]["lastUpdated"]
+    )
+
+    # Only the resources updated at the watermark are read again.
+    assert await sync.pull() == 1
+
+
+async def test_pull_invalidates_the_cached_patients(store, crud):
+    data_source = await DataSource.get(name="fhir-store")
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1, "fhir-store"))
+    await response_cache.set(patient_key(data_source.id, "00000000001"), {"name": "Paciente 1"})
+    resource = (await PatientRecord.to_fhir_resources(await PatientRecord.all()))[0]
+    store.write("00000000001", {**resource, "name": [{"text": "Paciente Renomeado"}]})
+
+    assert await fhir_sync(crud).pull() == 1
+    assert await response_cache.get(patient_key(data_source.id, "00000000001")) is None
+
+
+async def test_pull_holds_the_watermark_at_the_first_rejected_resource(store, crud):
+    sync = fhir_sync(crud, batch_size=1)
+    await PatientRecord.upsert_from_pydantic_model(make_patient(1))
+    resource = (await PatientRecord.to_fhir_resources(await PatientRecord.all()))[0]
+    # A patient without CPF is rejected.
+    rejected = store.write("00000000002", {**resource, "identifier": []})
+    store.write(
+        "00000000003", {**resource, "identifier": [{"system": CPF_SYSTEM, "value": "00000000003"}]}
+    )
+
+    assert await sync.pull() == 2
+    assert await PatientRecord.exists(data_source__name="fhir-store", patient__cpf="00000000003")
+    watermark = await SyncWatermark.get(name=PATIENT_WATERMARK)
+    assert watermark.value == rejected["meta"]["lastUpdated"]
+
+    fixed = store.write(
+        "00000000002", {**resource, "identifier": [{"system": CPF_SYSTEM, "value": "00000000002"}]}
+    )
+    assert await sync.pull() == 2
+    assert await PatientRecord.exists(data_source__name="fhir-store", patient__cpf="00000000002")
+    watermark = await SyncWatermark.get(name=PATIENT_WATERMARK)
+    assert watermark.value == fixed["meta"]["lastUpdated"]
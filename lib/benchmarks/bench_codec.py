@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the encode/decode throughput of the available JSON codecs on Patient resources.
+
+Usage:
+    python benchmarks/bench_codec.py [--records 1000] [--repeat 5]
+"""
+from argparse import ArgumentParser
+from timeit import repeat
+
+from fhir_utils.codec import BACKENDS, get_codec
+
+
+def make_patient(index: int) -> dict:
+    """Build a Patient resource shaped like the ones synchronized with the FHIR store"""
+    cpf = f"{index:011d}"
+    return {
+        "resourceType": "Patient",
+        "id": f"patient-{index}",
+        "meta": {"lastUpdated": "2023-12-08T17:10:25.000000+00:00"},
+        "identifier": [
+            {"system": "https://rnds-fhir.saude.gov.br/NamingSystem/cpf", "value": cpf},
+            {"system": "https://rnds-fhir.saude.gov.br/NamingSystem/cns", "value": f"7{cpf}0000"},
+        ],
+        "active": True,
+        "name": [{"use": "official", "text": f"Maria José da Conceição {index}"}],
+        "telecom": [
+            {"system": "phone", "use": "mobile", "value": f"2199{index % 10**7:07d}", "rank": 1},
+            {"system": "email", "use": "home", "value": f"paciente{index}@example.com"},
+        ],
+        "gender": "female",
+        "birthDate": "1985-03-21",
+        "deceasedBoolean": False,
+        "address": [
+            {
+                "use": "home",
+                "type": "physical",
+                "line": [f"Rua São Clemente, {index % 1000}", "Apto 101"],
+                "city": "Rio de Janeiro",
+                "state": "RJ",
+                "postalCode": "22260000",
+                "country": "Brasil",
+                "period": {"start": "2020-01-01"},
+            }
+        ],
+        "extension": [
+            {
+                "url": "http://www.saude.gov.br/fhir/r4/StructureDefinition/BRRacaCorEtnia-1.0",
+                "extension": [
+                    {"url": "race", "valueCodeableConcept": {"coding": [{"code": "03"}]}}
+                ],
+            }
+        ],
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    patients = [make_patient(index) for index in range(args.records)]
+    entries = [{"resource": patient} for patient in patients]
+    bundle = {"resourceType": "Bundle", "type": "searchset", "entry": entries}
+
+    def best(function) -> float:
+        return min(repeat(function, number=1, repeat=args.repeat))
+
+    print(f"{'codec':<10}{'encode rec/s':>16}{'decode rec/s':>16}{'bundle MB/s':>14}")
+    for name in BACKENDS:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            print(f"{name:<10}{'not installed':>16}")
+            continue
+        encoded = [codec.dumps(patient) for patient in patients]
+        encoded_bundle = codec.dumps(bundle)
+
+        encode = best(lambda: [codec.dumps(p) for p in patients])
+        decode = best(lambda: [codec.loads(e) for e in encoded])
+        bundle_decode = best(lambda: codec.loads(encoded_bundle))
+        print(
+            f"{name:<10}{args.records / encode:>16,.0f}{args.records / decode:>16,.0f}"
+            f"{len(encoded_bundle) / bundle_decode / 1e6:>14,.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the throughput of the patient record <-> FHIR Patient mapper on a single core.
+
+The target is 50k records/s in each direction.
+
+Usage:
+    python benchmarks/bench_patient.py [--records 100000] [--repeat 5]
+"""
+from argparse import ArgumentParser
+from timeit import repeat
+
+from fhir_utils.patient import PatientMapper
+
+TARGET = 50_000
+
+
+def make_record(index: int) -> dict:
+    """Build a patient record shaped like the ones written through the API"""
+    period = {"start": "2020-01-01T00:00:00", "end": None}
+    return {
+        "cpf": f"{index:011d}",
+        "cns": f"7{index:014d}",
+        "data_source_name": "vitacare",
+        "active": True,
+        "name": f"Maria José da Conceição {index}",
+        "gender": "female",
+        "birth_date": "1985-03-21",
+        "deceased": False,
+        "mother": "Ana da Conceição",
+        "father": None,
+        "birth_city": "Rio de Janeiro",
+        "birth_state": "Rio de Janeiro",
+        "birth_country": "Brasil",
+        "race": "Parda",
+        "ethnicity": None,
+        "nationality": "B",
+        "naturalization": None,
+        "protected_person": None,
+        "address": [
+            {
+                "use": "home",
+                "type": "physical",
+                "line": f"Rua São Clemente, {index % 1000}",
+                "city": "Rio de Janeiro",
+                "state": "Rio de Janeiro",
+                "country": "Brasil",
+                "postal_code": "22260000",
+                "period": period,
+            }
+        ],
+        "telecom": [
+            {
+                "system": "phone",
+                "use": "mobile",
+                "value": f"2199{index % 10**7:07d}",
+                "rank": 1,
+                "period": period,
+            }
+        ],
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    mapper = PatientMapper()
+    records = [make_record(index) for index in range(args.records)]
+    resources = mapper.to_fhir_many(records)
+
+    print(f"{'direction':<12}{'records/s':>14}{'target':>10}")
+    for direction, convert, batch in (
+        ("to_fhir", mapper.to_fhir_many, records),
+        ("from_fhir", mapper.from_fhir_many, resources),
+    ):
+        seconds = min(repeat(lambda: convert(batch), number=1, repeat=args.repeat))
+        rate = args.records / seconds
+        print(f"{direction:<12}{rate:>14,.0f}{'met' if rate >= TARGET else 'missed':>10}")
+
+
+if __name__ == "__main__":
+    main()
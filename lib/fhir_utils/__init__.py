@@ -1,4 +1,10 @@
 # -*- coding: utf-8 -*-
 from .conf import settings  # noqa
 from .version import __version__  # noqa
-from fhir_utils.healthcare_api import HealthcareApi
\ No newline at end of file
+from fhir_utils.healthcare_api import HealthcareApi  # noqa: F401
+from fhir_utils.async_healthcare_api import AsyncHealthcareApi, AsyncFastCRUD  # noqa: F401
+from fhir_utils.bundle import AsyncBundleBuilder, BundleBuilder, BundleEntryResult  # noqa: F401
+from fhir_utils.exceptions import HealthcareApiError  # noqa: F401
+from fhir_utils.transport import CircuitBreaker, RetryPolicy, TokenBucket, Transport  # noqa: F401
+from fhir_utils.response import FhirResponse  # noqa: F401
+from fhir_utils.patient import PatientMapper  # noqa: F401
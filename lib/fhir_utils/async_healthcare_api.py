@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import AsyncIterator, Union
+
+import httpx
+from google.auth.transport import requests
+
+from fhir_utils.healthcare_api import BASE_URL, BASE_URL_BETA, load_credentials
+from fhir_utils import codec
+from fhir_utils.bundle import AsyncBundleBuilder
+from fhir_utils.exceptions import HealthcareApiError
+from fhir_utils.pagination import aiter_entries, aiter_pages
+from fhir_utils.response import FhirResponse, astream_bundle_entries
+from fhir_utils.sessions import registry
+from fhir_utils.transport import Transport
+
+RETRY_EXCEPTIONS = (httpx.TransportError,)
+
+
+class AsyncHealthcareApi:
+    """
+    Asynchronous counterpart of `HealthcareApi`, backed by a pooled `httpx.AsyncClient`.
+
+    Connections are kept alive and reused across requests, and the number of requests in flight
+    is capped by a semaphore, so a single process can keep hundreds of requests running
+    concurrently without exhausting sockets.
+
+    Usage:
+        async with AsyncHealthcareApi(project_id, location) as api:
+            results = await asyncio.gather(*[api.create(...) for ... in ...])
+    """
+
+    def __init__(
+            self,
+            project_id,
+            location,
+            credentials=None,
+            base_url: str = BASE_URL,
+            base_url_beta: str = BASE_URL_BETA,
+            max_in_flight: int = 100,
+            max_connections: int = 100,
+            max_keepalive_connections: int = 20,
+            http2: bool = False,
+            timeout: float = 60.0,
+            transport: Transport = None,
+            http_transport: httpx.AsyncBaseTransport = None,
+            ):
+        """
+        Args:
+            project_id (str): The Google Cloud project ID.
+            location (str): The Google Cloud location of the datasets.
+            credentials (google.auth.credentials.Credentials, optional): Credentials used to
+                authorize requests. Defaults to the service account file pointed by the
+                `GOOGLE_APPLICATION_CREDENTIALS` environment variable.
+            base_url (str, optional): Base URL of the Healthcare API.
+            base_url_beta (str, optional): Base URL of the Healthcare API beta endpoint.
+            max_in_flight (int, optional): Maximum number of concurrent requests. Defaults to 100.
+            max_connections (int, optional): Maximum number of pooled connections.
+                Defaults to 100.
+            max_keepalive_connections (int, optional): Maximum number of idle connections kept
+                alive in the pool. Defaults to 20.
+            http2 (bool, optional): Enable HTTP/2 (requires the `h2` package). Defaults to False.
+            timeout (float, optional): Timeout in seconds for each request. Defaults to 60.
+            transport (Transport, optional): Retry, rate limiting and circuit breaking settings.
+                Defaults to `Transport()`. See `HealthcareApi`.
+            http_transport (httpx.AsyncBaseTransport, optional): Custom httpx transport.
+        """
+        if credentials is None:
+            self.credentials = load_credentials()
+        else:
+            self.credentials = credentials
+        self.scoped_credentials = registry.get_scoped_credentials(self.credentials)
+        self.project_id = project_id
+        self.location = location
+        self.base_url = base_url
+        self.base_url_beta = base_url_beta
+        self.url = (f"{self.base_url}/projects/{self.project_id}/locations/{self.location}")
+        self.header = {"Content-Type": "application/fhir+json;charset=utf-8"}
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            http2=http2,
+            timeout=timeout,
+            transport=http_transport,
+        )
+        self.transport = transport or Transport()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._refresh_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the underlying connection pool"""
+        await self.client.aclose()
+
+    async def _authorized_headers(self) -> dict:
+        """Build the request headers, refreshing the access token if it has expired"""
+        if not self.scoped_credentials.valid:
+            async with self._refresh_lock:
+                if not self.scoped_credentials.valid:
+                    # google-auth only ships a blocking refresh, so keep it off the event loop.
+                    await asyncio.to_thread(self.scoped_credentials.refresh, requests.Request())
+        headers = dict(self.header)
+        self.scoped_credentials.apply(headers)
+        return headers
+
+    async def _request(
+            self,
+            method: str,
+            url: str,
+            payload: Union[dict, bytes] = None
+            ) -> FhirResponse:
+        if payload is not None and not isinstance(payload, bytes):
+            payload = codec.dumps(payload)
+        response = await self.transport.asend(
+            self._send_attempt,
+            method,
+            url,
+            retry_exceptions=RETRY_EXCEPTIONS,
+            content=payload,
+        )
+        return FhirResponse.from_response(response)
+
+    async def _send_attempt(
+            self,
+            method: str,
+            url: str,
+            stream: bool = False,
+            **kwargs
+            ) -> httpx.Response:
+        # A single attempt of `transport.asend`. The in-flight slot and the access token are taken
+        # anew by each attempt, so requests waiting to be retried hold no slot and do not reuse a
+        # token that expired during the backoff.
+        async with self._in_flight:
+            headers = await self._authorized_headers()
+            request = self.client.build_request(method, url, headers=headers, **kwargs)
+            return await self.client.send(request, stream=stream)
+
+    async def create(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            payload: dict
+            ) -> FhirResponse:
+        """Create a new resource in the FHIR store"""
+        resource_path = (
+            f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}"
+        )
+
+        return await self._request("POST", resource_path, payload)
+
+    async def update(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            resource_id: str,
+            payload: dict,
+            ) -> FhirResponse:
+        """Update an existing resource in the FHIR store"""
+        resource_path = (
+            f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}/{resource_id}"
+        )
+
+        return await self._request("PUT", resource_path, payload)
+
+    async def update_conditional(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            condition: str,
+            payload: dict,
+            ) -> FhirResponse:
+        """
+        Update (or create) the resource matching the search criteria.
+        See `HealthcareApi.update_conditional`.
+        """
+        url_beta = f"{self.base_url_beta}/projects/{self.project_id}/locations/{self.location}"
+
+        resource_path = (
+            f"{url_beta}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}"
+        )
+        resource_path += f"?{condition}"
+
+        return await self._request("PUT", resource_path, payload)
+
+    async def read(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            resource_id: str
+            ) -> FhirResponse:
+        """Read the contents of a specific resource in the FHIR store"""
+        resource_path = (
+            f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}/{resource_id}"
+        )
+
+        return await self._request("GET", resource_path)
+
+    async def read_conditional(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            condition: str
+            ) -> FhirResponse:
+        """
+        If a resource is found based on the search criteria specified in the query parameters,
+        read the entire contents of that resource.
+        """
+        resource_path = (
+            f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}"
+        )
+        resource_path += f"?{condition}"
+
+        return await self._request("GET", resource_path)
+
+    def search_iter(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            condition: str = "",
+            count: int = 100,
+            prefetch: bool = False
+            ) -> AsyncIterator[dict]:
+        """
+        Asynchronously iterate over every resource matching the search criteria.
+        See `HealthcareApi.search_iter`.
+        """
+        resource_path = (
+            f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}"
+        )
+        resource_path += f"?_count={count}"
+        if condition:
+            resource_path += f"&{condition}"
+
+        return aiter_entries(aiter_pages(self._get, resource_path, prefetch))
+
+    async def search_stream(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            condition: str = "",
+            count: int = 1000
+            ) -> AsyncIterator[dict]:
+        """
+        Asynchronously stream every resource matching the search criteria, parsing each page
+        incrementally. See `HealthcareApi.search_stream`.
+
+        The in-flight slot is only held while each page is requested, not while its entries are
+        yielded, so the loop consuming them may call the API too.
+        """
+        url = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}"
+        url += f"?_count={count}"
+        if condition:
+            url += f"&{condition}"
+
+        while url:
+            links = {}
+            response = await self.transport.asend(
+                self._send_attempt, "GET", url, retry_exceptions=RETRY_EXCEPTIONS, stream=True
+            )
+            try:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise HealthcareApiError(
+                        response.status_code, FhirResponse.from_response(response).body
+                    )
+                async for entry in astream_bundle_entries(response.aiter_bytes(), links):
+                    yield entry
+            finally:
+                await response.aclose()
+            url = links.get("next")
+
+    async def _get(self, url: str) -> FhirResponse:
+        return await self._request("GET", url)
+
+    async def delete(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            resource_id: str
+            ) -> FhirResponse:
+        """Delete a resource from the FHIR store"""
+        resource_path = (
+            f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}/{resource_id}"
+        )
+
+        return await self._request("DELETE", resource_path)
+
+    async def execute_bundle(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            payload: Union[dict, bytes]
+            ) -> FhirResponse:
+        """Execute a batch or transaction Bundle, given as a dict or already serialized"""
+        resource_path = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir"
+
+        return await self._request("POST", resource_path, payload)
+
+    def bundle(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            **kwargs
+            ) -> AsyncBundleBuilder:
+        """Start an `AsyncBundleBuilder` accumulating writes to the FHIR store"""
+        return AsyncBundleBuilder(self, dataset_id, fhir_store_id, **kwargs)
+
+
+class AsyncFastCRUD(AsyncHealthcareApi):
+    """Asynchronous counterpart of `FastCRUD`."""
+
+    def __init__(self, project_id, location, **kwargs):
+        super().__init__(project_id, location, **kwargs)
+
+    async def resource_search_lastupdated(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            since: str
+            ) -> FhirResponse:
+        """Read the entries from a resource in the FHIR store last updated after a date and time"""
+        parameter = f"_lastUpdated=gt{since}"
+        return await self.read_conditional(dataset_id, fhir_store_id, resource, parameter)
+
+    def resource_search_lastupdated_iter(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            since: str,
+            count: int = 100,
+            prefetch: bool = False
+            ) -> AsyncIterator[dict]:
+        """Asynchronously iterate over the resources last updated after a date and time"""
+        parameter = f"_lastUpdated=gt{since}"
+        return self.search_iter(dataset_id, fhir_store_id, resource, parameter, count, prefetch)
+
+    async def patient_search(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            cpf: str
+            ) -> FhirResponse:
+        """Read the entries from Patient resource in the FHIR store based on tax id (CPF)"""
+        parameter = f"identifier=https://rnds-fhir.saude.gov.br/NamingSystem/cpf|{cpf}"
+        return await self.read_conditional(dataset_id, fhir_store_id, "Patient", parameter)
+
+    async def patient_update(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            cpf: str,
+            payload: dict
+            ) -> FhirResponse:
+        """Update the entries from Patient resource in the FHIR store based on tax id (CPF)"""
+        parameter = f"identifier=https://rnds-fhir.saude.gov.br/NamingSystem/cpf|{cpf}"
+        return await self.update_conditional(
+            dataset_id, fhir_store_id, "Patient", parameter, payload
+        )
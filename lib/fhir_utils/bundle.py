@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+from typing import Callable
+
+from fhir_utils import codec
+
+BATCH = "batch"
+TRANSACTION = "transaction"
+
+
+class BundleEntryResult:
+    """
+    Placeholder for the outcome of a single Bundle entry.
+
+    It is returned as soon as the entry is queued and filled in when the Bundle holding it is
+    executed, so callers can keep a reference to each entry and inspect its result later.
+    """
+
+    __slots__ = ("method", "url", "status_code", "location", "etag", "body")
+
+    def __init__(self, method: str, url: str):
+        self.method = method
+        self.url = url
+        self.status_code = None
+        self.location = None
+        self.etag = None
+        self.body = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the Bundle holding this entry was executed"""
+        return self.status_code is not None
+
+    @property
+    def ok(self) -> bool:
+        """Whether the entry was executed successfully"""
+        return self.done and 200 <= self.status_code < 300
+
+    def __repr__(self) -> str:
+        return f"BundleEntryResult({self.method} {self.url} -> {self.status_code})"
+
+
+class _BundleQueue:
+    """Entries queued for the next Bundle, shared by `BundleBuilder` and `AsyncBundleBuilder`"""
+
+    def __init__(
+            self,
+            api,
+            dataset_id: str,
+            fhir_store_id: str,
+            bundle_type: str = BATCH,
+            max_entries: int = 1000,
+            max_bytes: int = 10 * 1024 * 1024,
+            on_flush: Callable[[list[BundleEntryResult]], None] = None,
+            ):
+        """
+        Args:
+            api (HealthcareApi | AsyncHealthcareApi): Client used to execute the Bundles.
+            dataset_id (str): The dataset ID.
+            fhir_store_id (str): The FHIR store ID.
+            bundle_type (str, optional): Either "batch" or "transaction". Defaults to "batch".
+            max_entries (int, optional): Flush once this many entries are queued.
+                Defaults to 1000.
+            max_bytes (int, optional): Flush before the serialized entries exceed this size.
+                Defaults to 10 MiB.
+            on_flush (Callable, optional): Called with the results of every flushed Bundle,
+                including the automatic flushes, e.g. to count or log the failed entries.
+        """
+        if bundle_type not in (BATCH, TRANSACTION):
+            raise ValueError(f'bundle_type must be "{BATCH}" or "{TRANSACTION}"')
+        self.api = api
+        self.dataset_id = dataset_id
+        self.fhir_store_id = fhir_store_id
+        self.bundle_type = bundle_type
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_flush = on_flush
+        self._entries = []
+        self._pending = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _encode(self, method: str, url: str, payload: dict = None) -> bytes:
+        entry = {"request": {"method": method, "url": url}}
+        if payload is not None:
+            entry["resource"] = payload
+        # Entries are serialized once, here, and spliced into the Bundle when flushing.
+        return codec.dumps(entry)
+
+    def _must_flush_before(self, encoded: bytes) -> bool:
+        return bool(self._entries) and self._size + len(encoded) + 1 > self.max_bytes
+
+    def _queue(self, method: str, url: str, encoded: bytes) -> BundleEntryResult:
+        result = BundleEntryResult(method, url)
+        self._entries.append(encoded)
+        self._pending.append(result)
+        self._size += len(encoded) + 1
+        return result
+
+    def _is_full(self) -> bool:
+        return len(self._entries) >= self.max_entries
+
+    def _take(self) -> tuple[bytes, list[BundleEntryResult]]:
+        """Empty the queue, returning the serialized Bundle and the results of its entries"""
+        entries, pending = self._entries, self._pending
+        self._entries, self._pending, self._size = [], [], 0
+        payload = b"".join((
+            b'{"resourceType":"Bundle","type":"',
+            self.bundle_type.encode(),
+            b'","entry":[',
+            b",".join(entries),
+            b"]}",
+        ))
+        return payload, pending
+
+    def _done(self, response: dict, pending: list[BundleEntryResult]) -> list[BundleEntryResult]:
+        map_bundle_response(response, pending)
+        if self.on_flush is not None:
+            self.on_flush(pending)
+        return pending
+
+
+class BundleBuilder(_BundleQueue):
+    """
+    Accumulate FHIR write interactions and send them to the `executeBundle` endpoint.
+
+    Entries are flushed automatically once `max_entries` is reached, or before the serialized
+    Bundle would grow past `max_bytes`. Each queued interaction returns a `BundleEntryResult` that
+    is filled with the matching entry of the response Bundle. The builder keeps no reference to
+    the results once flushed, so its memory is bounded by a single Bundle however many entries
+    go through it: keep the results you need, or collect them with `on_flush`.
+
+    With `bundle_type="batch"` each entry succeeds or fails on its own. With
+    `bundle_type="transaction"` the store applies all entries atomically, so a failure is reported
+    on every entry of the flushed Bundle.
+
+    Usage:
+        with api.bundle(dataset_id, fhir_store_id) as bundle:
+            results = [bundle.create("Patient", patient) for patient in patients]
+        failed = [result for result in results if not result.ok]
+
+    Reference:
+        https://cloud.google.com/healthcare-api/docs/how-tos/fhir-bundles
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def create(self, resource: str, payload: dict) -> BundleEntryResult:
+        """Queue the creation of a resource"""
+        return self._add("POST", resource, payload)
+
+    def update(self, resource: str, resource_id: str, payload: dict) -> BundleEntryResult:
+        """Queue the update of an existing resource"""
+        return self._add("PUT", f"{resource}/{resource_id}", payload)
+
+    def update_conditional(
+            self, resource: str, condition: str, payload: dict
+            ) -> BundleEntryResult:
+        """Queue the update (or creation) of the resource matching the search criteria"""
+        return self._add("PUT", f"{resource}?{condition}", payload)
+
+    def delete(self, resource: str, resource_id: str) -> BundleEntryResult:
+        """Queue the deletion of a resource"""
+        return self._add("DELETE", f"{resource}/{resource_id}")
+
+    def _add(self, method: str, url: str, payload: dict = None) -> BundleEntryResult:
+        encoded = self._encode(method, url, payload)
+        if self._must_flush_before(encoded):
+            self.flush()
+        result = self._queue(method, url, encoded)
+        if self._is_full():
+            self.flush()
+        return result
+
+    def flush(self) -> list[BundleEntryResult]:
+        """Execute the queued entries, returning their results"""
+        if not self._entries:
+            return []
+        payload, pending = self._take()
+        response = self.api.execute_bundle(self.dataset_id, self.fhir_store_id, payload)
+        return self._done(response, pending)
+
+
+class AsyncBundleBuilder(_BundleQueue):
+    """
+    Asynchronous counterpart of `BundleBuilder`, for an `AsyncHealthcareApi`. Queueing may flush,
+    so the write methods are coroutines.
+
+    Usage:
+        async with api.bundle(dataset_id, fhir_store_id) as bundle:
+            results = [await bundle.create("Patient", patient) for patient in patients]
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.flush()
+
+    async def create(self, resource: str, payload: dict) -> BundleEntryResult:
+        """Queue the creation of a resource"""
+        return await self._add("POST", resource, payload)
+
+    async def update(self, resource: str, resource_id: str, payload: dict) -> BundleEntryResult:
+        """Queue the update of an existing resource"""
+        return await self._add("PUT", f"{resource}/{resource_id}", payload)
+
+    async def update_conditional(
+            self, resource: str, condition: str, payload: dict
+            ) -> BundleEntryResult:
+        """Queue the update (or creation) of the resource matching the search criteria"""
+        return await self._add("PUT", f"{resource}?{condition}", payload)
+
+    async def delete(self, resource: str, resource_id: str) -> BundleEntryResult:
+        """Queue the deletion of a resource"""
+        return await self._add("DELETE", f"{resource}/{resource_id}")
+
+    async def _add(self, method: str, url: str, payload: dict = None) -> BundleEntryResult:
+        encoded = self._encode(method, url, payload)
+        if self._must_flush_before(encoded):
+            await self.flush()
+        result = self._queue(method, url, encoded)
+        if self._is_full():
+            await self.flush()
+        return result
+
+    async def flush(self) -> list[BundleEntryResult]:
+        """Execute the queued entries, returning their results"""
+        if not self._entries:
+            return []
+        payload, pending = self._take()
+        response = await self.api.execute_bundle(self.dataset_id, self.fhir_store_id, payload)
+        return self._done(response, pending)
+
+
+def map_bundle_response(response: dict, results: list[BundleEntryResult]) -> None:
+    """
+    Fill `results` with the entries of an `executeBundle` response.
+
+    The response Bundle lists its entries in the same order as the request. If the request as a
+    whole failed (e.g. a rolled back transaction), every entry receives the request status code
+    and the returned OperationOutcome.
+    """
+    status_code, body = response["status_code"], response["body"]
+    entries = body.get("entry", []) if isinstance(body, dict) else []
+    if status_code >= 300 or len(entries) != len(results):
+        for result in results:
+            result.status_code = status_code
+            result.body = body
+        return
+
+    for result, entry in zip(results, entries):
+        entry_response = entry.get("response", {})
+        result.status_code = int(entry_response.get("status", "0").split(" ")[0])
+        result.location = entry_response.get("location")
+        result.etag = entry_response.get("etag")
+        result.body = entry.get("resource", entry_response.get("outcome"))
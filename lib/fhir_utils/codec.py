@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+JSON encoding and decoding with a pluggable backend.
+
+The fastest installed backend is selected by default, in the order `orjson`, `msgspec`, `json`
+(standard library). The choice can be forced with the `FHIR_UTILS_JSON_CODEC` environment
+variable or `set_codec`.
+
+Every backend serializes the objects it does not support natively through their `__json__`
+method, which returns a JSON-compatible value (e.g. the lazily decoded body of a `FhirResponse`).
+
+>>> loads(dumps({"resourceType": "Patient", "active": True}))
+{'resourceType': 'Patient', 'active': True}
+"""
+import json
+from typing import Any, Callable, Union
+
+from fhir_utils.conf import getenv_or_action
+
+
+class Codec:
+    """A named pair of `dumps` (object to UTF-8 bytes) and `loads` (bytes or str to object)"""
+
+    __slots__ = ("name", "dumps", "loads")
+
+    def __init__(
+            self,
+            name: str,
+            dumps: Callable[[Any], bytes],
+            loads: Callable[[Union[bytes, str]], Any]
+            ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self) -> str:
+        return f"Codec({self.name!r})"
+
+
+def _default(obj: Any) -> Any:
+    to_json = getattr(type(obj), "__json__", None)
+    if to_json is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_json(obj)
+
+
+def _stdlib_codec() -> Codec:
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+    return Codec("json", lambda obj: encoder.encode(obj).encode("utf-8"), json.loads)
+
+
+def _orjson_codec() -> Codec:
+    import orjson
+
+    return Codec("orjson", lambda obj: orjson.dumps(obj, default=_default), orjson.loads)
+
+
+def _msgspec_codec() -> Codec:
+    import msgspec
+
+    encoder = msgspec.json.Encoder(enc_hook=_default)
+    decoder = msgspec.json.Decoder()
+    return Codec("msgspec", encoder.encode, decoder.decode)
+
+
+BACKENDS = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _stdlib_codec,
+}
+
+
+def get_codec(name: str = None) -> Codec:
+    """
+    Build a codec by backend name, or the fastest installed one if `name` is None.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        ImportError: If the requested backend is not installed.
+    """
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError(f'Unknown JSON codec "{name}". Choose one of: {", ".join(BACKENDS)}')
+        return BACKENDS[name]()
+    for factory in BACKENDS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+
+codec = get_codec(getenv_or_action("FHIR_UTILS_JSON_CODEC", "pass"))
+
+
+def set_codec(name: str = None) -> Codec:
+    """Select the codec used by `dumps` and `loads` across fhir_utils"""
+    global codec
+    codec = get_codec(name)
+    return codec
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize `obj` to compact UTF-8 encoded JSON"""
+    return codec.dumps(obj)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Deserialize JSON from bytes or str"""
+    return codec.loads(data)
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+
+class HealthcareApiError(Exception):
+    """Raised when the Healthcare API answers a request with an error status code"""
+
+    def __init__(self, status_code: int, body):
+        super().__init__(f"Healthcare API request failed with status code {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is rejected because the circuit breaker is open"""
+
+    def __init__(self):
+        super().__init__("Healthcare API circuit breaker is open; request was not sent.")
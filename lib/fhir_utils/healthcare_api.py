@@ -1,7 +1,23 @@
 # -*- coding: utf-8 -*-
-from google.auth.transport import requests
-from google.oauth2 import service_account
-import os
+import requests as requests_lib
+from typing import Iterator, Union
+
+from fhir_utils import codec
+from fhir_utils.bundle import BundleBuilder
+from fhir_utils.exceptions import HealthcareApiError
+from fhir_utils.pagination import iter_entries, iter_pages
+from fhir_utils.response import FhirResponse, stream_bundle_entries
+from fhir_utils.sessions import registry
+from fhir_utils.transport import Transport
+
+BASE_URL = "https://healthcare.googleapis.com/v1"
+BASE_URL_BETA = "https://healthcare.googleapis.com/v1beta1"
+RETRY_EXCEPTIONS = (requests_lib.ConnectionError, requests_lib.Timeout)
+
+
+def load_credentials():
+    """Load, once per process, the credentials pointed by `GOOGLE_APPLICATION_CREDENTIALS`"""
+    return registry.get_credentials()
 
 
 class HealthcareApi:
@@ -11,15 +27,61 @@ class HealthcareApi:
         https://cloud.google.com/healthcare-api/docs/reference/rest
     """
 
-    def __init__(self, project_id, location):
-        self.credentials = service_account.Credentials.from_service_account_file(os.environ["GOOGLE_APPLICATION_CREDENTIALS"])
-        self.scoped_credentials = self.credentials.with_scopes(["https://www.googleapis.com/auth/cloud-platform"])
-        self.session = requests.AuthorizedSession(self.scoped_credentials)
+    def __init__(
+            self,
+            project_id,
+            location,
+            credentials=None,
+            base_url: str = BASE_URL,
+            base_url_beta: str = BASE_URL_BETA,
+            transport: Transport = None,
+            ):
+        """
+        Args:
+            project_id (str): The Google Cloud project ID.
+            location (str): The Google Cloud location of the datasets.
+            credentials (google.auth.credentials.Credentials, optional): Credentials used to
+                authorize requests. Defaults to the service account file pointed by the
+                `GOOGLE_APPLICATION_CREDENTIALS` environment variable, loaded once per process.
+            base_url (str, optional): Base URL of the Healthcare API. Useful for pointing the
+                client to a local stub server.
+            base_url_beta (str, optional): Base URL of the Healthcare API beta endpoint.
+            transport (Transport, optional): Retry, rate limiting and circuit breaking settings.
+                Defaults to `Transport()`, which retries idempotent requests on 429 and 5xx.
+                Counters are available in `transport.stats`.
+        """
+        if credentials is None:
+            self.credentials = load_credentials()
+        else:
+            self.credentials = credentials
+        # Scoped credentials and pooled sessions are shared by every client using the same
+        # credentials, see `fhir_utils.sessions`.
+        self.scoped_credentials = registry.get_scoped_credentials(self.credentials)
+        self.session = registry.get_session(self.credentials)
         self.project_id = project_id
         self.location = location
-        self.base_url = "https://healthcare.googleapis.com/v1"
+        self.base_url = base_url
+        self.base_url_beta = base_url_beta
         self.url = (f"{self.base_url}/projects/{self.project_id}/locations/{self.location}")
         self.header = {"Content-Type": "application/fhir+json;charset=utf-8"}
+        self.transport = transport or Transport()
+
+    @classmethod
+    def shared(cls, project_id, location, credentials=None, **kwargs):
+        """Return the process-wide instance for this project, location and credentials"""
+        return registry.get_client(cls, project_id, location, credentials, **kwargs)
+
+    def _send(self, method: str, url: str, json=None, **kwargs):
+        if json is not None:
+            kwargs["data"] = json if isinstance(json, bytes) else codec.dumps(json)
+        return self.transport.send(
+            self.session.request,
+            method,
+            url,
+            retry_exceptions=RETRY_EXCEPTIONS,
+            headers=self.header,
+            **kwargs
+        )
 
     def create(
             self,
@@ -27,13 +89,13 @@ class HealthcareApi:
             fhir_store_id: str,
             resource: str,
             payload: dict
-            ) -> dict:
+            ) -> FhirResponse:
         """Create a new resource in the FHIR store"""
         resource_path = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}"
 
-        response = self.session.post(resource_path, headers=self.header, json=payload)
+        response = self._send("POST", resource_path, json=payload)
 
-        return {"status_code": response.status_code, "body": response.json()}
+        return FhirResponse.from_response(response)
 
     def update(
             self,
@@ -42,13 +104,13 @@ class HealthcareApi:
             resource: str,
             resource_id: str,
             payload: dict,
-            ) -> dict:
+            ) -> FhirResponse:
         """Update an existing resource in the FHIR store"""
         resource_path = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}/{resource_id}"
 
-        response = self.session.put(resource_path, headers=self.header, json=payload)
+        response = self._send("PUT", resource_path, json=payload)
 
-        return {"status_code": response.status_code, "body": response.json()}
+        return FhirResponse.from_response(response)
 
     def update_conditional(
             self,
@@ -57,7 +119,7 @@ class HealthcareApi:
             resource: str,
             condition: str,
             payload: dict,
-            ) -> dict:
+            ) -> FhirResponse:
         """
         If a resource is found based on the search criteria specified in the query parameters,
          updates the entire contents of that resource.
@@ -78,15 +140,14 @@ class HealthcareApi:
 
         """
 
-        base_url_beta = "https://healthcare.googleapis.com/v1beta1"
-        url_beta = f"{base_url_beta}/projects/{self.project_id}/locations/{self.location}"
+        url_beta = f"{self.base_url_beta}/projects/{self.project_id}/locations/{self.location}"
 
         resource_path = f"{url_beta}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}"
         resource_path += f"?{condition}"
 
-        response = self.session.put(resource_path, headers=self.header, json=payload)
+        response = self._send("PUT", resource_path, json=payload)
 
-        return {"status_code": response.status_code, "body": response.json()}
+        return FhirResponse.from_response(response)
 
     def read(
             self,
@@ -94,13 +155,13 @@ class HealthcareApi:
             fhir_store_id: str,
             resource: str,
             resource_id: str
-            ) -> dict:
+            ) -> FhirResponse:
         """Read the contents of a specific resource in the FHIR store"""
         resource_path = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}/{resource_id}"
 
-        response = self.session.get(resource_path, headers=self.header)
+        response = self._send("GET", resource_path)
 
-        return {"status_code": response.status_code, "body": response.json()}
+        return FhirResponse.from_response(response)
 
     def read_conditional(
             self,
@@ -108,7 +169,7 @@ class HealthcareApi:
             fhir_store_id: str,
             resource: str,
             condition: str
-            ) -> dict:
+            ) -> FhirResponse:
         """
         If a resource is found based on the search criteria specified in the query parameters,
         read the entire contents of that resource.
@@ -116,9 +177,73 @@ class HealthcareApi:
         resource_path = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}"
         resource_path += f"?{condition}"
 
-        response = self.session.get(resource_path, headers=self.header)
+        response = self._send("GET", resource_path)
 
-        return {"status_code": response.status_code, "body": response.json()}
+        return FhirResponse.from_response(response)
+
+    def search_iter(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            condition: str = "",
+            count: int = 100,
+            prefetch: bool = False
+            ) -> Iterator[dict]:
+        """
+        Iterate over every resource matching the search criteria, following the `next` links of
+        the search Bundle. Only one page (two with `prefetch`) is held in memory at a time.
+
+        Raises:
+            HealthcareApiError: If any page is answered with an error status code.
+        """
+        resource_path = (
+            f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+            f"/fhir/{resource}"
+        )
+        resource_path += f"?_count={count}"
+        if condition:
+            resource_path += f"&{condition}"
+
+        return iter_entries(iter_pages(self._get, resource_path, prefetch))
+
+    def search_stream(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            condition: str = "",
+            count: int = 1000
+            ) -> Iterator[dict]:
+        """
+        Like `search_iter`, but each page is parsed incrementally while it is read from the
+        socket, so memory stays flat even for very large pages. Requires the `ijson` package.
+
+        Raises:
+            HealthcareApiError: If any page is answered with an error status code.
+        """
+        url = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}"
+        url += f"?_count={count}"
+        if condition:
+            url += f"&{condition}"
+
+        while url:
+            response = self._send("GET", url, stream=True)
+            links = {}
+            try:
+                if response.status_code != 200:
+                    body = FhirResponse.from_response(response).body
+                    raise HealthcareApiError(response.status_code, body)
+                response.raw.decode_content = True
+                yield from stream_bundle_entries(response.raw, links)
+            finally:
+                response.close()
+            url = links.get("next")
+
+    def _get(self, url: str) -> FhirResponse:
+        response = self._send("GET", url)
+
+        return FhirResponse.from_response(response)
 
     def delete(
             self,
@@ -126,7 +251,7 @@ class HealthcareApi:
             fhir_store_id: str,
             resource: str,
             resource_id: str
-            ) -> dict:
+            ) -> FhirResponse:
         """
         Delete a resource from the FHIR store
 
@@ -136,16 +261,45 @@ class HealthcareApi:
         """
         resource_path = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir/{resource}/{resource_id}"
 
-        response = self.session.delete(resource_path, headers=self.header)
+        response = self._send("DELETE", resource_path)
+
+        return FhirResponse.from_response(response)
+
+    def execute_bundle(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            payload: Union[dict, bytes]
+            ) -> FhirResponse:
+        """
+        Execute a batch or transaction Bundle in the FHIR store.
+        The Bundle may be given already serialized as bytes.
+
+        Response code:
+            200 Success
+                The Bundle was executed. For batches, each entry carries its own status.
+        """
+        resource_path = f"{self.url}/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir"
+
+        response = self._send("POST", resource_path, json=payload)
+
+        return FhirResponse.from_response(response)
 
-        return {"status_code": response.status_code, "body": response.json()}
+    def bundle(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            **kwargs
+            ) -> BundleBuilder:
+        """Start a `BundleBuilder` accumulating writes to the FHIR store"""
+        return BundleBuilder(self, dataset_id, fhir_store_id, **kwargs)
 
 
 class FastCRUD(HealthcareApi):
     """The  FastCRUD  class is a subclass of HealthcareApi that provides additional convenience methods for most common CRUD actions."""
 
-    def __init__(self, project_id, location):
-        super().__init__(project_id, location)
+    def __init__(self, project_id, location, **kwargs):
+        super().__init__(project_id, location, **kwargs)
 
     def resource_search_lastupdated(
             self,
@@ -153,17 +307,30 @@ class FastCRUD(HealthcareApi):
             fhir_store_id: str,
             resource: str,
             since: str
-            ) -> dict:
+            ) -> FhirResponse:
         """Read the entries from a resource in the FHIR store that were last updated after a specific date and time"""
         parameter = f"_lastUpdated=gt{since}"
         return self.read_conditional(dataset_id, fhir_store_id, resource, parameter)
 
+    def resource_search_lastupdated_iter(
+            self,
+            dataset_id: str,
+            fhir_store_id: str,
+            resource: str,
+            since: str,
+            count: int = 100,
+            prefetch: bool = False
+            ) -> Iterator[dict]:
+        """Iterate over the resources in the FHIR store last updated after a date and time"""
+        parameter = f"_lastUpdated=gt{since}"
+        return self.search_iter(dataset_id, fhir_store_id, resource, parameter, count, prefetch)
+
     def patient_search(
             self,
             dataset_id: str,
             fhir_store_id: str,
             cpf: str
-            ) -> dict:
+            ) -> FhirResponse:
         """Read the entries from Patient resource in the FHIR store based on tax id (CPF)"""
         parameter = f"identifier=https://rnds-fhir.saude.gov.br/NamingSystem/cpf|{cpf}"
         return self.read_conditional(dataset_id, fhir_store_id, "Patient", parameter)
@@ -174,7 +341,7 @@ class FastCRUD(HealthcareApi):
             fhir_store_id: str,
             cpf: str,
             payload: dict
-            ) -> dict:
+            ) -> FhirResponse:
         """Update the entries from Patient resource in the FHIR store based on tax id (CPF)"""
         parameter = f"identifier=https://rnds-fhir.saude.gov.br/NamingSystem/cpf|{cpf}"
         return self.update_conditional(dataset_id, fhir_store_id, "Patient", parameter, payload)
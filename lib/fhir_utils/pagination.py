@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Iterator
+
+from fhir_utils.exceptions import HealthcareApiError
+
+
+def next_link(bundle: dict) -> str:
+    """Return the URL of the next page of a search Bundle, or None on the last page"""
+    for link in bundle.get("link", []):
+        if link.get("relation") == "next":
+            return link.get("url")
+    return None
+
+
+def _check(response: dict) -> dict:
+    if response["status_code"] != 200:
+        raise HealthcareApiError(response["status_code"], response["body"])
+    return response["body"]
+
+
+def iter_pages(
+        fetch: Callable[[str], dict],
+        url: str,
+        prefetch: bool = False
+        ) -> Iterator[dict]:
+    """
+    Yield the pages of a search Bundle, following its `next` links.
+
+    Args:
+        fetch (Callable[[str], dict]): Function performing a GET on a URL and returning a
+            `{"status_code", "body"}` dict.
+        url (str): URL of the first page.
+        prefetch (bool, optional): Fetch the next page in a background thread while the current
+            one is consumed. At most two pages are held in memory. Defaults to False.
+
+    Raises:
+        HealthcareApiError: If any page is answered with a status code other than 200.
+    """
+    if not prefetch:
+        while url:
+            page = _check(fetch(url))
+            url = next_link(page)
+            yield page
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch, url)
+        while future is not None:
+            page = _check(future.result())
+            url = next_link(page)
+            future = executor.submit(fetch, url) if url else None
+            yield page
+
+
+async def aiter_pages(
+        fetch: Callable[[str], Awaitable[dict]],
+        url: str,
+        prefetch: bool = False
+        ) -> AsyncIterator[dict]:
+    """Asynchronous counterpart of `iter_pages`, prefetching in a background task"""
+    if not prefetch:
+        while url:
+            page = _check(await fetch(url))
+            url = next_link(page)
+            yield page
+        return
+
+    task = asyncio.ensure_future(fetch(url))
+    try:
+        while task is not None:
+            page = _check(await task)
+            url = next_link(page)
+            task = asyncio.ensure_future(fetch(url)) if url else None
+            yield page
+    finally:
+        if task is not None:
+            task.cancel()
+
+
+def iter_entries(pages: Iterator[dict]) -> Iterator[dict]:
+    """Yield the resources of each page's entries"""
+    for page in pages:
+        for entry in page.get("entry", []):
+            yield entry["resource"]
+
+
+async def aiter_entries(pages: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """Asynchronous counterpart of `iter_entries`"""
+    async for page in pages:
+        for entry in page.get("entry", []):
+            yield entry["resource"]
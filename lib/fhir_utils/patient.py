@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion between patient records and FHIR Patient resources.
+
+Records are the JSON-compatible dicts of the API's `PatientModel` (`model_dump(mode="json")`):
+`cpf`, `cns`, `name`, `birth_date`, `address` and so on. How each field maps to the resource is
+described by a table of `Field`s (`PATIENT_FIELDS`). `PatientMapper` compiles the table once into
+two plain Python functions, one per direction, so converting a record runs straight-line code,
+without looking the table up or inspecting the record.
+
+>>> mapper = PatientMapper()
+>>> resource = mapper.to_fhir({"cpf": "12345678901", "name": "Maria", "gender": "female"})
+>>> resource["identifier"]
+[{'system': 'https://rnds-fhir.saude.gov.br/NamingSystem/cpf', 'value': '12345678901'}]
+>>> mapper.from_fhir(resource)["name"]
+'Maria'
+"""
+from typing import Iterable
+
+CPF_SYSTEM = "https://rnds-fhir.saude.gov.br/NamingSystem/cpf"
+CNS_SYSTEM = "https://rnds-fhir.saude.gov.br/NamingSystem/cns"
+ROLE_CODE_SYSTEM = "http://terminology.hl7.org/CodeSystem/v3-RoleCode"
+BIRTH_PLACE_URL = "http://hl7.org/fhir/StructureDefinition/patient-birthPlace"
+RACE_URL = "http://www.saude.gov.br/fhir/r4/StructureDefinition/BRRacaCorEtnia-1.0"
+ETHNICITY_URL = "http://www.saude.gov.br/fhir/r4/StructureDefinition/BREtniaIndigena-1.0"
+NATIONALITY_URL = "http://www.saude.gov.br/fhir/r4/StructureDefinition/BRNacionalidade-1.0"
+NATURALIZATION_URL = "http://www.saude.gov.br/fhir/r4/StructureDefinition/BRNaturalizacao-1.0"
+PROTECTED_PERSON_URL = "http://www.saude.gov.br/fhir/r4/StructureDefinition/BRPessoaProtegida-1.0"
+
+# Field kinds.
+ELEMENT = "element"  # A resource element, e.g. "birthDate", or a nested one, e.g. "meta.source".
+IDENTIFIER = "identifier"  # The value of the identifier of system `target`.
+NAME = "name"  # The text of the first name.
+CONTACT = "contact"  # The name of the contact of relationship `target`, e.g. "MTH".
+EXTENSION = "extension"  # The `value` of the extension of URL `target`, e.g. "valueCode".
+LINES = "lines"  # An address line, as the `target` list of lines.
+PERIOD = "period"  # A period, with its `start` and `end`.
+LIST = "list"  # A list of items, each converted by `fields`, e.g. the addresses.
+
+
+class Field:
+    """
+    How a field of the records maps to the resources.
+
+    Args:
+        name (str): Key of the field in the records.
+        kind (str): How the field is converted, one of the field kinds of this module.
+        target (str, optional): The element, identifier system, contact relationship or extension
+            URL of the field, depending on its kind.
+        value (str, optional): For extensions, the value element, e.g. "valueCode", or a path
+            in it, e.g. "valueAddress.city". Fields with the same extension URL share it.
+        fields (tuple[Field], optional): For lists, the fields of each item.
+    """
+
+    __slots__ = ("name", "kind", "target", "value", "fields")
+
+    def __init__(
+            self,
+            name: str,
+            kind: str,
+            target: str = None,
+            value: str = None,
+            fields: tuple = ()
+            ):
+        self.name = name
+        self.kind = kind
+        self.target = target
+        self.value = value
+        self.fields = fields
+
+    def __repr__(self) -> str:
+        return f"Field({self.name!r}, {self.kind!r}, {self.target!r})"
+
+
+ADDRESS_FIELDS = (
+    Field("use", ELEMENT, "use"),
+    Field("type", ELEMENT, "type"),
+    Field("line", LINES, "line"),
+    Field("city", ELEMENT, "city"),
+    Field("state", ELEMENT, "state"),
+    Field("country", ELEMENT, "country"),
+    Field("postal_code", ELEMENT, "postalCode"),
+    Field("period", PERIOD, "period"),
+)
+
+TELECOM_FIELDS = (
+    Field("system", ELEMENT, "system"),
+    Field("use", ELEMENT, "use"),
+    Field("value", ELEMENT, "value"),
+    Field("rank", ELEMENT, "rank"),
+    Field("period", PERIOD, "period"),
+)
+
+PATIENT_FIELDS = (
+    Field("cpf", IDENTIFIER, CPF_SYSTEM),
+    Field("cns", IDENTIFIER, CNS_SYSTEM),
+    Field("data_source_name", ELEMENT, "meta.source"),
+    Field("active", ELEMENT, "active"),
+    Field("name", NAME, "name"),
+    Field("gender", ELEMENT, "gender"),
+    Field("birth_date", ELEMENT, "birthDate"),
+    Field("deceased", ELEMENT, "deceasedBoolean"),
+    Field("mother", CONTACT, "MTH"),
+    Field("father", CONTACT, "FTH"),
+    Field("birth_city", EXTENSION, BIRTH_PLACE_URL, "valueAddress.city"),
+    Field("birth_state", EXTENSION, BIRTH_PLACE_URL, "valueAddress.state"),
+    Field("birth_country", EXTENSION, BIRTH_PLACE_URL, "valueAddress.country"),
+    Field("race", EXTENSION, RACE_URL, "valueCode"),
+    Field("ethnicity", EXTENSION, ETHNICITY_URL, "valueCode"),
+    Field("nationality", EXTENSION, NATIONALITY_URL, "valueCode"),
+    Field("naturalization", EXTENSION, NATURALIZATION_URL, "valueString"),
+    Field("protected_person", EXTENSION, PROTECTED_PERSON_URL, "valueBoolean"),
+    Field("address", LIST, "address", fields=ADDRESS_FIELDS),
+    Field("telecom", LIST, "telecom", fields=TELECOM_FIELDS),
+)
+
+
+class PatientMapper:
+    """
+    Bidirectional converter between patient records and FHIR Patient resources.
+
+    The conversion functions are generated from `fields` when the mapper is created, which takes
+    a fraction of a millisecond: create a mapper once and reuse it. Their source code is kept in
+    `source` for debugging.
+
+    `to_fhir` leaves out the fields that are None; `from_fhir` returns every field of `fields`,
+    None when the resource does not have it.
+
+    Args:
+        fields (tuple[Field], optional): The mapping. Defaults to `PATIENT_FIELDS`.
+    """
+
+    def __init__(self, fields: tuple = PATIENT_FIELDS):
+        self.fields = fields
+        self.source = _compile_source(fields)
+        namespace = {"_name_text": _name_text}
+        exec(compile(self.source, f"<{type(self).__name__}>", "exec"), namespace)
+        self.to_fhir = namespace["to_fhir"]
+        self.from_fhir = namespace["from_fhir"]
+
+    def to_fhir_many(self, records: Iterable[dict]) -> list[dict]:
+        """Convert a batch of records to Patient resources"""
+        return list(map(self.to_fhir, records))
+
+    def from_fhir_many(self, resources: Iterable[dict]) -> list[dict]:
+        """Convert a batch of Patient resources to records"""
+        return list(map(self.from_fhir, resources))
+
+
+def to_fhir(record: dict) -> dict:
+    """
+    Convert a record with the default mapping. Usable as the converter of a pipeline:
+    "fhir_utils.patient:to_fhir".
+    """
+    return _default_mapper.to_fhir(record)
+
+
+def from_fhir(resource: dict) -> dict:
+    """Convert a Patient resource with the default mapping"""
+    return _default_mapper.from_fhir(resource)
+
+
+class _Source:
+    """Lines of generated Python code"""
+
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+
+    def add(self, line: str = "") -> None:
+        self.lines.append("    " * self.depth + line)
+
+    def block(self, line: str) -> "_Source":
+        self.add(line)
+        return self
+
+    def __enter__(self):
+        self.depth += 1
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+
+    def __str__(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def _compile_source(fields: tuple) -> str:
+    """Generate the source code of the `to_fhir` and `from_fhir` functions of `fields`"""
+    source = _Source()
+    lists = [field for field in fields if field.kind == LIST]
+    for field in lists:
+        _to_fhir_function(source, f"_{field.name}_to_fhir", "item", field.fields)
+        _from_fhir_function(source, f"_{field.name}_from_fhir", "item", field.fields)
+    _to_fhir_function(source, "to_fhir", "record", fields)
+    _from_fhir_function(source, "from_fhir", "resource", fields)
+    return str(source)
+
+
+def _to_fhir_function(source: _Source, function: str, argument: str, fields: tuple) -> None:
+    is_resource = argument == "record"
+    with source.block(f"def {function}({argument}):"):
+        source.add('resource = {"resourceType": "Patient"}' if is_resource else "resource = {}")
+        identifiers = [field for field in fields if field.kind == IDENTIFIER]
+        contacts = [field for field in fields if field.kind == CONTACT]
+        extensions = {}
+        for field in fields:
+            if field.kind == EXTENSION:
+                extensions.setdefault(field.target, []).append(field)
+        if identifiers:
+            source.add("identifier = []")
+        if contacts:
+            source.add("contact = []")
+        if extensions:
+            source.add("extension = []")
+
+        for field in fields:
+            if field.kind == EXTENSION:
+                continue
+            source.add(f"value = {argument}.get({field.name!r})")
+            with source.block("if value is not None:" if field.kind != LIST else "if value:"):
+                _to_fhir_field(source, field)
+
+        for url, extension_fields in extensions.items():
+            source.add(f"item = {{'url': {url!r}}}")
+            for field in extension_fields:
+                source.add(f"value = {argument}.get({field.name!r})")
+                with source.block("if value is not None:"):
+                    source.add(f"{_assignment_target('item', field.value)} = value")
+            with source.block("if len(item) > 1:"):
+                source.add("extension.append(item)")
+
+        for name, found in (
+            ("identifier", identifiers),
+            ("contact", contacts),
+            ("extension", extensions),
+        ):
+            if found:
+                with source.block(f"if {name}:"):
+                    source.add(f"resource[{name!r}] = {name}")
+        source.add("return resource")
+    source.add()
+
+
+def _to_fhir_field(source: _Source, field: Field) -> None:
+    if field.kind == ELEMENT:
+        source.add(f"{_assignment_target('resource', field.target)} = value")
+    elif field.kind == IDENTIFIER:
+        source.add(f"identifier.append({{'system': {field.target!r}, 'value': value}})")
+    elif field.kind == NAME:
+        source.add(f"resource[{field.target!r}] = [{{'text': value}}]")
+    elif field.kind == CONTACT:
+        relationship = [{"coding": [{"system": ROLE_CODE_SYSTEM, "code": field.target}]}]
+        contact = f"{{'relationship': {relationship!r}, 'name': {{'text': value}}}}"
+        source.add(f"contact.append({contact})")
+    elif field.kind == LINES:
+        source.add(f"resource[{field.target!r}] = [value]")
+    elif field.kind == PERIOD:
+        source.add(
+            f"resource[{field.target!r}] = "
+            "{key: date for key, date in value.items() if date is not None}"
+        )
+    elif field.kind == LIST:
+        source.add(f"resource[{field.target!r}] = [_{field.name}_to_fhir(item) for item in value]")
+    else:
+        raise ValueError(f'Unknown field kind "{field.kind}".')
+
+
+def _from_fhir_function(source: _Source, function: str, argument: str, fields: tuple) -> None:
+    with source.block(f"def {function}({argument}):"):
+        # Membership tests on set literals of constants are compiled to frozenset constants.
+        identifiers = _set_literal(field.target for field in fields if field.kind == IDENTIFIER)
+        contacts = _set_literal(field.target for field in fields if field.kind == CONTACT)
+        if identifiers:
+            source.add("identifiers = {}")
+            with source.block(f"for item in {argument}.get('identifier', ()):"):
+                source.add("system = item.get('system')")
+                with source.block(f"if system in {identifiers} and system not in identifiers:"):
+                    source.add("identifiers[system] = item.get('value')")
+        if contacts:
+            source.add("contacts = {}")
+            with source.block(f"for item in {argument}.get('contact', ()):"):
+                with source.block("for relationship in item.get('relationship', ()):"):
+                    with source.block("for coding in relationship.get('coding', ()):"):
+                        with source.block(f"if coding.get('code') in {contacts}:"):
+                            name = "item.get('name', {}).get('text')"
+                            source.add(f"contacts[coding['code']] = {name}")
+        if any(field.kind == EXTENSION for field in fields):
+            extensions = f"{argument}.get('extension', ())"
+            source.add(f"extensions = {{item.get('url'): item for item in {extensions}}}")
+
+        source.add("return {")
+        with source:
+            for field in fields:
+                source.add(f"{field.name!r}: {_from_fhir_value(field, argument)},")
+        source.add("}")
+    source.add()
+
+
+def _from_fhir_value(field: Field, argument: str) -> str:
+    """The expression reading `field` from the resource `argument`"""
+    if field.kind == ELEMENT:
+        *parents, key = field.target.split(".")
+        container = argument + "".join(f".get({parent!r}, {{}})" for parent in parents)
+        return f"{container}.get({key!r})"
+    if field.kind == IDENTIFIER:
+        return f"identifiers.get({field.target!r})"
+    if field.kind == NAME:
+        return f"(_name_text(names[0]) if (names := {argument}.get({field.target!r})) else None)"
+    if field.kind == CONTACT:
+        return f"contacts.get({field.target!r})"
+    if field.kind == EXTENSION:
+        path = "".join(f".get({key!r}, {{}})" for key in field.value.split(".")[:-1])
+        key = field.value.split(".")[-1]
+        return f"extensions.get({field.target!r}, {{}}){path}.get({key!r})"
+    if field.kind == LINES:
+        return f"(', '.join(lines) if (lines := {argument}.get({field.target!r})) else None)"
+    if field.kind == PERIOD:
+        return (
+            "({'start': period.get('start'), 'end': period.get('end')} "
+            f"if (period := {argument}.get({field.target!r})) else None)"
+        )
+    if field.kind == LIST:
+        return (
+            f"([_{field.name}_from_fhir(item) for item in items] "
+            f"if (items := {argument}.get({field.target!r})) else None)"
+        )
+    raise ValueError(f'Unknown field kind "{field.kind}".')
+
+
+def _assignment_target(container: str, path: str) -> str:
+    """The assignment target of the dotted `path` in `container`, creating the parents"""
+    *parents, key = path.split(".")
+    parents = "".join(f".setdefault({parent!r}, {{}})" for parent in parents)
+    return f"{container}{parents}[{key!r}]"
+
+
+def _set_literal(values: Iterable[str]) -> str:
+    values = list(values)
+    return "{" + ", ".join(map(repr, values)) + "}" if values else ""
+
+
+def _name_text(name: dict) -> str:
+    """The text of a HumanName, or its given names followed by its family name"""
+    if name.get("text"):
+        return name["text"]
+    return " ".join([*name.get("given", ()), name.get("family", "")]).strip() or None
+
+
+_default_mapper = PatientMapper()
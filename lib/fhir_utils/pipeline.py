@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel conversion of source extracts (XML, JSON, NDJSON) into NDJSON records.
+
+Input files are split into shards that are parsed and converted by a process pool:
+- plain NDJSON files, into line-aligned byte ranges;
+- plain XML files, when `xml_record_tag` names the record elements (children of the root), into
+  byte ranges aligned on the start tags of the records. The tag must not also name an element
+  nested within the records, nor appear in comments or CDATA sections;
+- other inputs (JSON, gzipped files, XML without `xml_record_tag`) cannot be split, each is a
+  single shard parsed by a single worker: pass several files to parse them in parallel.
+
+Workers write the converted records of each shard to a spool file, which the parent process
+copies to the output in fixed-size chunks, so neither side holds a whole shard's output in memory.
+At most `max_pending` shards are in flight, so fast parsers cannot outrun the writer.
+"""
+import importlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterable, Iterator
+
+from loguru import logger
+
+from fhir_utils import codec
+from fhir_utils.utils import (
+    GZIP_MAGIC,
+    iter_json_array,
+    iter_ndjson,
+    iter_xml_records,
+    open_maybe_gzip,
+)
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+XML_ENCODING = re.compile(rb"""<\?xml[^>]*encoding=["']([A-Za-z0-9._-]+)["']""")
+# Bytes read at a time when looking for the end of an XML shard, and when copying spool files.
+CHUNK_BYTES = 1024 ** 2
+
+
+class Shard:
+    """A unit of work: a whole input file, or a byte range of a plain NDJSON or XML file"""
+
+    __slots__ = ("index", "path", "start", "end")
+
+    def __init__(self, index: int, path: str, start: int = 0, end: int = None):
+        self.index = index
+        self.path = path
+        self.start = start
+        self.end = end
+
+    def __repr__(self) -> str:
+        return f"Shard({self.index}, {self.path!r}, {self.start}, {self.end})"
+
+
+class PipelineReport:
+    """Counters describing a pipeline run"""
+
+    def __init__(self):
+        self.shards = 0
+        self.records_in = 0
+        self.records_out = 0
+        self.bytes_written = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def records_per_second(self) -> float:
+        return self.records_in / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "shards": self.shards,
+            "records_in": self.records_in,
+            "records_out": self.records_out,
+            "bytes_written": self.bytes_written,
+            "seconds": round(self.seconds, 3),
+            "records_per_second": round(self.records_per_second, 1),
+        }
+
+    def __repr__(self) -> str:
+        return f"PipelineReport({self.as_dict()})"
+
+
+def _is_ndjson(path: str) -> bool:
+    name = str(path).lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return name.endswith(NDJSON_EXTENSIONS)
+
+
+def _is_xml(path: str) -> bool:
+    return str(path).lower().endswith((".xml", ".xml.gz"))
+
+
+def plan_shards(
+        paths: Iterable[str],
+        shard_bytes: int = 64 * 1024 ** 2,
+        xml_record_tag: str = None,
+        ) -> list[Shard]:
+    """
+    Split the input files into shards of roughly `shard_bytes` where the format allows it: plain
+    NDJSON files, and plain XML files if `xml_record_tag` is given.
+    """
+    shards = []
+    for path in paths:
+        size = os.path.getsize(path)
+        with open(path, "rb") as file:
+            gzipped = file.read(2) == GZIP_MAGIC
+        splittable = _is_ndjson(path) or (_is_xml(path) and xml_record_tag is not None)
+        if not splittable or gzipped or size <= shard_bytes:
+            shards.append(Shard(len(shards), str(path)))
+            continue
+        for start in range(0, size, shard_bytes):
+            shards.append(Shard(len(shards), str(path), start, min(start + shard_bytes, size)))
+    return shards
+
+
+def _iter_ndjson_range(path: str, start: int, end: int) -> Iterator[dict]:
+    """Yield the NDJSON lines that start within [start, end)"""
+    with open(path, "rb") as file:
+        if start:
+            # The line crossing `start` belongs to the previous shard.
+            file.seek(start - 1)
+            file.readline()
+        while file.tell() < end:
+            line = file.readline()
+            if not line:
+                break
+            if line.strip():
+                yield codec.loads(line)
+
+
+def _find_start_tag(data: bytes, tag: bytes, position: int) -> int:
+    """Index of the first start tag `tag` at or after `position` in `data`, or -1"""
+    while True:
+        position = data.find(b"<" + tag, position)
+        if position < 0:
+            return -1
+        # Not another tag sharing the prefix, e.g. <patientName> for <patient>.
+        following = data[position + len(tag) + 1:position + len(tag) + 2]
+        if following and following in b" \t\r\n/>":
+            return position
+        position += 1
+
+
+def _iter_xml_range(path: str, start: int, end: int, record_tag: str) -> Iterator[dict]:
+    """
+    Yield the records of an XML file whose start tags begin within [start, end). The records
+    are parsed as the children of a synthetic root, in the encoding declared by the file.
+    """
+    tag = record_tag.encode()
+    with open(path, "rb") as file:
+        declaration = XML_ENCODING.search(file.read(256))
+        file.seek(start)
+        data = file.read(end - start)
+        first = _find_start_tag(data, tag, 0)
+        if first < 0:
+            return
+        # The last record runs until the next start tag, or the closing tag of the root.
+        while (stop := _find_start_tag(data, tag, end - start)) < 0:
+            chunk = file.read(CHUNK_BYTES)
+            if not chunk:
+                stop = data.rfind(b"</")
+                break
+            data += chunk
+    document = io.BytesIO(b"<records>" + data[first:stop] + b"</records>")
+    encoding = declaration.group(1).decode() if declaration else None
+    yield from iter_xml_records(document, item_depth=2, encoding=encoding)
+
+
+def iter_records(
+        shard: Shard,
+        json_prefix: str = "item",
+        item_depth: int = 2,
+        xml_record_tag: str = None,
+        ) -> Iterator[dict]:
+    """Yield the raw records of a shard according to its file format"""
+    path = shard.path
+    if shard.end is not None and _is_xml(path):
+        return _iter_xml_range(path, shard.start, shard.end, xml_record_tag)
+    if shard.end is not None:
+        return _iter_ndjson_range(path, shard.start, shard.end)
+    if _is_ndjson(path):
+        return iter_ndjson(path)
+    if _is_xml(path):
+        return iter_xml_records(path, item_depth=item_depth)
+    if path.lower().endswith((".json", ".json.gz")):
+        return iter_json_array(path, json_prefix)
+    raise ValueError(f"Unsupported input format: {path}")
+
+
+def load_converter(spec: str) -> Callable[[dict], dict]:
+    """Import a converter given as "package.module:function\""""
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f'Converter must be given as "module:function", got "{spec}"')
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def _identity(record: dict) -> dict:
+    return record
+
+
+def _convert_shard(
+        shard: Shard,
+        converter,
+        json_prefix: str,
+        item_depth: int,
+        xml_record_tag: str,
+        spool_dir: str,
+        ) -> tuple:
+    """Worker: convert a shard into a spool file, returning (records read, records written, path)"""
+    if isinstance(converter, str):
+        converter = load_converter(converter)
+    records_in = records_out = 0
+    path = os.path.join(spool_dir, f"{shard.index}.ndjson")
+    with open(path, "wb", buffering=CHUNK_BYTES) as file:
+        for record in iter_records(shard, json_prefix, item_depth, xml_record_tag):
+            records_in += 1
+            converted = converter(record)
+            if converted is None:
+                continue
+            file.write(codec.dumps(converted) + b"\n")
+            records_out += 1
+    return records_in, records_out, path
+
+
+def run_pipeline(
+        inputs: Iterable[str],
+        output: str,
+        converter=None,
+        workers: int = None,
+        ordered: bool = True,
+        max_pending: int = None,
+        shard_bytes: int = 64 * 1024 ** 2,
+        json_prefix: str = "item",
+        item_depth: int = 2,
+        xml_record_tag: str = None,
+        progress_interval: float = 10.0
+        ) -> PipelineReport:
+    """
+    Convert the records of `inputs` in parallel and write them to the NDJSON file `output`.
+
+    Args:
+        inputs (Iterable[str]): Paths of .xml, .json, .ndjson/.jsonl files (optionally gzipped).
+        output (str): Output NDJSON path, gzipped if it ends with ".gz".
+        converter (Callable or str, optional): Picklable function (or "module:function") mapping
+            a raw record to the dict to write, or to None to drop it. Defaults to identity.
+        workers (int, optional): Number of worker processes. Defaults to the CPU count.
+        ordered (bool, optional): Write shards in input order. When False, shards are written
+            as soon as they are converted. Defaults to True.
+        max_pending (int, optional): Maximum number of shards converted but not yet written,
+            bounding the spool files on disk. Defaults to twice the number of workers.
+        shard_bytes (int, optional): Target size of the byte ranges plain NDJSON and XML files
+            are split into. Defaults to 64 MiB.
+        json_prefix (str, optional): ijson prefix of the records in JSON inputs.
+        item_depth (int, optional): Depth of the records in XML inputs.
+        xml_record_tag (str, optional): Tag of the records in XML inputs, which allows to split
+            plain XML files. Requires `item_depth` 2. See the module docstring.
+        progress_interval (float, optional): Seconds between progress log lines.
+
+    Returns:
+        PipelineReport: Record counts and throughput.
+    """
+    if xml_record_tag is not None and item_depth != 2:
+        raise ValueError("xml_record_tag requires item_depth 2")
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    converter = converter or _identity
+    shards = iter(plan_shards(inputs, shard_bytes, xml_record_tag))
+    report = PipelineReport()
+    last_progress = time.monotonic()
+
+    # Spool files are written next to the output, on the disk expected to have room for it.
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as spool_dir, \
+            ProcessPoolExecutor(max_workers=workers) as executor, \
+            open_maybe_gzip(output, "wb") as file:
+        pending = {}
+
+        def submit_next() -> bool:
+            shard = next(shards, None)
+            if shard is None:
+                return False
+            future = executor.submit(
+                _convert_shard,
+                shard,
+                converter,
+                json_prefix,
+                item_depth,
+                xml_record_tag,
+                spool_dir,
+            )
+            pending[future] = shard
+            return True
+
+        while len(pending) < max_pending and submit_next():
+            pass
+        while pending:
+            if ordered:
+                future = min(pending, key=lambda future: pending[future].index)
+                future.result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = next(iter(done))
+            pending.pop(future)
+            records_in, records_out, spool_path = future.result()
+            with open(spool_path, "rb") as spool:
+                shutil.copyfileobj(spool, file, CHUNK_BYTES)
+                report.bytes_written += spool.tell()
+            os.remove(spool_path)
+            report.shards += 1
+            report.records_in += records_in
+            report.records_out += records_out
+            submit_next()
+
+            if time.monotonic() - last_progress >= progress_interval:
+                last_progress = time.monotonic()
+                logger.info(
+                    f"{report.shards} shards, {report.records_in} records "
+                    f"({report.records_per_second:,.0f} records/s)"
+                )
+
+    report.finished_at = time.monotonic()
+    logger.info(f"Pipeline finished: {report.as_dict()}")
+    return report
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+from collections.abc import Mapping
+from typing import AsyncIterator, Iterator
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+from fhir_utils import codec
+
+ENTRY_RESOURCE_PREFIX = "entry.item.resource"
+
+
+class _LazyBody:
+    """The body of a `FhirResponse` that was not decoded yet"""
+
+    __slots__ = ("content",)
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def __json__(self):
+        return codec.loads(self.content) if self.content else None
+
+
+class FhirResponse(dict):
+    """
+    Response of a Healthcare API request whose body is decoded lazily.
+
+    It is the `{"status_code", "body"}` dict the clients used to return, so `json.dumps`,
+    `fhir_utils.codec.dumps` and `isinstance(response, dict)` keep working, but the JSON body is
+    only parsed the first time it is read, through `body` or any dict access that needs it.
+    Callers that only check the status code, e.g. after a `delete`, never pay for decoding.
+
+    Until then, the dict itself holds a `_LazyBody` for serializers that read it directly, such as
+    orjson and msgspec, which the codecs of `fhir_utils.codec` decode through `__json__`.
+    """
+
+    __slots__ = ("status_code", "headers", "content", "_decoded")
+
+    def __init__(self, status_code: int, content: bytes, headers: Mapping = None):
+        super().__init__(status_code=status_code, body=_LazyBody(content))
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self.content = content
+        self._decoded = False
+
+    @classmethod
+    def from_response(cls, response) -> "FhirResponse":
+        """Wrap a `requests` or `httpx` response"""
+        return cls(response.status_code, response.content, response.headers)
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+    @property
+    def body(self):
+        """The decoded JSON body, or None if the response has no content"""
+        self._decode()
+        return dict.get(self, "body")
+
+    def json(self):
+        return self.body
+
+    def _decode(self) -> None:
+        if not self._decoded:
+            dict.__setitem__(self, "body", codec.loads(self.content) if self.content else None)
+            self._decoded = True
+
+    # Every dict read but the one of the status code decodes the body first.
+    def __getitem__(self, key):
+        if key != "status_code":
+            self._decode()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key != "status_code":
+            self._decode()
+        return super().get(key, default)
+
+    def __iter__(self):
+        self._decode()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        self._decode()
+        return super().__len__()
+
+    def __contains__(self, key) -> bool:
+        self._decode()
+        return super().__contains__(key)
+
+    def __eq__(self, other) -> bool:
+        self._decode()
+        return super().__eq__(other)
+
+    def __ne__(self, other) -> bool:
+        self._decode()
+        return super().__ne__(other)
+
+    def keys(self):
+        self._decode()
+        return super().keys()
+
+    def values(self):
+        self._decode()
+        return super().values()
+
+    def items(self):
+        self._decode()
+        return super().items()
+
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        size = len(self.content or b"")
+        return f"FhirResponse(status_code={self.status_code}, content={size} bytes)"
+
+
+def _require_ijson():
+    if ijson is None:
+        raise ImportError(
+            "Streaming FHIR responses requires the ijson package. "
+            "Install it with: pip install fhir-utils[stream]"
+        )
+
+
+class _BundleStreamParser:
+    """
+    Turn ijson parse events into Bundle entry resources, recording the Bundle links on the way.
+
+    Only the resource being built is held in memory, so the size of the whole Bundle does not
+    matter.
+    """
+
+    def __init__(self):
+        self.links = {}
+        self._link = {}
+        self._builder = None
+
+    def feed(self, prefix: str, event: str, value):
+        """Consume one event, returning a resource once it has been fully parsed"""
+        if self._builder is not None:
+            self._builder.event(event, value)
+            if prefix == ENTRY_RESOURCE_PREFIX and event == "end_map":
+                resource, self._builder = self._builder.value, None
+                return resource
+        elif prefix == ENTRY_RESOURCE_PREFIX and event == "start_map":
+            self._builder = ijson.ObjectBuilder()
+            self._builder.event(event, value)
+        elif prefix in ("link.item.relation", "link.item.url"):
+            self._link[prefix.rsplit(".", 1)[1]] = value
+        elif prefix == "link.item" and event == "end_map":
+            self.links[self._link.get("relation")] = self._link.get("url")
+            self._link = {}
+        return None
+
+
+def stream_bundle_entries(fileobj, links: dict = None) -> Iterator[dict]:
+    """
+    Incrementally yield the entry resources of a Bundle read from a file-like object.
+
+    Args:
+        fileobj: Binary file-like object, such as `requests.Response.raw`.
+        links (dict, optional): Filled with the Bundle links, keyed by relation, as they are
+            parsed. The `next` link is only guaranteed to be present once iteration is over.
+    """
+    _require_ijson()
+    parser = _BundleStreamParser()
+    if links is not None:
+        parser.links = links
+    for prefix, event, value in ijson.parse(fileobj, use_float=True):
+        resource = parser.feed(prefix, event, value)
+        if resource is not None:
+            yield resource
+
+
+class _AsyncByteStream:
+    """Adapt an async iterator of byte chunks to the async `read` interface ijson expects"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks.__aiter__()
+        self._buffer = b""
+
+    async def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+async def astream_bundle_entries(
+        chunks: AsyncIterator[bytes],
+        links: dict = None
+        ) -> AsyncIterator[dict]:
+    """Asynchronous counterpart of `stream_bundle_entries`, reading from byte chunks"""
+    _require_ijson()
+    parser = _BundleStreamParser()
+    if links is not None:
+        parser.links = links
+    async for prefix, event, value in ijson.parse_async(_AsyncByteStream(chunks), use_float=True):
+        resource = parser.feed(prefix, event, value)
+        if resource is not None:
+            yield resource
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry of credentials, authorized sessions and clients.
+
+Loading a service account file, scoping the credentials and opening TLS connections are paid
+once per process instead of once per `HealthcareApi` instance. Access tokens of registered
+credentials are refreshed in a background thread shortly before they expire, so requests rarely
+block on a token refresh.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Hashable
+
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport import requests
+from google.oauth2 import service_account
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+
+def scope_credentials(credentials):
+    """Scope credentials to the Cloud Platform, when the credentials support scoping"""
+    if hasattr(credentials, "with_scopes"):
+        return credentials.with_scopes(SCOPES)
+    return credentials
+
+
+def credentials_key(credentials) -> Hashable:
+    """
+    Identity of the principal behind `credentials`: its service account email, scopes, delegated
+    subject and signing key when it has one, so that fresh copies of the same credentials share a
+    session, else the object itself.
+    """
+    email = getattr(credentials, "service_account_email", None)
+    if isinstance(email, str):
+        scopes = tuple(getattr(credentials, "scopes", None) or SCOPES)
+        subject = getattr(credentials, "_subject", None)
+        key_id = getattr(getattr(credentials, "signer", None), "key_id", None)
+        return (type(credentials).__name__, email, scopes, subject, key_id)
+    return ("object", id(credentials))
+
+
+class _Entry:
+    __slots__ = ("credentials", "scoped_credentials", "session", "lock")
+
+    def __init__(self, credentials, scoped_credentials, session):
+        self.credentials = credentials
+        self.scoped_credentials = scoped_credentials
+        self.session = session
+        self.lock = threading.Lock()
+
+
+class SessionRegistry:
+    """
+    Share scoped credentials, `AuthorizedSession`s and clients across a process.
+
+    Sessions and clients are keyed by `credentials_key`, and only the `max_entries` most recently
+    used of each are kept: callers building fresh credentials for every client do not make the
+    registry grow. Every method is safe to call from multiple threads.
+    """
+
+    def __init__(
+            self,
+            pool_maxsize: int = 32,
+            refresh_margin: timedelta = timedelta(minutes=5),
+            refresh_interval: float = 60.0,
+            max_entries: int = 64,
+            ):
+        """
+        Args:
+            pool_maxsize (int, optional): Connections kept alive per host in each session.
+                Defaults to 32.
+            refresh_margin (timedelta, optional): Refresh tokens expiring within this margin.
+                Defaults to 5 minutes.
+            refresh_interval (float, optional): Seconds between background refresh checks.
+                Defaults to 60.
+            max_entries (int, optional): Sessions, and clients, kept in the registry. The least
+                recently used are evicted first; the clients using them keep working, but are no
+                longer shared nor refreshed in the background. Defaults to 64.
+        """
+        self.pool_maxsize = pool_maxsize
+        self.refresh_margin = refresh_margin
+        self.refresh_interval = refresh_interval
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self._files = {}
+        self._entries = OrderedDict()
+        self._clients = OrderedDict()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def get_credentials(self, credentials_path: str = None):
+        """
+        Load (once) the service account credentials stored at `credentials_path`.
+        Defaults to the file pointed by `GOOGLE_APPLICATION_CREDENTIALS`.
+        """
+        credentials_path = os.path.abspath(
+            credentials_path or os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
+        )
+        with self._lock:
+            if credentials_path not in self._files:
+                self._files[credentials_path] = (
+                    service_account.Credentials.from_service_account_file(credentials_path)
+                )
+            return self._files[credentials_path]
+
+    def _entry(self, credentials) -> _Entry:
+        key = credentials_key(credentials)
+        with self._lock:
+            entry = self._entries.get(key)
+            # Entries keyed by id hold their credentials, so the id is not reused while they are
+            # cached; the check guards against a recycled id all the same.
+            if entry is not None and (key[0] != "object" or entry.credentials is credentials):
+                self._entries.move_to_end(key)
+                return entry
+            scoped_credentials = scope_credentials(credentials)
+            session = requests.AuthorizedSession(scoped_credentials)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            entry = self._entries[key] = _Entry(credentials, scoped_credentials, session)
+            self._entries.move_to_end(key)
+            _evict(self._entries, self.max_entries)
+            self._start_refresher()
+            return entry
+
+    def get_scoped_credentials(self, credentials):
+        """Return the shared scoped copy of `credentials`"""
+        return self._entry(credentials).scoped_credentials
+
+    def get_session(self, credentials) -> requests.AuthorizedSession:
+        """Return the shared, pooled `AuthorizedSession` for `credentials`"""
+        return self._entry(credentials).session
+
+    def get_client(self, cls, project_id: str, location: str, credentials=None, **kwargs):
+        """
+        Return the shared `cls(project_id, location, credentials, **kwargs)` instance.
+
+        Clients are keyed by class, project, location and credentials; `kwargs` are only used
+        when the client is first created. Asynchronous clients are bound to the event loop they
+        are first used in, so only share them within a single loop.
+        """
+        if credentials is None:
+            credentials = self.get_credentials()
+        key = (cls, project_id, location, credentials_key(credentials))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None or (key[3][0] == "object" and client.credentials is not credentials):
+                client = cls(project_id, location, credentials=credentials, **kwargs)
+                self._clients[key] = client
+            self._clients.move_to_end(key)
+            _evict(self._clients, self.max_entries)
+            return client
+
+    def refresh_expiring(self) -> int:
+        """Refresh the tokens expiring within `refresh_margin`, returning how many were refreshed"""
+        with self._lock:
+            entries = list(self._entries.values())
+        refreshed = 0
+        deadline = datetime.utcnow() + self.refresh_margin
+        for entry in entries:
+            credentials = entry.scoped_credentials
+            expiry = getattr(credentials, "expiry", None)
+            if isinstance(credentials, AnonymousCredentials) or (expiry and expiry > deadline):
+                continue
+            with entry.lock:
+                try:
+                    credentials.refresh(requests.Request())
+                    refreshed += 1
+                except Exception as exc:
+                    logger.warning(f"Unable to refresh Healthcare API credentials: {exc}")
+        return refreshed
+
+    def _start_refresher(self):
+        if self._refresher is not None or self.refresh_interval is None:
+            return
+        self._refresher = threading.Thread(
+            target=self._refresh_loop, name="fhir-utils-token-refresher", daemon=True
+        )
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh_expiring()
+
+    def clear(self):
+        """Stop the background refresher and forget every cached object"""
+        self._stop.set()
+        with self._lock:
+            for entry in self._entries.values():
+                entry.session.close()
+            self._files.clear()
+            self._entries.clear()
+            self._clients.clear()
+            self._refresher = None
+        self._stop = threading.Event()
+
+
+def _evict(cache: OrderedDict, max_size: int) -> None:
+    # Evicted sessions are not closed, as clients created from them may still be using them.
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+registry = SessionRegistry()
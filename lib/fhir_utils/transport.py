@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from fhir_utils.exceptions import CircuitOpenError
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    The delay before retry `n` (starting at 0) is a random value between zero and
+    `min(max_backoff, backoff_factor * 2 ** n)`, unless the server asked for a specific delay
+    through the `Retry-After` header.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = 5,
+            backoff_factor: float = 0.5,
+            max_backoff: float = 60.0,
+            retry_statuses: tuple = (429, 500, 502, 503, 504),
+            retry_post: bool = False,
+            ):
+        """
+        Args:
+            max_retries (int, optional): Maximum number of retries per request. Defaults to 5.
+            backoff_factor (float, optional): Base delay in seconds. Defaults to 0.5.
+            max_backoff (float, optional): Maximum delay in seconds. Defaults to 60.
+            retry_statuses (tuple, optional): Status codes that trigger a retry.
+            retry_post (bool, optional): Also retry non-idempotent requests (POST). Only enable
+                it if creating a resource twice is acceptable. Defaults to False.
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.retry_post = retry_post
+
+    def is_retryable(self, method: str) -> bool:
+        """Whether requests with this method may be sent more than once"""
+        return self.retry_post or method.upper() in IDEMPOTENT_METHODS
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """Seconds to wait before retry number `attempt`"""
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+
+def parse_retry_after(value: str) -> float:
+    """Parse a `Retry-After` header, given either in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter allowing `rate` requests per second with bursts up to `capacity`.
+
+    A single instance can be shared by several clients and threads to enforce a common quota.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds the caller must wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests after `failure_threshold` consecutive failures.
+
+    While open, requests fail fast with `CircuitOpenError`. After `reset_timeout` seconds a single
+    trial request is let through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._reset_timed_out():
+                return self.HALF_OPEN
+            return self._state
+
+    def _reset_timed_out(self) -> bool:
+        # Called with the lock held.
+        return self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._reset_timed_out():
+                # Let a single trial request through.
+                self._state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Healthcare API circuit breaker opened.")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_abort(self) -> None:
+        """
+        Record a request that ended without a response to judge, e.g. cancelled or failed with an
+        unexpected exception. A trial request re-opens the circuit, so that another trial follows
+        after `reset_timeout` instead of the circuit staying half-open for good.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class TransportStats:
+    """Thread-safe counters describing the traffic sent through a `Transport`"""
+
+    FIELDS = (
+        "requests",
+        "retries",
+        "throttled",
+        "server_errors",
+        "connection_errors",
+        "rate_limited",
+        "rate_limited_seconds",
+        "circuit_rejections",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def increment(self, field: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[field] += value
+
+    def __getattr__(self, field: str):
+        if field in TransportStats.FIELDS:
+            with self._lock:
+                return self._counters[field]
+        raise AttributeError(field)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def __repr__(self) -> str:
+        return f"TransportStats({self.as_dict()})"
+
+
+class Transport:
+    """
+    Send requests with retries, client-side rate limiting and an optional circuit breaker.
+
+    The same logic backs the synchronous (`send`) and asynchronous (`asend`) clients. Responses
+    only need to expose `status_code` and `headers`, as both `requests` and `httpx` responses do.
+    Once retries are exhausted the last response is returned, so callers keep receiving the
+    `{"status_code", "body"}` dicts they already handle.
+    """
+
+    def __init__(
+            self,
+            retry_policy: RetryPolicy = None,
+            rate_limiter: TokenBucket = None,
+            circuit_breaker: CircuitBreaker = None,
+            ):
+        """
+        Args:
+            retry_policy (RetryPolicy, optional): Retry configuration. Defaults to `RetryPolicy()`.
+            rate_limiter (TokenBucket, optional): Rate limiter shared by the requests.
+            circuit_breaker (CircuitBreaker, optional): Circuit breaker guarding the requests.
+        """
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.stats = TransportStats()
+
+    def _before_attempt(self) -> float:
+        """Check the circuit breaker and return how long the rate limiter asks to wait"""
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+            self.stats.increment("circuit_rejections")
+            raise CircuitOpenError()
+        self.stats.increment("requests")
+        if self.rate_limiter is None:
+            return 0.0
+        wait = self.rate_limiter.reserve()
+        if wait > 0:
+            self.stats.increment("rate_limited")
+            self.stats.increment("rate_limited_seconds", wait)
+        return wait
+
+    def _abort_attempt(self) -> None:
+        """Record an attempt interrupted by an exception that is not retried"""
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_abort()
+
+    def _after_attempt(self, method: str, attempt: int, response=None, exc: Exception = None):
+        """Record the outcome of an attempt and return the delay before retrying, or None"""
+        if exc is not None:
+            self.stats.increment("connection_errors")
+            failed, retryable, retry_after = True, True, None
+        else:
+            status_code = response.status_code
+            if status_code == 429:
+                self.stats.increment("throttled")
+            elif status_code >= 500:
+                self.stats.increment("server_errors")
+            failed = status_code >= 500
+            retryable = status_code in self.retry_policy.retry_statuses
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+        if self.circuit_breaker is not None:
+            if failed:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+        if not retryable:
+            return None
+        if attempt >= self.retry_policy.max_retries or not self.retry_policy.is_retryable(method):
+            return None
+        self.stats.increment("retries")
+        return self.retry_policy.delay(attempt, retry_after)
+
+    def send(
+            self,
+            send: Callable,
+            method: str,
+            url: str,
+            retry_exceptions: tuple = (),
+            **kwargs
+            ):
+        """
+        Call `send(method, url, **kwargs)` until it succeeds or retries are exhausted.
+
+        Exceptions listed in `retry_exceptions` (e.g. connection errors) are retried like server
+        errors, and re-raised once retries are exhausted.
+        """
+        attempt = 0
+        while True:
+            wait = self._before_attempt()
+            try:
+                if wait:
+                    time.sleep(wait)
+                response = send(method, url, **kwargs)
+            except retry_exceptions as exc:
+                delay = self._after_attempt(method, attempt, exc=exc)
+                if delay is None:
+                    raise
+            except BaseException:
+                self._abort_attempt()
+                raise
+            else:
+                delay = self._after_attempt(method, attempt, response)
+                if delay is None:
+                    return response
+                # Release the connection of streamed responses before trying again.
+                response.close()
+            logger.debug(f"Retrying {method} {url} in {delay:.2f}s (attempt {attempt + 1}).")
+            time.sleep(delay)
+            attempt += 1
+
+    async def asend(
+            self,
+            send: Callable[..., Awaitable],
+            method: str,
+            url: str,
+            retry_exceptions: tuple = (),
+            **kwargs
+            ):
+        """Asynchronous counterpart of `send`"""
+        attempt = 0
+        while True:
+            wait = self._before_attempt()
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                response = await send(method, url, **kwargs)
+            except retry_exceptions as exc:
+                delay = self._after_attempt(method, attempt, exc=exc)
+                if delay is None:
+                    raise
+            except BaseException:
+                # Also cancellations, which are not `Exception`s.
+                self._abort_attempt()
+                raise
+            else:
+                delay = self._after_attempt(method, attempt, response)
+                if delay is None:
+                    return response
+                await response.aclose()
+            logger.debug(f"Retrying {method} {url} in {delay:.2f}s (attempt {attempt + 1}).")
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -1,15 +1,31 @@
 # -*- coding: utf-8 -*-
-import json
+import contextlib
+import gzip
+import os
+import queue
+import threading
+from typing import Iterable, Iterator
+
 import xmltodict
 
+from fhir_utils import codec
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
 def json_to_dict(json_file_path):
     try:
-        with open(json_file_path, 'r') as file:
-            data = json.load(file)
+        with open(json_file_path, 'rb') as file:
+            data = codec.loads(file.read())
             return data
     except FileNotFoundError:
         print(f"File '{json_file_path}' not found.")
-    except json.JSONDecodeError:
+    except ValueError:
         print(f"Unable to parse JSON file: '{json_file_path}'.")
     except Exception as e:
         print(f"An error occurred while importing JSON: {e}")
@@ -29,5 +45,145 @@ def xml_to_dict(xml_file_path):
 
 
 def save_to_json(dict, json_path,):
-    with open(json_path, "w") as file:
-        json.dump(dict, file)
\ No newline at end of file
+    with open(json_path, "wb") as file:
+        file.write(codec.dumps(dict))
+
+
+def open_maybe_gzip(path, mode="rb", compress=None):
+    """
+    Open a file, transparently handling gzip.
+
+    When reading, gzip is detected from the file's magic bytes. When writing, it is used if
+    `compress` is True or, when `compress` is None, if the path ends with ".gz".
+    """
+    if "r" in mode:
+        with open(path, "rb") as file:
+            compress = file.read(2) == GZIP_MAGIC
+    elif compress is None:
+        compress = str(path).endswith(".gz")
+    return gzip.open(path, mode) if compress else open(path, mode)
+
+
+def iter_ndjson(ndjson_file_path) -> Iterator[dict]:
+    """Yield the records of a (possibly gzipped) NDJSON file, one line at a time"""
+    with open_maybe_gzip(ndjson_file_path) as file:
+        for line in file:
+            if line.strip():
+                yield codec.loads(line)
+
+
+def write_ndjson(records: Iterable[dict], ndjson_path, compress=None) -> int:
+    """Write records to an NDJSON file, gzipped if the path ends with ".gz". Returns the count."""
+    count = 0
+    with open_maybe_gzip(ndjson_path, "wb", compress) as file:
+        for record in records:
+            file.write(codec.dumps(record) + b"\n")
+            count += 1
+    return count
+
+
+def write_ndjson_chunks(
+        records: Iterable[dict],
+        directory,
+        prefix: str = "chunk",
+        max_records: int = 100_000,
+        max_bytes: int = 1024 ** 3,
+        compress: bool = False
+        ) -> list[str]:
+    """
+    Split records into numbered NDJSON files suitable for the FHIR store `import` operation.
+
+    A new file is started once the current one holds `max_records` records or `max_bytes`
+    uncompressed bytes. Returns the paths of the written files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    extension = ".ndjson.gz" if compress else ".ndjson"
+    paths, file = [], None
+    count = size = 0
+    try:
+        for record in records:
+            line = codec.dumps(record) + b"\n"
+            if file is None or count >= max_records or size + len(line) > max_bytes:
+                if file is not None:
+                    file.close()
+                paths.append(os.path.join(directory, f"{prefix}-{len(paths):05d}{extension}"))
+                file = open_maybe_gzip(paths[-1], "wb", compress)
+                count = size = 0
+            file.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if file is not None:
+            file.close()
+    return paths
+
+
+def iter_json_array(json_file_path, prefix: str = "item") -> Iterator[dict]:
+    """
+    Yield the items of a large JSON document without loading it whole, using ijson.
+
+    `prefix` selects the items to yield: "item" for a top-level array, or e.g.
+    "entry.item.resource" for the resources of a Bundle.
+    """
+    if ijson is None:
+        raise ImportError("iter_json_array requires ijson: pip install fhir-utils[stream]")
+    with open_maybe_gzip(json_file_path) as file:
+        yield from ijson.items(file, prefix, use_float=True)
+
+
+def iter_xml_records(
+        xml_file_path,
+        item_depth: int = 2,
+        buffer_size: int = 1000,
+        **kwargs
+        ) -> Iterator[dict]:
+    """
+    Yield the records of a large XML document as dicts, using xmltodict's streaming mode.
+
+    xmltodict hands each element found at `item_depth` to a callback; the parse runs in a
+    background thread that feeds a bounded queue, so at most `buffer_size` records are held in
+    memory. `xml_file_path` may also be a binary file-like object. Extra keyword arguments are
+    passed to `xmltodict.parse`.
+    """
+    records = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                records.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def parse():
+        try:
+            if hasattr(xml_file_path, "read"):
+                source = contextlib.nullcontext(xml_file_path)
+            else:
+                source = open_maybe_gzip(xml_file_path)
+            with source as file:
+                xmltodict.parse(
+                    file, item_depth=item_depth, item_callback=lambda _, item: put(item), **kwargs
+                )
+        except xmltodict.ParsingInterrupted:
+            pass
+        except Exception as exc:
+            put(exc)
+        put(done)
+
+    thread = threading.Thread(target=parse, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = records.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from argparse import ArgumentParser
+
+from fhir_utils.pipeline import load_converter, run_pipeline
+
+
+def main():
+    """
+    Convert XML/JSON/NDJSON extracts to NDJSON in parallel.
+
+    Usage:
+        poetry run convert extract-*.xml --output patients.ndjson.gz \
+            --converter my_package.converters:to_patient
+    """
+    parser = ArgumentParser(description="Convert source extracts to NDJSON in parallel.")
+    parser.add_argument("inputs", nargs="+", help="Input .xml, .json or .ndjson files.")
+    parser.add_argument("--output", required=True, help="Output NDJSON file (.gz to compress).")
+    parser.add_argument("--converter", help='Record converter, as "module:function".')
+    parser.add_argument("--workers", type=int, help="Number of worker processes.")
+    parser.add_argument("--unordered", action="store_true", help="Write shards as they finish.")
+    parser.add_argument("--max-pending", type=int, help="Maximum shards buffered for writing.")
+    parser.add_argument("--shard-mb", type=int, default=64, help="Shard size in MiB.")
+    parser.add_argument("--json-prefix", default="item", help="ijson prefix of JSON records.")
+    parser.add_argument("--item-depth", type=int, default=2, help="Depth of XML records.")
+    parser.add_argument(
+        "--xml-record-tag", help="Tag of the XML records, to split plain XML files into shards."
+    )
+    args = parser.parse_args()
+
+    if args.converter:
+        # Fail fast on a bad converter instead of inside every worker.
+        load_converter(args.converter)
+    report = run_pipeline(
+        args.inputs,
+        args.output,
+        converter=args.converter,
+        workers=args.workers,
+        ordered=not args.unordered,
+        max_pending=args.max_pending,
+        shard_bytes=args.shard_mb * 1024 ** 2,
+        json_prefix=args.json_prefix,
+        item_depth=args.item_depth,
+        xml_record_tag=args.xml_record_tag,
+    )
+    print(report.as_dict())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+PATH_PATTERN = re.compile(
+    r"^/(?P<version>v1|v1beta1)/projects/[^/]+/locations/[^/]+/datasets/[^/]+/fhirStores/[^/]+/fhir"
+    r"(?:/(?P<resource>[^/]+))?(?:/(?P<resource_id>[^/]+))?$"
+)
+
+
+class StubFhirStore:
+    """In-memory FHIR store answering a small subset of the Healthcare API FHIR endpoints"""
+
+    def __init__(self):
+        self.origin = ""
+        self.resources = {}
+        self.requests = []
+        self.faults = []
+        self.lock = threading.Lock()
+
+    def inject_faults(self, status_code: int, times: int, headers: dict = None):
+        """Answer the next `times` requests with `status_code` instead of handling them"""
+        self.faults.extend([(status_code, headers or {})] * times)
+
+    def _stamp(self, resource_type: str, resource: dict, resource_id: str = None) -> dict:
+        resource = dict(resource)
+        resource["resourceType"] = resource_type
+        resource["id"] = resource_id or resource.get("id") or str(uuid.uuid4())
+        resource["meta"] = {"lastUpdated": datetime.now(timezone.utc).isoformat()}
+        self.resources[(resource_type, resource["id"])] = resource
+        return resource
+
+    def _matches(self, resource: dict, params: list) -> bool:
+        for key, value in params:
+            if key == "identifier":
+                system, _, code = value.rpartition("|")
+                if not any(
+                    identifier.get("system") == system and identifier.get("value") == code
+                    for identifier in resource.get("identifier", [])
+                ):
+                    return False
+            elif key == "_lastUpdated" and value.startswith("gt"):
+                if resource["meta"]["lastUpdated"] <= value[2:]:
+                    return False
+        return True
+
+    def search(self, resource_type: str, params: list) -> list:
+        return [
+            resource
+            for (type_, _), resource in sorted(self.resources.items())
+            if type_ == resource_type and self._matches(resource, params)
+        ]
+
+    def handle(self, method: str, path: str, query: str, body: dict) -> tuple:
+        match = PATH_PATTERN.match(path)
+        if not match:
+            return 404, {"resourceType": "OperationOutcome", "issue": [{"code": "not-found"}]}
+        with self.lock:
+            self.requests.append((method, path, query))
+            if self.faults:
+                status_code, headers = self.faults.pop(0)
+                return status_code, {"resourceType": "OperationOutcome", "issue": []}, headers
+            if method == "POST" and match.group("resource") is None:
+                return self.execute_bundle(path, body)
+            return self._handle_entry(method, path, query, body)
+
+    def _handle_entry(self, method: str, path: str, query: str, body: dict) -> tuple:
+        match = PATH_PATTERN.match(path)
+        resource_type, resource_id = match.group("resource"), match.group("resource_id")
+        params = parse_qsl(query)
+        if method == "POST":
+            return 201, self._stamp(resource_type, body)
+        if method == "PUT" and resource_id:
+            return 200, self._stamp(resource_type, body, resource_id)
+        if method == "PUT":
+            found = self.search(resource_type, params)
+            if len(found) > 1:
+                return 412, {"resourceType": "OperationOutcome", "issue": [{"code": "multiple"}]}
+            resource_id = found[0]["id"] if found else None
+            return 200, self._stamp(resource_type, body, resource_id)
+        if method == "GET" and resource_id:
+            resource = self.resources.get((resource_type, resource_id))
+            if resource is None:
+                return 404, {"resourceType": "OperationOutcome", "issue": [{"code": "not-found"}]}
+            return 200, resource
+        if method == "GET":
+            found = self.search(resource_type, params)
+            query_params = dict(params)
+            offset = int(query_params.pop("_page_token", 0))
+            count = int(query_params.get("_count", 100))
+            bundle = {
+                "resourceType": "Bundle",
+                "type": "searchset",
+                "total": len(found),
+                "link": [],
+                "entry": [{"resource": resource} for resource in found[offset:offset + count]],
+            }
+            if offset + count < len(found):
+                query_params["_page_token"] = offset + count
+                bundle["link"].append(
+                    {"relation": "next", "url": f"{self.origin}{path}?{urlencode(query_params)}"}
+                )
+            return 200, bundle
+        if method == "DELETE":
+            self.resources.pop((resource_type, resource_id), None)
+            return 200, {}
+        return 405, {"resourceType": "OperationOutcome", "issue": [{"code": "not-supported"}]}
+
+    def execute_bundle(self, path: str, bundle: dict) -> tuple:
+        snapshot = dict(self.resources)
+        entries = []
+        for entry in bundle["entry"]:
+            request = entry["request"]
+            url = urlsplit(request["url"])
+            status_code, body = self._handle_entry(
+                request["method"], f"{path}/{url.path}", url.query, entry.get("resource")
+            )
+            if bundle["type"] == "transaction" and status_code >= 400:
+                self.resources = snapshot
+                return status_code, body
+            response = {"status": f"{status_code} {HTTPStatus(status_code).phrase}"}
+            if status_code < 300:
+                entries.append({"response": response, "resource": body})
+            else:
+                entries.append({"response": {**response, "outcome": body}})
+        response_type = f"{bundle['type']}-response"
+        return 200, {"resourceType": "Bundle", "type": response_type, "entry": entries}
+
+
+class StubFhirRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        status_code, payload, *headers = self.server.store.handle(
+            self.command, url.path, url.query, body
+        )
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status_code)
+        for key, value in (headers[0] if headers else {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/fhir+json;charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fhir_server():
+    """Run a stub FHIR server on a random local port, yielding its store and base URLs"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubFhirRequestHandler)
+    server.daemon_threads = True
+    server.store = StubFhirStore()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    host, port = server.server_address
+    server.store.origin = f"http://{host}:{port}"
+    server.base_url = f"http://{host}:{port}/v1"
+    server.base_url_beta = f"http://{host}:{port}/v1beta1"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api_kwargs(fhir_server):
+    """Keyword arguments pointing a Healthcare API client at the stub FHIR server"""
+    return {
+        "credentials": AnonymousCredentials(),
+        "base_url": fhir_server.base_url,
+        "base_url_beta": fhir_server.base_url_beta,
+    }
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from fhir_utils import AsyncFastCRUD, AsyncHealthcareApi
+
+CPF_SYSTEM = "https://rnds-fhir.saude.gov.br/NamingSystem/cpf"
+
+
+def _patient(cpf: str) -> dict:
+    return {"resourceType": "Patient", "identifier": [{"system": CPF_SYSTEM, "value": cpf}]}
+
+
+def test_crud_roundtrip(api_kwargs):
+    async def run():
+        async with AsyncHealthcareApi("project", "location", **api_kwargs) as api:
+            created = await api.create("dataset", "store", "Patient", _patient("1"))
+            assert created["status_code"] == 201
+            resource_id = created["body"]["id"]
+
+            updated = await api.update(
+                "dataset", "store", "Patient", resource_id, {**_patient("1"), "active": False}
+            )
+            assert updated["body"]["active"] is False
+
+            read = await api.read("dataset", "store", "Patient", resource_id)
+            assert read["status_code"] == 200
+            assert read["body"]["id"] == resource_id
+
+            deleted = await api.delete("dataset", "store", "Patient", resource_id)
+            assert deleted["status_code"] == 200
+            missing = await api.read("dataset", "store", "Patient", resource_id)
+            assert missing["status_code"] == 404
+
+    asyncio.run(run())
+
+
+def test_concurrent_requests_share_the_pool(fhir_server, api_kwargs):
+    async def run():
+        async with AsyncFastCRUD("project", "location", max_in_flight=8, **api_kwargs) as api:
+            results = await asyncio.gather(
+                *[
+                    api.patient_update("dataset", "store", str(cpf), _patient(str(cpf)))
+                    for cpf in range(200)
+                ]
+            )
+            assert all(result["status_code"] == 200 for result in results)
+            found = await api.patient_search("dataset", "store", "42")
+            assert found["body"]["total"] == 1
+
+    asyncio.run(run())
+    assert len(fhir_server.store.resources) == 200
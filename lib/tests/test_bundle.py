@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from fhir_utils import AsyncHealthcareApi, BundleBuilder
+from fhir_utils.healthcare_api import HealthcareApi
+
+CPF_SYSTEM = "https://rnds-fhir.saude.gov.br/NamingSystem/cpf"
+
+
+def _patient(cpf: str) -> dict:
+    return {"resourceType": "Patient", "identifier": [{"system": CPF_SYSTEM, "value": cpf}]}
+
+
+def _bundle_requests(fhir_server) -> int:
+    return sum(
+        1 for method, path, _ in fhir_server.store.requests
+        if method == "POST" and path.endswith("/fhir")
+    )
+
+
+def test_batch_maps_results_per_entry(fhir_server, api_kwargs):
+    api = HealthcareApi("project", "location", **api_kwargs)
+    with api.bundle("dataset", "store") as bundle:
+        created = bundle.create("Patient", _patient("1"))
+        updated = bundle.update("Patient", "fixed-id", _patient("2"))
+        upserted = bundle.update_conditional(
+            "Patient", f"identifier={CPF_SYSTEM}|3", _patient("3")
+        )
+        deleted = bundle.delete("Patient", "missing")
+        assert not created.done
+
+    results = [created, updated, upserted, deleted]
+    assert [result.status_code for result in results] == [201, 200, 200, 200]
+    assert created.body["identifier"][0]["value"] == "1"
+    assert updated.body["id"] == "fixed-id"
+    assert upserted.ok and deleted.ok
+    assert _bundle_requests(fhir_server) == 1
+
+
+def test_batch_reports_partial_failures(fhir_server, api_kwargs):
+    api = HealthcareApi("project", "location", **api_kwargs)
+    api.create("dataset", "store", "Patient", _patient("1"))
+    api.create("dataset", "store", "Patient", _patient("1"))
+
+    with api.bundle("dataset", "store") as bundle:
+        ambiguous = bundle.update_conditional(
+            "Patient", f"identifier={CPF_SYSTEM}|1", _patient("1")
+        )
+        created = bundle.create("Patient", _patient("2"))
+
+    assert ambiguous.status_code == 412 and not ambiguous.ok
+    assert ambiguous.body["resourceType"] == "OperationOutcome"
+    assert created.ok
+
+
+def test_transaction_failure_is_reported_on_every_entry(fhir_server, api_kwargs):
+    api = HealthcareApi("project", "location", **api_kwargs)
+    api.create("dataset", "store", "Patient", _patient("1"))
+    api.create("dataset", "store", "Patient", _patient("1"))
+
+    with api.bundle("dataset", "store", bundle_type="transaction") as bundle:
+        results = [
+            bundle.create("Patient", _patient("2")),
+            bundle.update_conditional("Patient", f"identifier={CPF_SYSTEM}|1", _patient("1")),
+        ]
+
+    assert [result.status_code for result in results] == [412, 412]
+    assert len(fhir_server.store.resources) == 2
+
+
+def test_auto_flush_by_entries_and_bytes(fhir_server, api_kwargs):
+    api = HealthcareApi("project", "location", **api_kwargs)
+    flushed = []
+    with api.bundle("dataset", "store", max_entries=10, on_flush=flushed.append) as bundle:
+        for cpf in range(25):
+            bundle.create("Patient", _patient(str(cpf)))
+    assert _bundle_requests(fhir_server) == 3
+    assert [len(results) for results in flushed] == [10, 10, 5]
+    assert all(result.ok for results in flushed for result in results)
+
+    with api.bundle("dataset", "store", max_bytes=300) as bundle:
+        for cpf in range(4):
+            bundle.create("Patient", _patient(str(cpf)))
+    assert _bundle_requests(fhir_server) == 7
+
+
+def test_async_bundle(fhir_server, api_kwargs):
+    async def run():
+        async with AsyncHealthcareApi("project", "location", **api_kwargs) as api:
+            async with api.bundle("dataset", "store", max_entries=2) as bundle:
+                results = [await bundle.create("Patient", _patient(str(cpf))) for cpf in range(3)]
+                assert [result.done for result in results] == [True, True, False]
+        return results
+
+    results = asyncio.run(run())
+    assert [result.status_code for result in results] == [201, 201, 201]
+    assert _bundle_requests(fhir_server) == 2
+
+
+def test_invalid_bundle_type():
+    with pytest.raises(ValueError):
+        BundleBuilder(None, "dataset", "store", bundle_type="history")
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fhir_utils import codec
+from fhir_utils.utils import json_to_dict, save_to_json
+
+PATIENT = {
+    "resourceType": "Patient",
+    "name": [{"text": "José da Silva"}],
+    "birthDate": "1990-01-01",
+    "multipleBirthInteger": 2,
+    "deceasedBoolean": False,
+}
+
+
+def _installed_backends():
+    for name in codec.BACKENDS:
+        try:
+            yield codec.get_codec(name)
+        except ImportError:
+            continue
+
+
+@pytest.mark.parametrize("backend", list(_installed_backends()), ids=lambda backend: backend.name)
+def test_backends_roundtrip(backend):
+    encoded = backend.dumps(PATIENT)
+    assert isinstance(encoded, bytes)
+    assert backend.loads(encoded) == PATIENT
+    assert backend.loads(encoded.decode("utf-8")) == PATIENT
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        codec.get_codec("pickle")
+
+
+def test_set_codec_switches_module_functions():
+    previous = codec.codec
+    try:
+        assert codec.set_codec("json").name == "json"
+        assert codec.dumps({"a": 1}) == b'{"a":1}'
+    finally:
+        codec.codec = previous
+
+
+def test_save_and_load_json(tmp_path):
+    path = tmp_path / "patient.json"
+    save_to_json(PATIENT, path)
+    assert json_to_dict(path) == PATIENT
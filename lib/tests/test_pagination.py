@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from fhir_utils import AsyncFastCRUD, HealthcareApiError
+from fhir_utils.healthcare_api import FastCRUD
+from fhir_utils.pagination import iter_pages
+
+
+def _search_requests(fhir_server) -> int:
+    return sum(1 for method, _, query in fhir_server.store.requests if method == "GET" and query)
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_search_iter_follows_next_links(fhir_server, api_kwargs, prefetch):
+    api = FastCRUD("project", "location", **api_kwargs)
+    for index in range(25):
+        api.update("dataset", "store", "Patient", f"{index:03}", {"resourceType": "Patient"})
+
+    resources = api.search_iter("dataset", "store", "Patient", count=10, prefetch=prefetch)
+    assert [resource["id"] for resource in resources] == [f"{index:03}" for index in range(25)]
+    assert _search_requests(fhir_server) == 3
+
+    recent = api.resource_search_lastupdated_iter(
+        "dataset", "store", "Patient", "1970-01-01T00:00:00", count=7
+    )
+    assert len(list(recent)) == 25
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_async_search_iter_follows_next_links(fhir_server, api_kwargs, prefetch):
+    async def run():
+        async with AsyncFastCRUD("project", "location", **api_kwargs) as api:
+            for index in range(12):
+                await api.update(
+                    "dataset", "store", "Patient", f"{index:03}", {"resourceType": "Patient"}
+                )
+            resources = api.search_iter("dataset", "store", "Patient", count=5, prefetch=prefetch)
+            return [resource["id"] async for resource in resources]
+
+    assert asyncio.run(run()) == [f"{index:03}" for index in range(12)]
+    assert _search_requests(fhir_server) == 3
+
+
+def test_iter_pages_raises_on_error_status():
+    def fetch(url):
+        return {"status_code": 500, "body": {"resourceType": "OperationOutcome"}}
+
+    with pytest.raises(HealthcareApiError) as exc_info:
+        list(iter_pages(fetch, "http://localhost/fhir/Patient"))
+    assert exc_info.value.status_code == 500
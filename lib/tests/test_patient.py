@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from fhir_utils.patient import (
+    BIRTH_PLACE_URL,
+    CNS_SYSTEM,
+    CPF_SYSTEM,
+    ELEMENT,
+    IDENTIFIER,
+    NATIONALITY_URL,
+    PROTECTED_PERSON_URL,
+    RACE_URL,
+    Field,
+    PatientMapper,
+    from_fhir,
+    to_fhir,
+)
+from fhir_utils.pipeline import run_pipeline
+from fhir_utils.utils import iter_ndjson, write_ndjson
+
+PERIOD = {"start": "2020-01-01T00:00:00", "end": None}
+RECORD = {
+    "cpf": "12345678901",
+    "cns": "700000000000001",
+    "data_source_name": "vitacare",
+    "active": True,
+    "name": "Maria José da Conceição",
+    "gender": "female",
+    "birth_date": "1985-03-21",
+    "deceased": False,
+    "mother": "Ana da Conceição",
+    "father": None,
+    "birth_city": "Rio de Janeiro",
+    "birth_state": "Rio de Janeiro",
+    "birth_country": "Brasil",
+    "race": "Parda",
+    "ethnicity": None,
+    "nationality": "B",
+    "naturalization": None,
+    "protected_person": True,
+    "address": [
+        {
+            "use": "home",
+            "type": "physical",
+            "line": "Rua São Clemente, 10",
+            "city": "Rio de Janeiro",
+            "state": "Rio de Janeiro",
+            "country": "Brasil",
+            "postal_code": "22260000",
+            "period": PERIOD,
+        }
+    ],
+    "telecom": [
+        {"system": "phone", "use": "mobile", "value": "21999999999", "rank": 1, "period": None}
+    ],
+}
+
+
+def test_roundtrip():
+    resource = to_fhir(RECORD)
+
+    assert resource["resourceType"] == "Patient"
+    assert resource["identifier"] == [
+        {"system": CPF_SYSTEM, "value": "12345678901"},
+        {"system": CNS_SYSTEM, "value": "700000000000001"},
+    ]
+    assert resource["name"] == [{"text": "Maria José da Conceição"}]
+    assert resource["birthDate"] == "1985-03-21"
+    assert resource["meta"] == {"source": "vitacare"}
+    assert resource["address"][0]["line"] == ["Rua São Clemente, 10"]
+    assert resource["address"][0]["period"] == {"start": "2020-01-01T00:00:00"}
+    assert resource["telecom"] == [
+        {"system": "phone", "use": "mobile", "value": "21999999999", "rank": 1}
+    ]
+    assert [contact["name"]["text"] for contact in resource["contact"]] == ["Ana da Conceição"]
+    # Fields set to None are left out, the birth place fields share their extension.
+    urls = [extension["url"] for extension in resource["extension"]]
+    assert urls == [BIRTH_PLACE_URL, RACE_URL, NATIONALITY_URL, PROTECTED_PERSON_URL]
+    assert resource["deceasedBoolean"] is False
+
+    assert from_fhir(resource) == RECORD
+
+
+def test_from_fhir_reads_resources_of_other_systems():
+    resource = {
+        "resourceType": "Patient",
+        "identifier": [
+            {"system": "urn:other", "value": "1"},
+            {"system": CPF_SYSTEM, "value": "12345678901"},
+            {"system": CPF_SYSTEM, "value": "10987654321"},
+        ],
+        "name": [{"use": "official", "given": ["Maria", "José"], "family": "Silva"}],
+        "address": [{"line": ["Rua São Clemente, 10", "Apto 101"], "city": "Rio de Janeiro"}],
+    }
+
+    record = from_fhir(resource)
+
+    assert record["cpf"] == "12345678901"
+    assert record["cns"] is None
+    assert record["name"] == "Maria José Silva"
+    assert record["address"][0]["line"] == "Rua São Clemente, 10, Apto 101"
+    assert record["telecom"] is None
+    assert set(record) == set(RECORD)
+
+
+def test_custom_fields():
+    mapper = PatientMapper(
+        (Field("cpf", IDENTIFIER, "urn:cpf"), Field("source", ELEMENT, "meta.source"))
+    )
+    resources = mapper.to_fhir_many([{"cpf": "1", "source": "a"}, {"cpf": "2"}])
+
+    assert resources == [
+        {
+            "resourceType": "Patient",
+            "identifier": [{"system": "urn:cpf", "value": "1"}],
+            "meta": {"source": "a"},
+        },
+        {"resourceType": "Patient", "identifier": [{"system": "urn:cpf", "value": "2"}]},
+    ]
+    assert mapper.from_fhir_many(resources) == [
+        {"cpf": "1", "source": "a"},
+        {"cpf": "2", "source": None},
+    ]
+    assert "def to_fhir(record):" in mapper.source
+
+    with pytest.raises(ValueError, match="Unknown field kind"):
+        PatientMapper((Field("cpf", "reference"),))
+
+
+def test_pipeline_converter(tmp_path):
+    write_ndjson([RECORD] * 3, tmp_path / "records.ndjson")
+
+    run_pipeline(
+        [tmp_path / "records.ndjson"],
+        tmp_path / "patients.ndjson",
+        converter="fhir_utils.patient:to_fhir",
+        workers=1,
+    )
+
+    assert list(iter_ndjson(tmp_path / "patients.ndjson")) == [to_fhir(RECORD)] * 3
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from fhir_utils.pipeline import plan_shards, run_pipeline
+from fhir_utils.utils import iter_ndjson, iter_xml_records, write_ndjson
+
+
+def keep_even(record: dict) -> dict:
+    if int(record["cpf"]) % 2:
+        return None
+    return {"resourceType": "Patient", "id": record["cpf"]}
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_pipeline_converts_all_formats(tmp_path, ordered):
+    write_ndjson(({"cpf": str(index)} for index in range(0, 100)), tmp_path / "a.ndjson")
+    (tmp_path / "b.json").write_text(json.dumps([{"cpf": str(index)} for index in range(100, 150)]))
+    rows = "".join(f"<patient><cpf>{index}</cpf></patient>" for index in range(150, 200))
+    (tmp_path / "c.xml").write_text(f"<patients>{rows}</patients>")
+    inputs = [tmp_path / "a.ndjson", tmp_path / "b.json", tmp_path / "c.xml"]
+
+    report = run_pipeline(
+        inputs,
+        tmp_path / "out.ndjson.gz",
+        converter=keep_even,
+        workers=2,
+        ordered=ordered,
+        max_pending=2,
+        shard_bytes=256,
+    )
+
+    ids = [record["id"] for record in iter_ndjson(tmp_path / "out.ndjson.gz")]
+    expected = [str(index) for index in range(0, 200, 2)]
+    assert ids == expected if ordered else sorted(ids, key=int) == expected
+    assert report.records_in == 200
+    assert report.records_out == 100
+    assert report.shards > 3
+
+
+def test_plan_shards_splits_ndjson_on_line_boundaries(tmp_path):
+    path = tmp_path / "a.ndjson"
+    write_ndjson(({"cpf": str(index)} for index in range(1000)), path)
+    shards = plan_shards([path], shard_bytes=1000)
+    assert len(shards) > 1
+
+    report = run_pipeline([path], tmp_path / "out.ndjson", workers=2, shard_bytes=1000)
+    assert [record["cpf"] for record in iter_ndjson(tmp_path / "out.ndjson")] == [
+        str(index) for index in range(1000)
+    ]
+    assert report.records_in == 1000
+
+
+def test_xml_files_are_split_on_record_tags(tmp_path):
+    path = tmp_path / "patients.xml"
+    rows = "".join(
+        f'<patient id="{index}"><cpf>{index}</cpf><patientName>José</patientName></patient>\n'
+        for index in range(300)
+    )
+    path.write_bytes(
+        f'<?xml version="1.0" encoding="ISO-8859-1"?>\n<patients>\n{rows}</patients>\n'.encode(
+            "latin-1"
+        )
+    )
+    assert len(plan_shards([path], shard_bytes=1000, xml_record_tag="patient")) > 10
+
+    report = run_pipeline(
+        [path], tmp_path / "out.ndjson", workers=2, shard_bytes=1000, xml_record_tag="patient"
+    )
+
+    assert list(iter_ndjson(tmp_path / "out.ndjson")) == list(iter_xml_records(path))
+    assert report.records_in == 300
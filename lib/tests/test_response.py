@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+import json
+
+import pytest
+
+from fhir_utils import AsyncHealthcareApi, FhirResponse, HealthcareApiError, codec
+from fhir_utils.healthcare_api import HealthcareApi
+from fhir_utils.response import stream_bundle_entries
+from fhir_utils.transport import RetryPolicy, Transport
+
+
+def test_body_is_decoded_lazily_and_once():
+    response = FhirResponse(200, b'{"resourceType": "Patient"}')
+    assert response._decoded is False
+    assert response["status_code"] == 200
+    assert response._decoded is False
+    assert response["body"] is response.body
+    assert dict(response) == {"status_code": 200, "body": {"resourceType": "Patient"}}
+    assert FhirResponse(204, b"").body is None
+
+
+def test_response_is_a_dict():
+    expected = {"status_code": 200, "body": {"resourceType": "Patient"}}
+    response = FhirResponse(200, b'{"resourceType": "Patient"}')
+    assert isinstance(response, dict)
+    assert json.loads(json.dumps(response)) == expected
+    assert FhirResponse(200, b'{"resourceType": "Patient"}') == expected
+    assert {**FhirResponse(200, b'{"resourceType": "Patient"}')} == expected
+
+
+@pytest.mark.parametrize("backend", ["orjson", "msgspec", "json"])
+def test_response_serializes_with_every_codec(backend):
+    try:
+        dumps = codec.get_codec(backend).dumps
+    except ImportError:
+        pytest.skip(f"{backend} is not installed")
+    expected = {"status_code": 200, "body": {"resourceType": "Patient"}}
+    response = FhirResponse(200, b'{"resourceType": "Patient"}')
+    assert json.loads(dumps(response)) == expected
+    assert json.loads(dumps([response, FhirResponse(204, b"")])) == [
+        expected,
+        {"status_code": 204, "body": None},
+    ]
+    response.body
+    assert json.loads(dumps(response)) == expected
+
+
+def test_delete_does_not_decode_the_body(api_kwargs):
+    api = HealthcareApi("project", "location", **api_kwargs)
+    response = api.delete("dataset", "store", "Patient", "1")
+    assert response.ok
+    assert response._decoded is False
+
+
+def test_stream_bundle_entries_reads_links_after_entries():
+    bundle = {
+        "resourceType": "Bundle",
+        "entry": [
+            {"resource": {"id": str(index), "resource": {"nested": True}, "valueInteger": 1}}
+            for index in range(3)
+        ],
+        "link": [{"relation": "next", "url": "http://next"}],
+    }
+    links = {}
+    resources = list(stream_bundle_entries(io.BytesIO(json.dumps(bundle).encode()), links))
+    assert resources == [entry["resource"] for entry in bundle["entry"]]
+    assert links == {"next": "http://next"}
+
+
+def test_search_stream_follows_next_links(fhir_server, api_kwargs):
+    api = HealthcareApi("project", "location", **api_kwargs)
+    for index in range(25):
+        api.update("dataset", "store", "Patient", f"{index:03}", {"resourceType": "Patient"})
+
+    resources = api.search_stream("dataset", "store", "Patient", count=10)
+    assert [resource["id"] for resource in resources] == [f"{index:03}" for index in range(25)]
+
+
+def test_async_search_stream_follows_next_links(fhir_server, api_kwargs):
+    async def run():
+        async with AsyncHealthcareApi("project", "location", **api_kwargs) as api:
+            for index in range(12):
+                await api.update(
+                    "dataset", "store", "Patient", f"{index:03}", {"resourceType": "Patient"}
+                )
+            return [
+                resource["id"]
+                async for resource in api.search_stream("dataset", "store", "Patient", count=5)
+            ]
+
+    assert asyncio.run(run()) == [f"{index:03}" for index in range(12)]
+
+
+def test_async_search_stream_consumer_may_call_the_api(fhir_server, api_kwargs):
+    async def run():
+        async with AsyncHealthcareApi("project", "location", max_in_flight=1, **api_kwargs) as api:
+            await api.update("dataset", "store", "Patient", "001", {"resourceType": "Patient"})
+            return [
+                (await api.read("dataset", "store", "Patient", resource["id"]))["status_code"]
+                async for resource in api.search_stream("dataset", "store", "Patient")
+            ]
+
+    assert asyncio.run(asyncio.wait_for(run(), timeout=5)) == [200]
+
+
+def test_search_stream_raises_on_error_status(fhir_server, api_kwargs):
+    transport = Transport(retry_policy=RetryPolicy(max_retries=0))
+    api = HealthcareApi("project", "location", transport=transport, **api_kwargs)
+    fhir_server.store.inject_faults(500, times=1)
+    with pytest.raises(HealthcareApiError):
+        list(api.search_stream("dataset", "store", "Patient"))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import threading
+from datetime import datetime, timedelta
+
+from google.auth.credentials import AnonymousCredentials, Credentials
+from google.oauth2 import service_account
+
+from fhir_utils.healthcare_api import FastCRUD, HealthcareApi
+from fhir_utils.sessions import SessionRegistry, registry
+
+
+class CountingCredentials(Credentials):
+    def __init__(self, expires_in: timedelta):
+        super().__init__()
+        self.refreshes = 0
+        self.token = "token"
+        self.expiry = datetime.utcnow() + expires_in
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+def test_clients_share_sessions(api_kwargs):
+    first = HealthcareApi("project", "location", **api_kwargs)
+    second = FastCRUD("project", "other-location", **api_kwargs)
+    assert first.session is second.session
+    assert first.scoped_credentials is second.scoped_credentials
+
+
+def test_shared_clients_are_created_once_across_threads(api_kwargs):
+    clients = []
+
+    def create():
+        clients.append(HealthcareApi.shared("p", "l", **api_kwargs))
+
+    threads = [threading.Thread(target=create) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(client) for client in clients}) == 1
+    assert HealthcareApi.shared("p", "other", **api_kwargs) is not clients[0]
+
+
+def test_refresh_expiring_only_refreshes_tokens_close_to_expiry():
+    sessions = SessionRegistry(refresh_interval=None)
+    expiring = CountingCredentials(timedelta(minutes=1))
+    fresh = CountingCredentials(timedelta(minutes=50))
+    for credentials in (expiring, fresh, AnonymousCredentials()):
+        sessions.get_session(credentials)
+
+    assert sessions.refresh_expiring() == 1
+    assert (expiring.refreshes, fresh.refreshes) == (1, 0)
+    assert sessions.refresh_expiring() == 0
+
+
+def test_registry_clear():
+    credentials = AnonymousCredentials()
+    session = registry.get_session(credentials)
+    registry.clear()
+    assert registry.get_session(credentials) is not session
+
+
+def test_sessions_are_keyed_by_principal_and_evicted():
+    sessions = SessionRegistry(refresh_interval=None, max_entries=2)
+    first, second, other = (
+        service_account.Credentials(None, f"{name}@project.iam.gserviceaccount.com", "uri")
+        for name in ("a", "a", "b")
+    )
+    assert sessions.get_session(first) is sessions.get_session(second)
+    assert sessions.get_session(other) is not sessions.get_session(first)
+
+    for _ in range(3):
+        sessions.get_session(AnonymousCredentials())
+    assert len(sessions._entries) == 2
+
+
+def test_sessions_are_keyed_by_subject_and_signing_key():
+    class Signer:
+        def __init__(self, key_id):
+            self.key_id = key_id
+
+    def credentials(key_id, subject=None):
+        return service_account.Credentials(
+            Signer(key_id), "a@project.iam.gserviceaccount.com", "uri", subject=subject)
+
+    sessions = SessionRegistry(refresh_interval=None)
+    session = sessions.get_session(credentials("key-1"))
+    assert sessions.get_session(credentials("key-1")) is session
+    assert sessions.get_session(credentials("key-2")) is not session
+    assert sessions.get_session(credentials("key-1", subject="user@example.com")) is not session
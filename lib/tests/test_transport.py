@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+import pytest
+
+from fhir_utils import AsyncHealthcareApi
+from fhir_utils.exceptions import CircuitOpenError
+from fhir_utils.healthcare_api import HealthcareApi
+from fhir_utils.transport import (
+    CircuitBreaker,
+    RetryPolicy,
+    TokenBucket,
+    Transport,
+    parse_retry_after,
+)
+
+FAST_RETRIES = RetryPolicy(max_retries=3, backoff_factor=0.001)
+
+
+def test_idempotent_requests_are_retried(fhir_server, api_kwargs):
+    transport = Transport(retry_policy=FAST_RETRIES)
+    api = HealthcareApi("project", "location", transport=transport, **api_kwargs)
+    fhir_server.store.inject_faults(503, times=2)
+    fhir_server.store.inject_faults(429, times=1, headers={"Retry-After": "0"})
+
+    response = api.update("dataset", "store", "Patient", "1", {"resourceType": "Patient"})
+
+    assert response["status_code"] == 200
+    assert transport.stats.retries == 3
+    assert transport.stats.throttled == 1
+    assert transport.stats.server_errors == 2
+
+
+def test_post_is_retried_only_when_opted_in(fhir_server, api_kwargs):
+    transport = Transport(retry_policy=FAST_RETRIES)
+    api = HealthcareApi("project", "location", transport=transport, **api_kwargs)
+    fhir_server.store.inject_faults(503, times=1)
+    assert api.create("dataset", "store", "Patient", {})["status_code"] == 503
+    assert transport.stats.retries == 0
+
+    transport.retry_policy = RetryPolicy(max_retries=3, backoff_factor=0.001, retry_post=True)
+    fhir_server.store.inject_faults(503, times=1)
+    assert api.create("dataset", "store", "Patient", {})["status_code"] == 201
+    assert transport.stats.retries == 1
+
+
+def test_retries_are_bounded(fhir_server, api_kwargs):
+    transport = Transport(retry_policy=FAST_RETRIES)
+    api = HealthcareApi("project", "location", transport=transport, **api_kwargs)
+    fhir_server.store.inject_faults(500, times=10)
+    assert api.read("dataset", "store", "Patient", "1")["status_code"] == 500
+    assert transport.stats.requests == 4
+
+
+def test_circuit_breaker_fails_fast(fhir_server, api_kwargs):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    transport = Transport(retry_policy=RetryPolicy(max_retries=0), circuit_breaker=breaker)
+    api = HealthcareApi("project", "location", transport=transport, **api_kwargs)
+    fhir_server.store.inject_faults(500, times=2)
+    api.read("dataset", "store", "Patient", "1")
+    api.read("dataset", "store", "Patient", "1")
+
+    with pytest.raises(CircuitOpenError):
+        api.read("dataset", "store", "Patient", "1")
+    assert breaker.state == CircuitBreaker.OPEN
+    assert transport.stats.circuit_rejections == 1
+
+    breaker.reset_timeout = 0
+    assert api.read("dataset", "store", "Patient", "1")["status_code"] == 404
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_aborted_trial_request_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    transport = Transport(retry_policy=FAST_RETRIES, circuit_breaker=breaker)
+    breaker.record_failure()
+
+    def fail(method, url):
+        raise ValueError("unexpected")
+
+    with pytest.raises(ValueError):
+        transport.send(fail, "GET", "url")
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    async def cancelled(method, url):
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(transport.asend(cancelled, "GET", "url"))
+    assert breaker.allow()
+
+
+def test_async_client_retries(fhir_server, api_kwargs):
+    async def run():
+        transport = Transport(retry_policy=FAST_RETRIES)
+        api = AsyncHealthcareApi("project", "location", transport=transport, **api_kwargs)
+        async with api:
+            fhir_server.store.inject_faults(502, times=2)
+            response = await api.read("dataset", "store", "Patient", "1")
+        return response, transport
+
+    response, transport = asyncio.run(run())
+    assert response["status_code"] == 404
+    assert transport.stats.retries == 2
+
+
+def test_async_client_releases_the_slot_while_backing_off(fhir_server, api_kwargs):
+    async def run():
+        transport = Transport(retry_policy=FAST_RETRIES)
+        api = AsyncHealthcareApi(
+            "project", "location", transport=transport, max_in_flight=1, **api_kwargs)
+        finished = []
+
+        async def read(resource_id):
+            await api.read("dataset", "store", "Patient", resource_id)
+            finished.append(resource_id)
+
+        async with api:
+            fhir_server.store.inject_faults(503, times=1, headers={"Retry-After": "1"})
+            await asyncio.gather(read("retried"), read("other"))
+        return finished
+
+    assert asyncio.run(run()) == ["other", "retried"]
+
+
+def test_token_bucket_is_shared_across_threads():
+    bucket = TokenBucket(rate=100, capacity=10)
+    waits = []
+
+    def worker():
+        waits.extend(bucket.reserve() for _ in range(10))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(1 for wait in waits if wait == 0) == 10
+    assert max(waits) == pytest.approx(0.3, abs=0.05)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
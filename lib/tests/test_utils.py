@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from fhir_utils.utils import (
+    iter_json_array,
+    iter_ndjson,
+    iter_xml_records,
+    write_ndjson,
+    write_ndjson_chunks,
+)
+
+RECORDS = [{"resourceType": "Patient", "id": str(index)} for index in range(10)]
+
+
+@pytest.mark.parametrize("filename", ["patients.ndjson", "patients.ndjson.gz"])
+def test_ndjson_roundtrip(tmp_path, filename):
+    path = tmp_path / filename
+    assert write_ndjson(iter(RECORDS), path) == 10
+    assert list(iter_ndjson(path)) == RECORDS
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_write_ndjson_chunks(tmp_path, compress):
+    directory = tmp_path / "import"
+    paths = write_ndjson_chunks(iter(RECORDS), directory, max_records=4, compress=compress)
+    assert len(paths) == 3
+    assert [record for path in paths for record in iter_ndjson(path)] == RECORDS
+
+
+def test_iter_json_array(tmp_path):
+    path = tmp_path / "bundle.json"
+    path.write_text(json.dumps({"entry": [{"resource": record} for record in RECORDS]}))
+    assert list(iter_json_array(path, "entry.item.resource")) == RECORDS
+
+
+def test_iter_xml_records(tmp_path):
+    path = tmp_path / "patients.xml"
+    rows = "".join(f"<patient><cpf>{index}</cpf></patient>" for index in range(50))
+    path.write_text(f"<patients>{rows}</patients>")
+
+    assert [record["cpf"] for record in iter_xml_records(path, buffer_size=3)] == [
+        str(index) for index in range(50)
+    ]
+
+    records = iter_xml_records(path, buffer_size=3)
+    assert next(records) == {"cpf": "0"}
+    records.close()
+
+
+def test_iter_xml_records_raises_parse_errors(tmp_path):
+    path = tmp_path / "broken.xml"
+    path.write_text("<patients><patient></patients>")
+    with pytest.raises(Exception):
+        list(iter_xml_records(path))